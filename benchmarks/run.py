@@ -0,0 +1,361 @@
+"""
+Benchmarks for the hot paths of pyramid_es: document serialization, query
+building, result wrapping and sending the transactional write queue.
+
+Run from the top level of the repo::
+
+    $ python benchmarks/run.py
+
+Each benchmark reports the best time per operation over several runs and the
+peak memory allocated by one operation, and is compared to the stored
+baseline (``benchmarks/baseline.json``). The script exits with status 1 when
+a benchmark is slower, or allocates more, than the baseline allows: times may
+exceed it by ``TIME_TOLERANCE``, plus a noise floor of a few microseconds
+which matters for the fastest operations only. Timings
+depend on the machine: refresh the baseline with ``--save`` when changing
+machines, and when a change is expected to move the numbers.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import timeit
+
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import transaction  # noqa
+from sqlalchemy import Column, types  # noqa
+from sqlalchemy.ext.declarative import declarative_base  # noqa
+
+from pyramid_es.client import ElasticClient  # noqa
+from pyramid_es.dotdict import DotDict  # noqa
+from pyramid_es.mixin import (ElasticMixin, ESMapping, ESString,  # noqa
+                              ESField)
+from pyramid_es.result import ElasticResult  # noqa
+
+from stub import StubServer, canned_search  # noqa
+
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+# The absolute slowdown, in seconds per operation, always allowed.
+NOISE_FLOOR = 2e-6
+# The minimum duration of a timing run, in seconds: operations are run more
+# than ``number`` times if needed.
+MIN_RUN_TIME = 0.2
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(number, noise=NOISE_FLOOR):
+    """
+    Register a benchmark. The decorated function sets it up and returns the
+    operation to measure, which is run at least ``number`` times per timing
+    run. Slowdowns of less than ``noise`` seconds per operation are ignored.
+    """
+    def register(f):
+        BENCHMARKS[f.__name__[len('bench_'):]] = (f, number, noise)
+        return f
+    return register
+
+
+Base = declarative_base()
+
+
+class Movie(Base, ElasticMixin):
+    __tablename__ = 'movies'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+    director = Column(types.Unicode(40))
+    year = Column(types.Integer)
+    rating = Column(types.Numeric)
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('title', boost=5.0),
+                ESString('director'),
+                ESField('year'),
+                ESField('rating')))
+
+
+class Node(object):
+
+    def __init__(self, depth, width):
+        self.id = depth
+        for ii in range(width):
+            setattr(self, 'field%d' % ii, 'value %d' % ii)
+        self.child = Node(depth - 1, width) if depth > 1 else None
+
+
+def nested_mapping(depth, width):
+    fields = [ESField('field%d' % ii) for ii in range(width)]
+    if depth > 1:
+        return ESMapping(*fields,
+                         child=ESMapping(
+                             attr='child',
+                             properties=nested_mapping(depth - 1, width)))
+    return ESMapping(*fields)
+
+
+@benchmark(number=2000)
+def bench_mapping_flat():
+    mapping = ESMapping(properties=nested_mapping(1, 30))
+    node = Node(1, 30)
+    return lambda: mapping(node)
+
+
+@benchmark(number=1000)
+def bench_mapping_nested():
+    mapping = ESMapping(properties=nested_mapping(5, 6))
+    node = Node(5, 6)
+    return lambda: mapping(node)
+
+
+@benchmark(number=2000)
+def bench_mapping_compiled_nested():
+    serialize = ESMapping(properties=nested_mapping(5, 6)).compile()
+    node = Node(5, 6)
+    return lambda: serialize(node)
+
+
+def _client(url='http://localhost:9200'):
+    return ElasticClient(servers=[url], index='pyramid_es_bench')
+
+
+@benchmark(number=2000)
+def bench_query_chain():
+    client = _client()
+
+    def build():
+        return (client.query(Movie, q='kittens')
+                .filter_term('director', 'Spielberg')
+                .filter_terms('year', [1980, 1981, 1982])
+                .filter_value_lower('rating', 3)
+                .filter_value_upper('rating', 5)
+                .add_term_aggregate('directors', 'director')
+                .order_by('year', desc=True)
+                .order_by('title')
+                .offset(20)
+                .limit(10))
+    return build
+
+
+@benchmark(number=5000)
+def bench_search_body():
+    client = _client()
+    q = (client.query(Movie, q='kittens')
+         .filter_term('director', 'Spielberg')
+         .filter_terms('year', [1980, 1981, 1982])
+         .add_term_aggregate('directors', 'director')
+         .order_by('year', desc=True)
+         .limit(10))
+
+    def build():
+        body, params = q._search_params()
+        return client._search_kwargs(body, q.classes, **params)
+    return build
+
+
+@benchmark(number=5)
+def bench_result_10k():
+    raw = canned_search(10000)
+
+    def wrap():
+        return [(record.title, record._source.director.name)
+                for record in ElasticResult(raw)]
+    return wrap
+
+
+@benchmark(number=5)
+def bench_result_10k_eager():
+    raw = canned_search(10000)
+
+    def wrap():
+        return [(record.title, record._source.director.name)
+                for record in ElasticResult(raw, lazy=False)]
+    return wrap
+
+
+@benchmark(number=5)
+def bench_dotdict_10k():
+    raw = canned_search(10000)
+    return lambda: DotDict(raw)
+
+
+def _commit(stub, enqueue):
+    client = _client(stub.url)
+
+    def commit():
+        with transaction.manager:
+            enqueue(client)
+    return commit
+
+
+@benchmark(number=3)
+def bench_tpc_finish_documents(stub):
+    docs = [{'title': 'Movie %d' % ii, 'year': 1950 + ii % 70}
+            for ii in range(5000)]
+
+    def enqueue(client):
+        for ii, doc in enumerate(docs):
+            client.index_document(id=ii, doc_type='Movie', doc=doc)
+    return _commit(stub, enqueue)
+
+
+@benchmark(number=3)
+def bench_tpc_finish_objects(stub):
+    movies = [Movie(id=ii, title='Movie %d' % ii, director='Director',
+                    year=1950 + ii % 70) for ii in range(5000)]
+
+    def enqueue(client):
+        for movie in movies:
+            client.index_object(movie)
+    return _commit(stub, enqueue)
+
+
+def measure(op, number, repeat):
+    """
+    Return the best time per operation in seconds, and the peak memory
+    allocated by one operation in bytes (None without tracemalloc).
+    """
+    op()
+    timer = timeit.Timer(op)
+    # Run fast operations enough times for a timing run to last
+    # MIN_RUN_TIME.
+    elapsed = timer.timeit(number=1)
+    if elapsed * number < MIN_RUN_TIME:
+        number = int(MIN_RUN_TIME / max(elapsed, 1e-9)) + 1
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            op()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def compare(name, result, baseline, time_tolerance, memory_tolerance,
+            noise=NOISE_FLOOR):
+    """
+    Return a list of regressions of ``result`` against ``baseline``.
+    """
+    regressions = []
+    if not baseline:
+        return regressions
+    if result['time'] > baseline['time'] * (1 + time_tolerance) + noise:
+        regressions.append('%s: time %.3gs > baseline %.3gs' %
+                           (name, result['time'], baseline['time']))
+    if (result['peak'] is not None and baseline.get('peak') is not None and
+            result['peak'] > baseline['peak'] * (1 + memory_tolerance)):
+        regressions.append('%s: peak memory %d > baseline %d' %
+                           (name, result['peak'], baseline['peak']))
+    return regressions
+
+
+def format_ratio(value, reference):
+    if not reference or value is None:
+        return '-'
+    return '%.2fx' % (value / reference)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='timing runs per benchmark (default: 7)')
+    parser.add_argument('--time-tolerance', type=float,
+                        default=TIME_TOLERANCE,
+                        help='allowed slowdown (default: %(default)s)')
+    parser.add_argument('--memory-tolerance', type=float,
+                        default=MEMORY_TOLERANCE,
+                        help='allowed memory increase (default: '
+                        '%(default)s)')
+    args = parser.parse_args(argv)
+
+    # The client logs the transaction lifecycle: keep it off the output.
+    log = logging.getLogger('pyramid_es')
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    names = args.names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+
+    results = OrderedDict()
+    regressions = []
+    print('%-28s %12s %8s %12s %8s' % ('benchmark', 'time', 'vs base',
+                                       'peak', 'vs base'))
+    with StubServer() as stub:
+        for name in names:
+            setup, number, noise = BENCHMARKS[name]
+            if setup.__code__.co_argcount:
+                op = setup(stub)
+            else:
+                op = setup()
+            best, peak = measure(op, number, args.repeat)
+            results[name] = result = {'time': best, 'peak': peak}
+            reference = baseline.get(name, {})
+            print('%-28s %10.1fus %8s %12s %8s' % (
+                name, best * 1e6,
+                format_ratio(best, reference.get('time')),
+                '-' if peak is None else '%dk' % (peak // 1024),
+                format_ratio(peak, reference.get('peak'))))
+            regressions.extend(compare(name, result, reference,
+                                       args.time_tolerance,
+                                       args.memory_tolerance, noise))
+
+    if args.save:
+        if args.names:
+            merged = dict(baseline)
+            merged.update(results)
+            results = merged
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'benchmarks': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved baseline to %s' % args.baseline)
+        return 0
+
+    if regressions:
+        print()
+        print('Regressions:')
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
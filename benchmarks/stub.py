@@ -0,0 +1,121 @@
+"""
+An in-process HTTP server answering Elasticsearch requests with canned
+responses, so that benchmarks include the cost of serializing requests and
+parsing responses without depending on a running cluster.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def canned_search(num_hits, doc_type='Movie'):
+    """
+    Return a search response with ``num_hits`` hits, each with a nested
+    source document.
+    """
+    hits = [{'_index': 'pyramid_es_bench',
+             '_type': doc_type,
+             '_id': str(ii),
+             '_score': 1.0,
+             '_source': {'title': 'Movie %d' % ii,
+                         'year': 1950 + ii % 70,
+                         'director': {'name': 'Director %d' % (ii % 100),
+                                      'born': {'year': 1900 + ii % 80}},
+                         'tags': ['tag%d' % (ii % 7), 'tag%d' % (ii % 11)]},
+             'sort': [1950 + ii % 70, str(ii)]}
+            for ii in range(num_hits)]
+    return {'took': 3,
+            'timed_out': False,
+            'hits': {'total': num_hits, 'max_score': 1.0, 'hits': hits}}
+
+
+def _bulk_response(body):
+    items = []
+    for line in body.splitlines():
+        action = json.loads(line)
+        op = next(iter(action))
+        if op in ('index', 'delete', 'create', 'update'):
+            meta = action[op]
+            items.append({op: {'_index': meta.get('_index'),
+                               '_type': meta.get('_type'),
+                               '_id': meta.get('_id'),
+                               'status': 200}})
+    return {'took': 1, 'errors': False, 'items': items}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/_bulk'):
+            self._respond(_bulk_response(body))
+        elif path.endswith('/_search'):
+            self._respond(self.server.search_response)
+        elif not path:
+            self._respond({'version': {'number': '1.7.0'},
+                           'tagline': 'You Know, for Search'})
+        else:
+            self._respond({'acknowledged': True})
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """
+    Serve canned ES responses on a local port from a background thread.
+    Search requests are answered with ``search_response``, and bulk requests
+    with a successful item for each action.
+    """
+
+    def __init__(self, search_response=None):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.search_response = (search_response or
+                                       canned_search(10))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server.server_address
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,13 +1,45 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from pyramid.settings import asbool
+from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool, aslist
+from pyramid.tweens import INGRESS
+from sqlalchemy import MetaData
 
+from .autoindex import SessionIndexer
+from .background import BackgroundIndexer
 from .client import ElasticClient
+from .digest import DocumentDigestStore, MemoryDigestStore
+from .outbox import ElasticOutbox, outbox_table
+from .cache import ResultCache
 
 
 __version__ = '0.3.2.dev'
 
 
+def _servers(value):
+    """
+    Parse a list of servers, separated by whitespace or commas.
+    """
+    return [server for item in aslist(value)
+            for server in item.split(',') if server]
+
+
+#: Transport options read by :py:func:`client_from_config`, with the
+#: functions parsing their settings.
+TRANSPORT_SETTINGS = {
+    'timeout': float,
+    'maxsize': int,
+    'http_compress': asbool,
+    'sniff_on_start': asbool,
+    'sniff_on_connection_fail': asbool,
+    'sniffer_timeout': float,
+    'retry_on_timeout': asbool,
+    'max_retries': int,
+    'dead_node_backoff': float,
+    'connection_class': DottedNameResolver().maybe_resolve,
+}
+
+
 def client_from_config(settings, prefix='elastic.'):
     """
     Instantiate and configure an Elasticsearch from settings.
@@ -16,12 +48,58 @@ def client_from_config(settings, prefix='elastic.'):
     include ``pyramid_es`` and use the :py:func:`get_client` function to get
     access to the shared :py:class:`.client.ElasticClient` instance.
     """
-    return ElasticClient(
-        servers=settings.get(prefix + 'servers', ['localhost:9200']),
-        timeout=settings.get(prefix + 'timeout', 1.0),
+    cache = None
+    cache_size = int(settings.get(prefix + 'cache_size', 0))
+    if cache_size:
+        ttl = settings.get(prefix + 'cache_ttl', 60)
+        cache = ResultCache(
+            max_size=cache_size,
+            ttl=float(ttl) if ttl else None,
+            refresh_interval=float(settings.get(
+                prefix + 'cache_refresh_interval', 1)))
+
+    transport_options = {}
+    for name, parse in TRANSPORT_SETTINGS.items():
+        value = settings.get(prefix + name)
+        if value not in (None, ''):
+            transport_options[name] = parse(value)
+
+    client = ElasticClient(
+        servers=_servers(settings.get(prefix + 'servers', 'localhost:9200')),
         index=settings[prefix + 'index'],
         use_transaction=asbool(settings.get(prefix + 'use_transaction', True)),
-        disable_indexing=settings.get(prefix + 'disable_indexing', False))
+        disable_indexing=asbool(settings.get(prefix + 'disable_indexing',
+                                             False)),
+        cache=cache,
+        **transport_options)
+
+    if asbool(settings.get(prefix + 'background')):
+        put_timeout = settings.get(prefix + 'background_put_timeout')
+        client.background = BackgroundIndexer(
+            client,
+            max_queue=int(settings.get(prefix + 'background_queue_size', 100)),
+            put_timeout=float(put_timeout) if put_timeout else None,
+            drain_timeout=float(settings.get(
+                prefix + 'background_drain_timeout', 30)))
+
+    session = settings.get(prefix + 'outbox_session')
+    if session:
+        client.outbox = ElasticOutbox(
+            DottedNameResolver().maybe_resolve(session),
+            table=outbox_table(MetaData(), settings.get(
+                prefix + 'outbox_table', 'pyramid_es_outbox')))
+
+    digests = settings.get(prefix + 'digests')
+    if digests == 'memory':
+        client.digests = MemoryDigestStore(max_size=int(settings.get(
+            prefix + 'digest_cache_size', 100000)))
+    elif digests == 'document':
+        client.digests = DocumentDigestStore(client, field=settings.get(
+            prefix + 'digest_field', 'pyramid_es_digest'))
+    elif digests:
+        # A factory taking the client.
+        client.digests = DottedNameResolver().maybe_resolve(digests)(client)
+    return client
 
 
 def includeme(config):
@@ -34,6 +112,20 @@ def includeme(config):
 
     registry.pyramid_es_client = client
 
+    session = settings.get('elastic.autoindex_session')
+    if session:
+        indexer = SessionIndexer(client)
+        indexer.listen(DottedNameResolver().maybe_resolve(session))
+        registry.pyramid_es_session_indexer = indexer
+
+    if asbool(settings.get('elastic.request_scope')):
+        config.add_tween('pyramid_es.tweens.request_scope_tween_factory')
+
+    if asbool(settings.get('elastic.instrument')):
+        # Outermost, so that writes sent on commit by pyramid_tm are included.
+        config.add_tween('pyramid_es.tweens.instrument_tween_factory',
+                         under=INGRESS)
+
 
 def get_client(request):
     """
@@ -0,0 +1,235 @@
+"""
+asyncio support: an ``AsyncElasticClient`` with awaitable search, get and
+bulk indexing methods, built on the asynchronous Elasticsearch transport.
+
+This module requires Python 3.6 or later, and an elasticsearch package with
+asyncio support (``elasticsearch[async]``, or ``elasticsearch-async`` for older
+releases).
+"""
+import asyncio
+import logging
+
+from elasticsearch.exceptions import NotFoundError
+
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:  # pragma: no cover
+    from elasticsearch_async import AsyncElasticsearch
+
+from .client import (ElasticClient, ElasticBulkError, BULK_CHUNK_SIZE,
+                     BULK_MAX_CHUNK_BYTES, transport_kwargs)
+from .query import ElasticQuery, SCROLL_BATCH_SIZE, SCROLL_TIMEOUT
+from .result import ElasticResultRecord
+
+log = logging.getLogger(__name__)
+
+
+class AsyncElasticQuery(ElasticQuery):
+    """
+    An :py:class:`.query.ElasticQuery` whose execution methods are
+    coroutines. The query itself is built exactly the same way.
+    """
+
+    async def execute(self, start=None, size=None, fields=None):
+        """
+        Execute this query and return a result set.
+        """
+        body, params = self._search_params(start=start, size=size)
+        raw = await self.client.search(body, classes=self.classes,
+                                       fields=fields, **params)
+        return self._result(raw, size=size)
+
+    async def count(self):
+        """
+        Execute this query to determine the number of documents that would be
+        returned, but do not actually fetch documents. Returns an int.
+        """
+        body, params = self._search_params(size=0)
+        raw = await self.client.search(body, classes=self.classes, **params)
+        return raw['hits']['total']
+
+    async def iterate(self, batch_size=SCROLL_BATCH_SIZE,
+                      scroll=SCROLL_TIMEOUT, fields=None):
+        """
+        Asynchronously iterate over all the documents matched by this query
+        using the scroll API, like :py:meth:`.query.ElasticQuery.iterate`.
+
+        Garbage collection of an asynchronous generator can't await the
+        release of the scroll context, so when not exhausting the iterator,
+        close it explicitly with ``aclose()``.
+        """
+        raw = await self.client.search(self._scroll_body(),
+                                       classes=self.classes, fields=fields,
+                                       size=batch_size, scroll=scroll)
+        scroll_id = raw.get('_scroll_id')
+        window = self._scroll_window()
+        try:
+            while raw['hits']['hits']:
+                for hit in raw['hits']['hits']:
+                    keep = window(hit)
+                    if keep is None:
+                        return
+                    if keep:
+                        yield ElasticResultRecord(hit)
+                raw = await self.client.scroll(scroll_id, scroll=scroll)
+                scroll_id = raw.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                await self.client.clear_scroll(scroll_id)
+    scan = iterate
+
+
+class AsyncElasticClient(object):
+    """
+    An asyncio counterpart of :py:class:`.client.ElasticClient`, for
+    searching and indexing. Writes are performed immediately: they are not
+    tied to a transaction. Index and mapping management is left to the
+    synchronous client.
+    """
+
+    def __init__(self, servers, index, disable_indexing=False,
+                 **transport_options):
+        self.index = index
+        self.disable_indexing = disable_indexing
+        self.es = AsyncElasticsearch(servers,
+                                     **transport_kwargs(transport_options))
+
+    # Request building is shared with the synchronous client.
+    subtype_names = ElasticClient.subtype_names
+    _search_kwargs = ElasticClient._search_kwargs
+    _get_kwargs = ElasticClient._get_kwargs
+    _object_document = ElasticClient._object_document
+    _index_document_action = ElasticClient._index_document_action
+    _delete_document_action = ElasticClient._delete_document_action
+    _index_object_action = ElasticClient._index_object_action
+    _delete_object_action = ElasticClient._delete_object_action
+    _bulk_chunks = ElasticClient._bulk_chunks
+    _bulk_failures = ElasticClient._bulk_failures
+    _bulk_errors = ElasticClient._bulk_errors
+
+    async def close(self):
+        """
+        Close the connections of the underlying transport.
+        """
+        await self.es.close()
+
+    async def search(self, body, classes=None, fields=None, **query_params):
+        """
+        Run ES search using default indexes.
+        """
+        return await self.es.search(**self._search_kwargs(body, classes,
+                                                          fields,
+                                                          **query_params))
+
+    async def scroll(self, scroll_id, scroll):
+        """
+        Fetch the next batch of results for a scrolled search.
+        """
+        return await self.es.scroll(scroll_id=scroll_id, scroll=scroll)
+
+    async def clear_scroll(self, scroll_id):
+        """
+        Release the server-side context of a scrolled search.
+        """
+        try:
+            await self.es.clear_scroll(scroll_id=scroll_id)
+        except NotFoundError:
+            pass
+
+    async def get(self, obj, routing=None):
+        """
+        Retrieve the ES source document for a given object or (document type,
+        id) pair.
+        """
+        r = await self.es.get(**self._get_kwargs(obj, routing))
+        return ElasticResultRecord(r)
+
+    async def _send_bulk_chunk(self, chunk, lines):
+        resp = await self.es.bulk(body='\n'.join(lines) + '\n')
+        return len(chunk), self._bulk_errors(chunk, resp)
+
+    async def bulk(self, actions, chunk_size=BULK_CHUNK_SIZE,
+                   max_chunk_bytes=BULK_MAX_CHUNK_BYTES, concurrency=1,
+                   raise_on_error=True):
+        """
+        Send an iterable of bulk actions, like
+        :py:meth:`.client.ElasticClient.bulk`. Up to ``concurrency`` bulk
+        requests are in flight at once.
+
+        Returns a ``(succeeded, errors)`` tuple.
+        """
+        if self.disable_indexing:
+            return 0, []
+
+        succeeded = 0
+        errors = []
+        pending = set()
+
+        def collect(done):
+            nonlocal succeeded
+            for task in done:
+                sent, chunk_errors = task.result()
+                succeeded += sent - len(chunk_errors)
+                errors.extend(chunk_errors)
+
+        try:
+            for chunk, lines in self._bulk_chunks(actions, chunk_size,
+                                                  max_chunk_bytes):
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+                pending.add(asyncio.ensure_future(
+                    self._send_bulk_chunk(chunk, lines)))
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                collect(done)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if errors and raise_on_error:
+            raise ElasticBulkError(errors)
+        return succeeded, errors
+
+    async def _bulk_objects(self, actions, chunk_size, max_chunk_bytes,
+                            concurrency):
+        succeeded, errors = await self.bulk(actions,
+                                            chunk_size=chunk_size,
+                                            max_chunk_bytes=max_chunk_bytes,
+                                            concurrency=concurrency,
+                                            raise_on_error=False)
+        for error in errors:
+            log.warning('Bulk action failed: %r', error)
+        return succeeded, len(errors)
+
+    async def index_objects(self, objects, chunk_size=BULK_CHUNK_SIZE,
+                            max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                            concurrency=1):
+        """
+        Add multiple objects to the index, in bulk. Returns a ``(succeeded,
+        failed)`` tuple of counts.
+        """
+        actions = (self._index_object_action(obj) for obj in objects)
+        return await self._bulk_objects(actions, chunk_size, max_chunk_bytes,
+                                        concurrency)
+
+    async def delete_objects(self, objects, safe=False,
+                             chunk_size=BULK_CHUNK_SIZE,
+                             max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                             concurrency=1):
+        """
+        Delete the indexed documents for multiple objects, in bulk. Returns a
+        ``(succeeded, failed)`` tuple of counts.
+        """
+        actions = (self._delete_object_action(obj, safe=safe)
+                   for obj in objects)
+        return await self._bulk_objects(actions, chunk_size, max_chunk_bytes,
+                                        concurrency)
+
+    def query(self, *classes, **kw):
+        """
+        Return an AsyncElasticQuery against the specified class.
+        """
+        cls = kw.pop('cls', AsyncElasticQuery)
+        return cls(client=self, classes=classes, **kw)
@@ -0,0 +1,141 @@
+"""
+Automatic indexing of the objects written through SQLAlchemy sessions.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import logging
+
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm.util import identity_key
+
+from .mixin import ElasticMixin
+
+log = logging.getLogger(__name__)
+
+_PENDING_KEY = 'pyramid_es_pending'
+
+
+class SessionIndexer(object):
+    """
+    Indexes the :py:class:`.mixin.ElasticMixin` objects which are added,
+    modified or deleted through the sessions it listens to, as if
+    ``client.index_object()`` or ``client.delete_object()`` were called for
+    each of them. Set it up with the ``elastic.autoindex_session`` setting,
+    or with :py:meth:`listen`.
+
+    When a session is flushed, only the class, ID and parent ID of these
+    objects are recorded. Before a transaction in which the session was used
+    commits, the session is flushed one last time, the objects to index are
+    loaded with one query per class (unless they are still in the session),
+    and their writes are queued, to be sent in one bulk request by the
+    client.
+
+    The client must use transactions (``use_transaction``), and the sessions
+    must take part in the transactions of its transaction manager, as with
+    ``zope.sqlalchemy``. ``classes`` limits indexing to instances of these
+    classes.
+    """
+
+    def __init__(self, client, classes=None):
+        self.client = client
+        self.classes = tuple(classes) if classes else (ElasticMixin,)
+        self.objects = 0
+
+    def listen(self, session):
+        """
+        Listen to the flushes of a session, which can also be a session
+        class, ``sessionmaker`` or ``scoped_session``.
+        """
+        event.listen(session, 'after_begin', self.after_begin)
+        event.listen(session, 'after_attach', self.after_attach)
+        event.listen(session, 'after_flush', self.after_flush)
+
+    def _pending(self, session):
+        """
+        Return the writes recorded for the session in the current
+        transaction, registering the hook which queues them if needed. This
+        is done as soon as the session is used, since it is usually only
+        flushed by the commit, once before-commit hooks have run.
+        """
+        txn = self.client.transaction_manager.get()
+        recorded = session.info.get(_PENDING_KEY)
+        if recorded is None or recorded[0] is not txn:
+            recorded = session.info[_PENDING_KEY] = (txn, OrderedDict())
+            txn.addBeforeCommitHook(self.before_commit, (session, txn))
+        return recorded[1]
+
+    def _indexed(self, obj):
+        return isinstance(obj, self.classes)
+
+    def after_begin(self, session, transaction, connection):
+        self._pending(session)
+
+    def after_attach(self, session, instance):
+        if self._indexed(instance):
+            self._pending(session)
+
+    def after_flush(self, session, flush_context):
+        new = [obj for obj in session.new if self._indexed(obj)]
+        dirty = [obj for obj in session.dirty
+                 if self._indexed(obj) and session.is_modified(obj)]
+        deleted = [obj for obj in session.deleted if self._indexed(obj)]
+        if not (new or dirty or deleted):
+            return
+        pending = self._pending(session)
+        for op, objs in (('index', new), ('index', dirty),
+                         ('delete', deleted)):
+            for obj in objs:
+                key = (type(obj), obj.id)
+                pending.pop(key, None)
+                pending[key] = (op, obj.elastic_parent)
+
+    def before_commit(self, session, txn):
+        # Changes made since the last flush are flushed by the commit, too
+        # late to be recorded.
+        session.flush()
+        recorded = session.info.pop(_PENDING_KEY, None)
+        if recorded is None or recorded[0] is not txn:
+            return
+        pending = recorded[1]
+
+        to_index = OrderedDict()
+        for (cls, id), (op, parent) in pending.items():
+            if op == 'index':
+                to_index.setdefault(cls, []).append(id)
+        objects = {}
+        for cls, ids in to_index.items():
+            for obj in load_objects(session, cls, ids):
+                objects[type(obj), obj.id] = obj
+
+        client = self.client
+        for (cls, id), (op, parent) in pending.items():
+            if op == 'delete':
+                client.delete_document(id=id, doc_type=cls.__name__,
+                                       parent=parent, safe=True)
+            elif (cls, id) in objects:
+                client.index_object(objects[cls, id])
+        self.objects += len(pending)
+        log.debug('Queued %d write(s) from session %r', len(pending),
+                  session)
+
+
+def load_objects(session, cls, ids):
+    """
+    Return the objects of a class with the given IDs, taken from the
+    identity map of the session if they are there, and otherwise loaded with
+    one query.
+    """
+    objs = []
+    missing = []
+    for id in ids:
+        obj = session.identity_map.get(identity_key(cls, (id,)))
+        if obj is None:
+            missing.append(id)
+        else:
+            objs.append(obj)
+    if missing:
+        pk = cls.__mapper__.primary_key[0]
+        objs.extend(session.query(cls).filter(pk.in_(missing)))
+    return objs
@@ -0,0 +1,147 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import atexit
+import logging
+import os
+import threading
+import time
+
+from six.moves import queue
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundIndexer(object):
+    """
+    Sends the writes of committed transactions to ES from a background
+    thread, so that requests don't wait for them. Set it as the
+    ``background`` attribute of a :py:class:`.client.ElasticClient`, or use
+    the ``elastic.background`` setting.
+
+    Up to ``max_queue`` transactions are held in the queue. When it is full,
+    committing waits for the worker to catch up, logging a warning if it
+    takes more than ``put_timeout`` seconds: the writes are never sent from
+    the committing thread, since they could then overtake older writes of
+    the same documents still in the queue. Failed writes are logged, since
+    the transaction has already been committed.
+
+    The queue is drained when the process exits. :py:meth:`flush` waits for
+    the queued writes to be sent, which is useful in tests.
+    """
+
+    def __init__(self, client, max_queue=100, put_timeout=None,
+                 drain_timeout=30):
+        self.client = client
+        self.max_queue = max_queue
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+        self.sent = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        atexit.register(self.stop)
+
+    def _start(self):
+        """
+        Start the worker thread, if it is not running in this process:
+        threads don't survive a fork.
+        """
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(self.max_queue)
+            self._thread = threading.Thread(target=self._run,
+                                            name='pyramid_es-indexer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, actions):
+        """
+        Queue a list of bulk actions to be sent by the worker thread.
+        """
+        if not actions:
+            return
+        self._start()
+        try:
+            self._queue.put(actions, timeout=self.put_timeout)
+        except queue.Full:
+            log.warning('Background indexing queue still full after %s '
+                        'seconds, waiting to queue %d action(s)',
+                        self.put_timeout, len(actions))
+            self._queue.put(actions)
+
+    def _send(self, actions):
+        try:
+            succeeded, errors = self.client.bulk(actions,
+                                                 raise_on_error=False)
+        except Exception:
+            log.exception('Failed to send %d action(s)', len(actions))
+            self.failed += len(actions)
+            return
+        for error in errors:
+            log.warning('Bulk action failed: %r', error)
+        self.sent += succeeded
+        self.failed += len(errors)
+
+    def _run(self):
+        q = self._queue
+        while True:
+            actions = q.get()
+            try:
+                if actions is _STOP:
+                    return
+                self._send(actions)
+            finally:
+                q.task_done()
+
+    def flush(self, timeout=None):
+        """
+        Wait until all the queued writes have been sent, for at most
+        ``timeout`` seconds if it is not None. Returns whether the queue was
+        drained.
+        """
+        q = self._queue
+        if q is None or self._pid != os.getpid():
+            return True
+        with q.all_tasks_done:
+            if timeout is None:
+                while q.unfinished_tasks:
+                    q.all_tasks_done.wait()
+            elif q.unfinished_tasks:
+                q.all_tasks_done.wait(timeout)
+            return not q.unfinished_tasks
+    wait = flush
+
+    def stop(self, timeout=None):
+        """
+        Send the queued writes and stop the worker thread, waiting at most
+        ``timeout`` seconds (by default, ``drain_timeout``). If the queue is
+        still full by then, it is abandoned to the worker. The worker is
+        started again by the next write.
+        """
+        with self._lock:
+            thread, q = self._thread, self._queue
+            if thread is None or self._pid != os.getpid():
+                return
+            self._thread = None
+        if timeout is None:
+            timeout = self.drain_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            # The worker is stuck on a request: leave it with the queue.
+            log.warning('Background indexing queue still full after %s '
+                        'seconds, abandoning %d transaction(s)', timeout,
+                        q.qsize())
+            return
+        thread.join(None if deadline is None
+                    else max(deadline - time.time(), 0))
+        if thread.is_alive():
+            log.warning('Background indexing did not finish in %s seconds, '
+                        '%d transaction(s) not sent', timeout, q.qsize())
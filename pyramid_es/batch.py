@@ -0,0 +1,102 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ElasticQueryError(Exception):
+    """
+    Raised when reading the result of a query of a batch which failed. The
+    ``error`` attribute holds the error returned by ES for that query.
+    """
+
+    def __init__(self, error):
+        self.error = error
+        Exception.__init__(self, 'Query failed: %r' % (error,))
+
+
+class DeferredResult(object):
+    """
+    The future result of a query added to an :py:class:`ElasticBatch`. The
+    batch is executed the first time the result of one of its queries is
+    read.
+    """
+
+    def __init__(self, batch, wrap):
+        self.batch = batch
+        self.wrap = wrap
+        self.done = False
+        self._raw = None
+
+    def _resolve(self, raw):
+        self._raw = raw
+        self.done = True
+
+    def result(self):
+        """
+        Return the result of the query, executing the batch if needed.
+        Raises :py:class:`ElasticQueryError` if the query failed.
+        """
+        if not self.done:
+            self.batch.execute()
+        if 'error' in self._raw:
+            raise ElasticQueryError(self._raw['error'])
+        return self.wrap(self._raw)
+
+
+class ElasticBatch(object):
+    """
+    Collects queries, possibly against different classes, to run them all
+    with a single ``_msearch`` request. Create one with
+    :py:meth:`.client.ElasticClient.batch`.
+
+    Adding a query returns a :py:class:`DeferredResult`: nothing is sent
+    until :py:meth:`execute` is called, or the first result is read. Queries
+    added after that are sent with the next execution.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._pending = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, query, start=None, size=None, fields=None):
+        """
+        Add a query, whose deferred result will be the one of
+        ``query.execute(start=start, size=size, fields=fields)``.
+        """
+        body, params = query._search_params(start=start, size=size)
+        kwargs = query.client._search_kwargs(body, query.classes, fields,
+                                             **params)
+        deferred = DeferredResult(
+            self, lambda raw: query._result(raw, size=size))
+        self._pending.append((kwargs, deferred))
+        return deferred
+
+    def add_count(self, query):
+        """
+        Add a query, whose deferred result will be the one of
+        ``query.count()``.
+        """
+        body, params = query._search_params(size=0)
+        kwargs = query.client._search_kwargs(body, query.classes, **params)
+        deferred = DeferredResult(self, lambda raw: raw['hits']['total'])
+        self._pending.append((kwargs, deferred))
+        return deferred
+
+    def execute(self):
+        """
+        Send all the pending queries in one request. If it fails, they stay
+        pending, to be sent again by the next execution.
+        """
+        pending = self._pending
+        if not pending:
+            return
+        responses = self.client.msearch([kwargs for kwargs, deferred
+                                         in pending])
+        self._pending = []
+        for (kwargs, deferred), raw in zip(pending, responses):
+            deferred._resolve(raw)
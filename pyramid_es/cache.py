@@ -0,0 +1,131 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import threading
+import time
+
+from collections import OrderedDict
+
+from .client import fingerprint
+
+
+class ResultCache(object):
+    """
+    An in-process cache of search responses, for use with
+    :py:class:`.client.ElasticClient`. It holds at most ``max_size`` entries,
+    evicting the least recently used ones first, and entries expire ``ttl``
+    seconds after being stored (never, if ``ttl`` is None).
+
+    Entries are invalidated by the client when it writes documents of a type
+    the cached search covers. As written documents only become searchable
+    when Elasticsearch refreshes the index, searches on a type written less
+    than ``refresh_interval`` seconds ago are not cached, so that a response
+    from before the refresh can't be kept. The ``hits``, ``misses``,
+    ``evictions`` and ``invalidations`` counters can be used to size the
+    cache.
+
+    Any object with the same ``key()``, ``get()``, ``set()`` and
+    ``invalidate()`` methods can be used in its place, for instance to share a
+    cache between processes. Cached responses are shared between callers, so
+    they should not be modified.
+    """
+
+    def __init__(self, max_size=1000, ttl=60, refresh_interval=1,
+                 clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._written = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, search_kwargs):
+        """
+        Return the cache key for the keyword arguments of a search request:
+        a hash of their canonical serialization.
+        """
+        return fingerprint(search_kwargs)
+
+    def get(self, key):
+        """
+        Return the cached response for ``key``, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, doc_types, value = entry
+                if expires is None or expires > self.clock():
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+
+    def set(self, key, value, doc_types):
+        """
+        Store the response of a search on ``doc_types`` (an empty sequence
+        meaning all document types), unless one of them was written within the
+        refresh interval.
+        """
+        now = self.clock()
+        expires = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            if self._recently_written(doc_types, now):
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, frozenset(doc_types), value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, doc_types):
+        """
+        Drop the cached responses of searches which may match documents of
+        one of ``doc_types``.
+        """
+        doc_types = frozenset(doc_types)
+        now = self.clock()
+        with self._lock:
+            for doc_type in doc_types:
+                self._written[doc_type] = now
+            stale = [key for key, (expires, types, value)
+                     in self._entries.items()
+                     if not types or types & doc_types]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def _recently_written(self, doc_types, now):
+        since = now - self.refresh_interval
+        for doc_type, written in list(self._written.items()):
+            if written <= since:
+                del self._written[doc_type]
+        if not doc_types:
+            return bool(self._written)
+        return any(doc_type in self._written for doc_type in doc_types)
+
+    def clear(self):
+        """
+        Drop all cached responses.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return the cache counters as a dict.
+        """
+        return dict(size=len(self._entries),
+                    hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    invalidations=self.invalidations)
@@ -1,20 +1,36 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+import weakref
 
-from itertools import chain
+from timeit import default_timer
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import chain, islice
+from multiprocessing.pool import ThreadPool
 from pprint import pformat
 from functools import wraps
 
 import six
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, VERSION as ES_VERSION
 from elasticsearch.exceptions import NotFoundError
+from elasticsearch.serializer import JSONSerializer
+from sqlalchemy import inspect as sa_inspect
 
 import transaction as zope_transaction
 from zope.interface import implementer
 from transaction.interfaces import ISavepointDataManager
 
+from .batch import ElasticBatch
+from .instrument import ElasticCall, ElasticRecorder, call_site, response_hits
+from .memory import MemoryElasticsearch
 from .query import ElasticQuery
 from .result import ElasticResultRecord
 
@@ -62,12 +78,171 @@ CREATE_INDEX_SETTINGS.update({
     },
 })
 
+#: Settings overriding ``CREATE_INDEX_SETTINGS`` while a new version of the
+#: index is loaded by :py:meth:`ElasticClient.rebuild_index`.
+BULK_LOAD_SETTINGS = {
+    "index": {
+        "refresh_interval": "-1",
+        "number_of_replicas": 0
+    },
+}
+
 STATUS_ACTIVE = 'active'
 STATUS_CHANGED = 'changed'
 
+FINGERPRINT_KEY = 'pyramid_es_fingerprint'
+
+BULK_CHUNK_SIZE = 500
+MGET_CHUNK_SIZE = 1000
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
 
 _CLIENT_STATE = {}
 
+#: Factories of ``Elasticsearch`` compatible backends, by the URL scheme of the
+#: servers they are used for. Other servers are accessed with an
+#: ``Elasticsearch`` instance.
+BACKENDS = {
+    'memory': MemoryElasticsearch,
+}
+
+_serializer = JSONSerializer()
+
+
+def _dumps(data):
+    """
+    Serialize ``data`` to a single line of JSON. The output is pure ASCII, so
+    its length is also its size in bytes.
+    """
+    return json.dumps(data, default=_serializer.default,
+                      separators=(',', ':'))
+
+
+def fingerprint(data):
+    """
+    Return a hash of the canonical JSON serialization of ``data``.
+    """
+    canonical = json.dumps(data, default=_serializer.default,
+                           separators=(',', ':'), sort_keys=True)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _flatten_settings(settings, prefix=''):
+    """
+    Flatten nested index settings to a dict of dotted keys, with the values
+    converted to strings like ES reports them.
+    """
+    flat = {}
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            flat.update(_flatten_settings(value, prefix + key + '.'))
+        elif isinstance(value, (list, tuple)):
+            flat[prefix + key] = [six.text_type(el) for el in value]
+        elif isinstance(value, bool):
+            flat[prefix + key] = six.text_type(value).lower()
+        else:
+            flat[prefix + key] = six.text_type(value)
+    return flat
+
+
+#: Transport options accepted by :py:func:`connect`, with the names of the
+#: corresponding ``Elasticsearch`` keyword arguments for elasticsearch-py 8
+#: and later, and for earlier versions.
+TRANSPORT_OPTIONS = {
+    'timeout': ('request_timeout', 'timeout'),
+    'maxsize': ('connections_per_node', 'maxsize'),
+    'http_compress': ('http_compress', 'http_compress'),
+    'sniff_on_start': ('sniff_on_start', 'sniff_on_start'),
+    'sniff_on_connection_fail': ('sniff_on_node_failure',
+                                 'sniff_on_connection_fail'),
+    'sniffer_timeout': ('min_delay_between_sniffing', 'sniffer_timeout'),
+    'retry_on_timeout': ('retry_on_timeout', 'retry_on_timeout'),
+    'max_retries': ('max_retries', 'max_retries'),
+    'dead_node_backoff': ('dead_node_backoff_factor', 'dead_timeout'),
+    'connection_class': ('node_class', 'connection_class'),
+}
+
+
+def transport_kwargs(options):
+    """
+    Translate transport options, named as in :py:data:`TRANSPORT_OPTIONS`,
+    to keyword arguments for the installed version of elasticsearch-py.
+    Options which are None are left out, and unknown ones passed as is.
+    """
+    modern = ES_VERSION[0] >= 8
+    kwargs = {}
+    for name, value in options.items():
+        if value is None:
+            continue
+        if name in TRANSPORT_OPTIONS:
+            name = TRANSPORT_OPTIONS[name][0 if modern else 1]
+        kwargs[name] = value
+    return kwargs
+
+
+def connect(servers, **options):
+    """
+    Return the ``Elasticsearch`` instance, or compatible backend registered
+    in :py:data:`BACKENDS`, to use for a server URL or list of URLs.
+    Transport ``options`` are described by :py:data:`TRANSPORT_OPTIONS`.
+    """
+    first = servers if isinstance(servers, six.string_types) else \
+        next(iter(servers), '')
+    scheme, sep, rest = first.partition('://')
+    factory = BACKENDS.get(scheme) if sep else None
+    if factory is None:
+        return Elasticsearch(servers, **transport_kwargs(options))
+    return factory(servers, **options)
+
+
+_CLIENTS = weakref.WeakSet()
+
+
+def _after_fork():
+    """
+    Drop the connections inherited by a forked process, which are shared
+    with its parent: they are created again on first use.
+    """
+    for client in list(_CLIENTS):
+        client._reset_connection()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def mapped_classes(base_class):
+    """
+    Return the classes registered with a SQLAlchemy declarative base class.
+    """
+    registry = getattr(base_class, '_decl_class_registry', None)
+    if registry is None:
+        # SQLAlchemy 1.4 and later.
+        registry = base_class.registry._class_registry
+    return [cls for cls in registry.values() if isinstance(cls, type)]
+
+
+def changed_attributes(obj):
+    """
+    Return the keys of the mapped attributes of an object which have pending
+    changes, according to the SQLAlchemy attribute history.
+    """
+    return [attr.key for attr in sa_inspect(obj).attrs
+            if attr.history.has_changes()]
+
+
+class ElasticBulkError(Exception):
+    """
+    Raised when one or more actions sent in a bulk request failed. The
+    ``errors`` attribute is the list of per-item responses returned by ES for
+    the failed actions.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        Exception.__init__(self, '%d bulk action(s) failed: %r' %
+                           (len(errors), errors[:3]))
+
 
 @implementer(ISavepointDataManager)
 class ElasticDataManager(object):
@@ -76,18 +251,30 @@ class ElasticDataManager(object):
         self.transaction_manager = transaction_manager
         t = transaction_manager.get()
         t.join(self)
+        if client.outbox is not None:
+            # Before commit, while the database session can still be used.
+            t.addBeforeCommitHook(self._write_outbox)
         _CLIENT_STATE[id(client)] = STATUS_ACTIVE
 
         self._reset()
 
+    def _write_outbox(self):
+        client = self.client
+        if not client.disable_indexing:
+            client.outbox.write(client.uncommitted.values())
+        client.uncommitted = OrderedDict()
+
     def _reset(self):
         log.error('_reset(%s)', self)
-        self.client.uncommitted = []
+        self.client.uncommitted = OrderedDict()
+        self.actions = []
 
     def _finish(self):
         log.error('_finish(%s)', self)
         client = self.client
-        del _CLIENT_STATE[id(client)]
+        # A failure in tpc_finish() will cause the transaction to be aborted
+        # again later, so don't assume the state is still around.
+        _CLIENT_STATE.pop(id(client), None)
 
     def abort(self, transaction):
         log.error('abort(%s)', self)
@@ -100,7 +287,13 @@ class ElasticDataManager(object):
 
     def commit(self, transaction):
         log.error('commit(%s)', self)
-        pass
+        # Build the documents for the queued writes now: the objects are in
+        # their final state, and the database session they belong to is still
+        # open, which may no longer be the case in tpc_finish().
+        client = self.client
+        actions = (getattr(client, '_%s_action' % cmd)(*args, **kwargs)
+                   for cmd, args, kwargs in client.uncommitted.values())
+        self.actions = [action for action in actions if action is not None]
 
     def tpc_vote(self, transaction):
         log.error('tpc_vote(%s)', self)
@@ -112,11 +305,14 @@ class ElasticDataManager(object):
         # Actually persist the uncommitted queue.
         log.error('tpc_finish(%s)', self)
         log.warn("running: %r", self.client.uncommitted)
-        for cmd, args, kwargs in self.client.uncommitted:
-            kwargs['immediate'] = True
-            getattr(self.client, cmd)(*args, **kwargs)
+        client = self.client
+        actions = self.actions
         self._reset()
         self._finish()
+        if client.background is not None:
+            client.background.submit(actions)
+        else:
+            client.bulk(actions)
 
     def tpc_abort(self, transaction):
         log.error('tpc_abort()')
@@ -143,6 +339,29 @@ class ElasticSavepoint(object):
         self.dm.client.uncommitted = self.saved.copy()
 
 
+class RequestScope(object):
+    """
+    Identity map of the documents fetched and searches run by a client
+    during one request.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.searches = {}
+
+    def evict(self, doc_type, id):
+        """
+        Drop the fetched documents with the given type and ID, and the
+        searches which may match them.
+        """
+        for key in [key for key in self.documents
+                    if key[0] == doc_type and key[1] == id]:
+            del self.documents[key]
+        for key in [key for key, (doc_types, raw) in self.searches.items()
+                    if not doc_types or doc_type in doc_types]:
+            del self.searches[key]
+
+
 def join_transaction(client, transaction_manager):
     client_id = id(client)
     existing_state = _CLIENT_STATE.get(client_id, None)
@@ -157,6 +376,19 @@ def join_transaction(client, transaction_manager):
 
 
 def transactional(f):
+    """
+    A decorator to wrap client write methods so that, when the client is
+    used with transactions, they are enqueued until the transaction commits.
+
+    The queue is keyed by ``(doc_type, id, parent)`` as returned by the
+    client's ``_<method>_key()`` method, so only the last write enqueued for a
+    given document is performed, unless the client has a ``_<method>_merge()``
+    method, which is called with the write already queued for the document
+    and the new one, as ``(method name, args, kwargs)`` tuples, and returns
+    the write to queue. The write itself is turned into a bulk action by the
+    ``_<method>_action()`` method at commit time, which may return None to
+    skip it.
+    """
     @wraps(f)
     def transactional_inner(client, *args, **kwargs):
         immediate = kwargs.pop('immediate', None)
@@ -167,7 +399,14 @@ def transactional(f):
                 log.error('enqueueing action: %s: %r, %r', f.__name__, args,
                           kwargs)
                 join_transaction(client, client.transaction_manager)
-                client.uncommitted.append((f.__name__, args, kwargs))
+                key = getattr(client, '_%s_key' % f.__name__)(*args, **kwargs)
+                client._evict(key[0], key[1])
+                write = (f.__name__, args, kwargs)
+                queued = client.uncommitted.pop(key, None)
+                merge = getattr(client, '_%s_merge' % f.__name__, None)
+                if queued is not None and merge is not None:
+                    write = merge(queued, write)
+                client.uncommitted[key] = write
                 return
         return f(client, *args, **kwargs)
     return transactional_inner
@@ -176,42 +415,332 @@ def transactional(f):
 class ElasticClient(object):
     """
     A handle for interacting with the Elasticsearch backend.
+
+    ``timeout`` and the other ``transport_options`` (see
+    :py:data:`TRANSPORT_OPTIONS`) configure the connections to the servers;
+    the defaults of elasticsearch-py are used for those which are None or not
+    given.
+
+    With a :py:class:`.background.BackgroundIndexer` as ``background``, the
+    writes of committed transactions are sent by its worker thread instead of
+    the committing one. With an :py:class:`.outbox.ElasticOutbox` as
+    ``outbox``, they are stored in the database instead, to be sent by a
+    separate indexer process.
+
+    With a :py:class:`.digest.DigestStore` as ``digests``, documents
+    identical to the last version indexed by the client are not sent again.
     """
 
-    def __init__(self, servers, index, timeout=1.0, disable_indexing=False,
+    def __init__(self, servers, index, timeout=None, disable_indexing=False,
                  use_transaction=True,
-                 transaction_manager=zope_transaction.manager):
+                 transaction_manager=zope_transaction.manager, cache=None,
+                 background=None, outbox=None, digests=None,
+                 **transport_options):
         self.index = index
         self.disable_indexing = disable_indexing
         self.use_transaction = use_transaction
         self.transaction_manager = transaction_manager
-        self.es = Elasticsearch(servers)
+        self.cache = cache
+        self.background = background
+        self.outbox = outbox
+        self.digests = digests
+        self.servers = servers
+        self.transport_options = dict(transport_options, timeout=timeout)
+        self._reset_connection()
+        self._local = threading.local()
+        _CLIENTS.add(self)
+
+    def _reset_connection(self):
+        self._es = None
+        self._pid = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def es(self):
+        """
+        The ``Elasticsearch`` instance, or compatible backend, used by the
+        client. It is created on first use, and again in a process forked
+        after that (with the ``preload_app`` option of gunicorn, for
+        instance), so that connections are never shared between processes.
+        """
+        pid = os.getpid()
+        if self._es is None or self._pid != pid:
+            with self._connect_lock:
+                if self._es is None or self._pid != pid:
+                    self._es = connect(self.servers, **self.transport_options)
+                    self._pid = pid
+        return self._es
+
+    @es.setter
+    def es(self, es):
+        self._es = es
+        self._pid = os.getpid()
+
+    def _invalidate(self, doc_types):
+        if self.cache is not None:
+            self.cache.invalidate(doc_types)
+
+    def _clear_digests(self):
+        if self.digests is not None:
+            self.digests.clear()
+
+    @contextmanager
+    def request_scope(self):
+        """
+        Context manager which, for its duration and in the current thread,
+        memoizes the documents returned by :py:meth:`get` and the responses
+        of :py:meth:`search`. Writes made through the client evict the
+        matching entries.
+
+        This is normally set up for each Pyramid request by the
+        ``pyramid_es.tweens.request_scope_tween_factory`` tween.
+        """
+        previous = getattr(self._local, 'scope', None)
+        self._local.scope = RequestScope()
+        try:
+            yield self._local.scope
+        finally:
+            self._local.scope = previous
+
+    def _request_scope(self):
+        return getattr(self._local, 'scope', None)
+
+    def _evict(self, doc_type, id):
+        scope = self._request_scope()
+        if scope is not None:
+            scope.evict(doc_type, id)
+
+    @contextmanager
+    def instrument(self, recorder=None):
+        """
+        Context manager which, for its duration and in the current thread,
+        records the search, get, index, delete and bulk requests made by the
+        client into an :py:class:`.instrument.ElasticRecorder`, which it
+        returns. Instrumentation contexts can be nested: calls are recorded by
+        all the active recorders.
+
+        This is normally set up for each Pyramid request by the
+        ``pyramid_es.tweens.instrument_tween_factory`` tween.
+        """
+        if recorder is None:
+            recorder = ElasticRecorder()
+        recorders = self._recorders()
+        self._local.recorders = recorders + (recorder,)
+        try:
+            yield recorder
+        finally:
+            self._local.recorders = recorders
+
+    def _recorders(self):
+        return getattr(self._local, 'recorders', ())
+
+    def _call(self, method, **kwargs):
+        """
+        Call ``method`` of the underlying ``Elasticsearch`` instance,
+        recording it if instrumentation is active.
+        """
+        recorders = self._recorders()
+        if not recorders:
+            return getattr(self.es, method)(**kwargs)
+
+        site = call_site()
+        resp = error = None
+        start = default_timer()
+        try:
+            resp = getattr(self.es, method)(**kwargs)
+            return resp
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = default_timer() - start
+            params = dict((k, v) for k, v in kwargs.items() if k != 'body')
+            body = kwargs.get('body')
+            if body is None:
+                request_size = 0
+            elif isinstance(body, six.string_types):
+                request_size = len(body)
+            else:
+                request_size = len(_dumps(body))
+            took = None
+            if isinstance(resp, dict):
+                took = resp.get('took')
+                if took is None and 'responses' in resp:
+                    took = sum(r.get('took', 0) for r in resp['responses'])
+            call = ElasticCall(
+                method, params, body, duration,
+                took=took,
+                request_size=request_size,
+                response_size=len(_dumps(resp)) if resp is not None else 0,
+                hits=response_hits(method, resp),
+                call_site=site,
+                error=error)
+            for recorder in recorders:
+                recorder.add(call)
 
     def ensure_index(self, recreate=False):
         """
         Ensure that the index exists on the ES server, and has up-to-date
         settings.
+
+        Settings can't all be changed on an existing index, so if they differ
+        from the ones the index would be created with, a warning is logged:
+        use ``recreate=True`` to apply them, or :py:meth:`rebuild_index` to
+        do so without downtime.
+
+        If the index name is an alias (see :py:meth:`swap_index_version`),
+        recreating the index points it to a new, empty version of the index,
+        and deletes the previous one.
         """
+        if recreate and self.aliased_indices():
+            name = self.create_index_version()
+            self.finish_index_version(name, force_merge=False)
+            self.swap_index_version(name)
+            return
         exists = self.es.indices.exists(self.index)
         if recreate or not exists:
             if exists:
                 self.es.indices.delete(self.index)
             self.es.indices.create(self.index,
                                    body=dict(settings=CREATE_INDEX_SETTINGS))
+            self._clear_digests()
+        elif not self.index_settings_current():
+            log.warning('Settings of index %r are out of date, it should be '
+                        'recreated.', self.index)
+
+    def index_settings_current(self):
+        """
+        Return whether the settings reported by the server for the index
+        match the ones it would be created with, by comparing their
+        fingerprints. Settings added by the server are ignored.
+        """
+        raw = self.es.indices.get_settings(index=self.index)
+        server = _flatten_settings(list(raw.values())[0]['settings'])
+        expected = dict(
+            (key if key.startswith('index.') else 'index.' + key, value)
+            for key, value in _flatten_settings(CREATE_INDEX_SETTINGS).items())
+        reported = dict((key, server.get(key)) for key in expected)
+        return fingerprint(reported) == fingerprint(expected)
 
     def delete_index(self):
         """
-        Delete the index on the ES server.
+        Delete the index on the ES server, or the indices the index name is
+        an alias of.
+        """
+        for index in self.aliased_indices() or [self.index]:
+            self.es.indices.delete(index)
+        self._clear_digests()
+
+    def for_index(self, index):
+        """
+        Return a client using the same connection to access another index,
+        without transactions.
+        """
+        client = ElasticClient(self.servers, index,
+                               disable_indexing=self.disable_indexing,
+                               use_transaction=False,
+                               **self.transport_options)
+        client.es = self.es
+        return client
+
+    def aliased_indices(self):
+        """
+        Return the names of the indices the index name is an alias of, which
+        is empty if it is not an alias.
+        """
+        try:
+            return sorted(self.es.indices.get_alias(name=self.index))
+        except NotFoundError:
+            return []
+
+    def create_index_version(self, version=None):
+        """
+        Create a new version of the index, named after the index and
+        ``version`` (by default, the current UTC time), with the
+        ``BULK_LOAD_SETTINGS``. Returns its name.
+        """
+        if version is None:
+            version = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+        name = '%s_%s' % (self.index, version)
+        settings = dict(CREATE_INDEX_SETTINGS)
+        settings['index'] = dict(CREATE_INDEX_SETTINGS['index'],
+                                 **BULK_LOAD_SETTINGS['index'])
+        self.es.indices.create(name, body=dict(settings=settings))
+        return name
+
+    def finish_index_version(self, name, force_merge=True):
+        """
+        Restore the settings of an index version loaded with the
+        ``BULK_LOAD_SETTINGS``, refresh it and, if ``force_merge`` is true,
+        merge its segments.
+        """
+        restored = dict((key, CREATE_INDEX_SETTINGS['index'].get(key))
+                        for key in BULK_LOAD_SETTINGS['index'])
+        if restored['refresh_interval'] is None:
+            restored['refresh_interval'] = '1s'
+        self.es.indices.put_settings(index=name, body={'index': restored})
+        self.es.indices.refresh(index=name)
+        if force_merge:
+            forcemerge = getattr(self.es.indices, 'forcemerge', None)
+            if forcemerge is None:
+                # Before ES 2.1.
+                forcemerge = self.es.indices.optimize
+            forcemerge(index=name, max_num_segments=1)
+
+    def swap_index_version(self, name, delete_old=True):
         """
-        self.es.indices.delete(self.index)
+        Atomically point the index name, as an alias, to the index version
+        ``name``. If the index name is an actual index, it is deleted in the
+        same operation. The indices the alias pointed to are deleted, unless
+        ``delete_old`` is false.
+        """
+        actions = [{'add': {'index': name, 'alias': self.index}}]
+        aliased = self.aliased_indices()
+        old = [index for index in aliased if index != name]
+        for index in old:
+            actions.append({'remove': {'index': index, 'alias': self.index}})
+        if not aliased and self.es.indices.exists(self.index):
+            actions.append({'remove_index': {'index': self.index}})
+        self.es.indices.update_aliases(body={'actions': actions})
+        self._clear_digests()
+        if delete_old:
+            for index in old:
+                self.es.indices.delete(index)
+
+    def rebuild_index(self, load, base_classes=(), version=None,
+                      force_merge=True, delete_old=True):
+        """
+        Rebuild the index without downtime: create a new version of the index
+        for bulk loading, put the mappings of ``base_classes`` (see
+        :py:meth:`ensure_all_mappings`), call ``load`` with a client for it
+        (see :py:meth:`for_index`), restore its settings and point the index
+        name to it. Searches use the previous version until then.
 
-    def ensure_mapping(self, cls, recreate=False):
+        Returns the name of the new version.
+        """
+        name = self.create_index_version(version)
+        client = self.for_index(name)
+        for base_class in base_classes:
+            client.ensure_all_mappings(base_class)
+        load(client)
+        self.finish_index_version(name, force_merge=force_merge)
+        self.swap_index_version(name, delete_old=delete_old)
+        log.info('Index %r now points to %r', self.index, name)
+        return name
+
+    def ensure_mapping(self, cls, recreate=False, server_fingerprints=None):
         """
         Put an explicit mapping for the given class if it doesn't already
-        exist.
+        exist, or has changed.
+
+        A fingerprint of the mapping is stored in its ``_meta`` field, and
+        the mapping is only sent if it differs from the fingerprint the server
+        reports (which can be supplied as ``server_fingerprints``, as returned
+        by :py:meth:`get_mapping_fingerprints`). Returns whether the mapping
+        was sent.
         """
         doc_type = cls.__name__
-        doc_mapping = cls.elastic_mapping()
+        doc_mapping = cls.elastic_mapping_cached()
 
         doc_mapping = dict(doc_mapping)
         if cls.elastic_parent:
@@ -219,6 +748,17 @@ class ElasticClient(object):
                 "type": cls.elastic_parent
             }
 
+        meta = dict(doc_mapping.get('_meta', {}))
+        meta[FINGERPRINT_KEY] = fingerprint(doc_mapping)
+        doc_mapping['_meta'] = meta
+
+        if not recreate:
+            if server_fingerprints is None:
+                server_fingerprints = self.get_mapping_fingerprints(cls)
+            if server_fingerprints.get(doc_type) == meta[FINGERPRINT_KEY]:
+                log.debug('Mapping for %s is up to date', doc_type)
+                return False
+
         doc_mapping = {doc_type: doc_mapping}
 
         log.debug('Putting mapping: \n%s', pformat(doc_mapping))
@@ -231,6 +771,7 @@ class ElasticClient(object):
         self.es.indices.put_mapping(index=self.index,
                                     doc_type=doc_type,
                                     body=doc_mapping)
+        return True
 
     def delete_mapping(self, cls):
         """
@@ -240,15 +781,20 @@ class ElasticClient(object):
         doc_type = cls.__name__
         self.es.indices.delete_mapping(index=self.index,
                                        doc_type=doc_type)
+        self._clear_digests()
 
     def ensure_all_mappings(self, base_class, recreate=False):
         """
         Initialize explicit mappings for all subclasses of the specified
         SQLAlcehmy declarative base class.
         """
-        for cls in base_class._decl_class_registry.values():
+        server_fingerprints = None
+        if not recreate:
+            server_fingerprints = self.get_mapping_fingerprints()
+        for cls in mapped_classes(base_class):
             if hasattr(cls, 'elastic_mapping'):
-                self.ensure_mapping(cls, recreate=recreate)
+                self.ensure_mapping(cls, recreate=recreate,
+                                    server_fingerprints=server_fingerprints)
 
     def get_mappings(self, cls=None):
         """
@@ -257,11 +803,27 @@ class ElasticClient(object):
         doc_type = cls and cls.__name__
         raw = self.es.indices.get_mapping(index=self.index,
                                           doc_type=doc_type)
+        if self.index not in raw:
+            # The index is accessed through an alias.
+            return list(raw.values())[0]['mappings']
         return raw[self.index]['mappings']
 
-    def index_object(self, obj, **kw):
+    def get_mapping_fingerprints(self, cls=None):
         """
-        Add or update the indexed document for an object.
+        Return a dict of the mapping fingerprints stored on the server, by
+        document type.
+        """
+        try:
+            mappings = self.get_mappings(cls)
+        except (NotFoundError, IndexError):
+            return {}
+        return dict((doc_type, mapping.get('_meta', {}).get(FINGERPRINT_KEY))
+                    for doc_type, mapping in mappings.items())
+
+    def _object_document(self, obj):
+        """
+        Build the document for an object. Returns a ``(doc_type, id, doc,
+        parent)`` tuple.
         """
         doc = obj.elastic_document()
 
@@ -274,28 +836,129 @@ class ElasticClient(object):
         log.debug('ID is %r', doc_id)
         log.debug('Parent is %r', doc_parent)
 
+        return doc_type, doc_id, doc, doc_parent
+
+    def _index_object_key(self, obj, **kw):
+        doc_type = obj.__class__.__name__
+        if obj.id is None:
+            # Not flushed yet, so the object itself is the best identity we
+            # have.
+            return doc_type, obj, None
+        return doc_type, obj.id, obj.elastic_parent
+
+    _delete_object_key = _index_object_key
+
+    @transactional
+    def index_object(self, obj, **kw):
+        """
+        Add or update the indexed document for an object.
+
+        When the client is used with transactions, the document is built when
+        the transaction commits, from the final state of the object.
+        """
+        doc_type, doc_id, doc, doc_parent = self._object_document(obj)
         self.index_document(id=doc_id,
                             doc_type=doc_type,
                             doc=doc,
                             parent=doc_parent,
+                            immediate=True,
                             **kw)
 
-    def delete_object(self, obj, safe=False, **kw):
+    def _index_object_action(self, obj, **kw):
+        doc_type, doc_id, doc, doc_parent = self._object_document(obj)
+        return self._index_document_action(id=doc_id,
+                                           doc_type=doc_type,
+                                           doc=doc,
+                                           parent=doc_parent,
+                                           **kw)
+
+    def update_object(self, obj, attributes=None, immediate=False):
         """
-        Delete the indexed document for an object.
+        Update the indexed document for an object with the fields which come
+        from its changed attributes, as reported by the SQLAlchemy attribute
+        history when this is called (so before the session is flushed), or
+        from the given ``attributes``.
+
+        Only these fields are sent, with a partial ``update`` upserting the
+        document: if it doesn't exist yet, it is created with these fields
+        only. The whole document is indexed instead when the changes can't
+        be mapped to fields (see
+        :py:meth:`.mixin.ElasticMixin.elastic_fields_for`), or no change is
+        found. Nothing is sent if no field depends on the changes.
+
+        When the client is used with transactions, updates of the same object
+        are merged, and an :py:meth:`index_object` call for it supersedes
+        them. Updating an object whose document is queued for deletion or
+        indexing as a raw document indexes it whole. With ``immediate``, the
+        update is sent right away.
         """
-        doc = obj.elastic_document()
+        if attributes is None:
+            attributes = changed_attributes(obj)
+        self.update_object_attributes(obj, frozenset(attributes),
+                                      immediate=immediate)
 
-        doc_type = obj.__class__.__name__
-        doc_id = doc.pop("_id")
-        doc_parent = obj.elastic_parent
+    @transactional
+    def update_object_attributes(self, obj, attributes):
+        """
+        Update the indexed document for an object with the fields which come
+        from the given attributes. See :py:meth:`update_object`.
+        """
+        if self.disable_indexing:
+            return
+        action = self._update_object_attributes_action(obj, attributes)
+        if action is not None:
+            self.bulk([action])
+
+    def _update_object_attributes_key(self, obj, attributes):
+        return self._index_object_key(obj)
+
+    def _update_object_attributes_merge(self, queued, write):
+        cmd, args, kwargs = queued
+        obj, attributes = write[1]
+        if cmd == 'update_object_attributes':
+            return write[0], (obj, args[1] | attributes), write[2]
+        # A partial update can't follow a deletion, or a raw document.
+        return 'index_object', (obj,), {}
+
+    def _update_object_attributes_action(self, obj, attributes):
+        """
+        Return the bulk action equivalent to
+        ``update_object_attributes()``.
+        """
+        fields = None
+        if attributes:
+            fields = type(obj).elastic_fields_for(attributes)
+        if fields is None:
+            return self._index_object_action(obj)
+        if not fields:
+            return None
+        meta = {'_index': self.index, '_type': obj.__class__.__name__,
+                '_id': obj.id}
+        parent = obj.elastic_parent
+        if parent:
+            meta['_parent'] = parent
+        doc = obj.elastic_partial_document(fields)
+        return ('update', meta, {'doc': doc, 'doc_as_upsert': True}, False)
 
-        self.delete_document(id=doc_id,
-                             doc_type=doc_type,
-                             parent=doc_parent,
+    @transactional
+    def delete_object(self, obj, safe=False, **kw):
+        """
+        Delete the indexed document for an object.
+        """
+        self.delete_document(id=obj.id,
+                             doc_type=obj.__class__.__name__,
+                             parent=obj.elastic_parent,
                              safe=safe,
+                             immediate=True,
                              **kw)
 
+    def _delete_object_action(self, obj, safe=False, **kw):
+        return self._delete_document_action(id=obj.id,
+                                            doc_type=obj.__class__.__name__,
+                                            parent=obj.elastic_parent,
+                                            safe=safe,
+                                            **kw)
+
     @transactional
     def index_document(self, id, doc_type, doc, parent=None):
         """
@@ -305,15 +968,47 @@ class ElasticClient(object):
         if self.disable_indexing:
             return
 
+        action = self._index_document_action(id, doc_type, doc, parent)
+        if self.digests is not None:
+            actions = list(self._skip_unchanged([action]))
+            if not actions:
+                return
+            action = actions[0]
+        op, meta, source, safe = action
+
         kwargs = dict(index=self.index,
-                      body=doc,
+                      body=source,
                       doc_type=doc_type,
                       id=id)
-        if '__pipeline__' in doc:
-            kwargs['pipeline'] = doc.pop('__pipeline__')
+        if 'pipeline' in meta:
+            kwargs['pipeline'] = meta['pipeline']
         if parent:
             kwargs['parent'] = parent
-        self.es.index(**kwargs)
+        try:
+            self._call('index', **kwargs)
+        except Exception:
+            self._forget_digests([action])
+            raise
+        finally:
+            self._invalidate([doc_type])
+            self._evict(doc_type, id)
+
+    def _index_document_key(self, id, doc_type, doc, parent=None):
+        return doc_type, id, parent
+
+    def _index_document_action(self, id, doc_type, doc, parent=None):
+        """
+        Return the bulk action equivalent to ``index_document()``.
+        """
+        meta = {'_index': self.index, '_type': doc_type}
+        if id is not None:
+            meta['_id'] = id
+        if '__pipeline__' in doc:
+            doc = dict(doc)
+            meta['pipeline'] = doc.pop('__pipeline__')
+        if parent:
+            meta['_parent'] = parent
+        return ('index', meta, doc, False)
 
     @transactional
     def delete_document(self, id, doc_type, parent=None, safe=False):
@@ -329,18 +1024,277 @@ class ElasticClient(object):
                       id=id)
         if parent:
             kwargs['routing'] = parent
+        self._forget_digests(
+            [self._delete_document_action(id, doc_type, parent, safe)])
         try:
-            self.es.delete(**kwargs)
+            self._call('delete', **kwargs)
         except NotFoundError:
             if not safe:
                 raise
+        finally:
+            self._invalidate([doc_type])
+            self._evict(doc_type, id)
+
+    def _delete_document_key(self, id, doc_type, parent=None, safe=False):
+        return doc_type, id, parent
 
-    def index_objects(self, objects):
+    def _delete_document_action(self, id, doc_type, parent=None,
+                                safe=False):
+        """
+        Return the bulk action equivalent to ``delete_document()``.
+        """
+        meta = {'_index': self.index, '_type': doc_type, '_id': id}
+        if parent:
+            meta['_routing'] = parent
+        return ('delete', meta, None, safe)
+
+    def _digest_key(self, meta):
+        return (meta['_index'], meta['_type'], meta.get('_id'),
+                meta.get('_parent') or meta.get('_routing'))
+
+    def _skip_unchanged(self, actions):
+        """
+        Yield bulk actions, except the index actions of documents identical
+        to the last version indexed, according to the digest store. Actions
+        are checked by chunks, with one lookup each.
+
+        The digests of the documents sent are stored before they are
+        yielded, and dropped by :py:meth:`_send_bulk_chunk` if the writes
+        fail. Those of the documents deleted or partially updated are
+        dropped.
+        """
+        digests = self.digests
+        actions = iter(actions)
+        while True:
+            chunk = list(islice(actions, BULK_CHUNK_SIZE))
+            if not chunk:
+                return
+            keys = [self._digest_key(action[1]) for action in chunk]
+            checked = [key for action, key in zip(chunk, keys)
+                       if action[0] == 'index' and key[2] is not None]
+            stored = digests.get_many(checked) if checked else {}
+
+            send = []
+            sent = OrderedDict()
+            dropped = []
+            for action, key in zip(chunk, keys):
+                op, meta, source, safe = action
+                if op == 'index' and key[2] is not None:
+                    digest = fingerprint([meta.get('pipeline'), source])
+                    if stored.get(key) == digest:
+                        continue
+                    stored[key] = sent[key] = digest
+                    if digests.field:
+                        source = dict(source)
+                        source[digests.field] = digest
+                        action = (op, meta, source, safe)
+                else:
+                    stored.pop(key, None)
+                    sent.pop(key, None)
+                    dropped.append(key)
+                send.append(action)
+
+            skipped = len(chunk) - len(send)
+            digests.count(len(checked), skipped)
+            if skipped:
+                log.debug('Skipped %d unchanged document(s)', skipped)
+            if dropped:
+                digests.delete_many(dropped)
+            if sent:
+                digests.set_many(sent)
+            for action in send:
+                yield action
+
+    def _forget_digests(self, actions):
+        """
+        Drop the digests of the documents of failed actions.
+        """
+        if self.digests is not None and actions:
+            self.digests.delete_many([self._digest_key(action[1])
+                                      for action in actions])
+
+    def _bulk_chunks(self, actions, chunk_size, max_chunk_bytes):
+        """
+        Serialize bulk actions and group them into chunks which hold at most
+        ``chunk_size`` actions and ``max_chunk_bytes`` bytes of request body
+        (a single action larger than that is sent on its own). Yields
+        ``(actions, lines)`` pairs.
+        """
+        chunk = []
+        lines = []
+        size = 0
+        for action in actions:
+            op, meta, source, safe = action
+            data = [_dumps({op: meta})]
+            if source is not None:
+                data.append(_dumps(source))
+            action_size = sum(len(line) + 1 for line in data)
+            if chunk and (len(chunk) >= chunk_size or
+                          size + action_size > max_chunk_bytes):
+                yield chunk, lines
+                chunk = []
+                lines = []
+                size = 0
+            chunk.append(action)
+            lines.extend(data)
+            size += action_size
+        if chunk:
+            yield chunk, lines
+
+    def _send_bulk_chunk(self, chunk, lines):
+        """
+        Send one chunk of bulk actions. Returns the number of actions sent,
+        and the list of per-item responses for the actions which failed.
+        """
+        try:
+            resp = self._call('bulk', body='\n'.join(lines) + '\n')
+        except Exception:
+            self._forget_digests(chunk)
+            raise
+        finally:
+            self._invalidate(set(action[1]['_type'] for action in chunk))
+            for op, meta, source, safe in chunk:
+                self._evict(meta['_type'], meta.get('_id'))
+        failures = self._bulk_failures(chunk, resp)
+        self._forget_digests([action for action, item in failures])
+        return len(chunk), [item for action, item in failures]
+
+    def _bulk_failures(self, chunk, resp):
+        """
+        Return the ``(action, item)`` pairs of the actions which failed in a
+        bulk request, with their per-item responses.
+        """
+        failures = []
+        for action, item in zip(chunk, resp['items']):
+            result = item[action[0]]
+            status = result.get('status', 500)
+            if 200 <= status < 300:
+                continue
+            if status == 404 and action[3]:
+                # Deleting a missing document with safe=True.
+                continue
+            failures.append((action, item))
+        return failures
+
+    def _bulk_errors(self, chunk, resp):
+        """
+        Return the per-item responses of a bulk request for the actions which
+        failed.
+        """
+        return [item for action, item in self._bulk_failures(chunk, resp)]
+
+    def bulk(self, actions, chunk_size=BULK_CHUNK_SIZE,
+             max_chunk_bytes=BULK_MAX_CHUNK_BYTES, thread_count=1,
+             raise_on_error=True):
+        """
+        Send an iterable of bulk actions, which are ``(op, meta, source,
+        safe)`` tuples, to ES, split into size-bounded ``_bulk`` requests.
+        Failures are collected across all chunks and raised together as an
+        :py:class:`ElasticBulkError`, unless ``raise_on_error`` is False.
+
+        The actions are consumed lazily. With a ``thread_count`` greater than
+        one, chunks are sent by a pool of worker threads so that several bulk
+        requests can be in flight at once, while at most twice that many
+        chunks are held in memory.
+
+        Returns a ``(succeeded, errors)`` tuple.
+        """
+        if self.disable_indexing:
+            return 0, []
+
+        if self.digests is not None:
+            actions = self._skip_unchanged(actions)
+        chunks = self._bulk_chunks(actions, chunk_size, max_chunk_bytes)
+        if thread_count > 1:
+            results = self._send_bulk_chunks_threaded(chunks, thread_count)
+        else:
+            results = (self._send_bulk_chunk(chunk, lines)
+                       for chunk, lines in chunks)
+
+        succeeded = 0
+        errors = []
+        for sent, chunk_errors in results:
+            succeeded += sent - len(chunk_errors)
+            errors.extend(chunk_errors)
+
+        if errors and raise_on_error:
+            raise ElasticBulkError(errors)
+        return succeeded, errors
+
+    def _send_bulk_chunks_threaded(self, chunks, thread_count):
+        """
+        Send chunks using a pool of ``thread_count`` threads, yielding the
+        results of ``_send_bulk_chunk()`` in order.
+        """
+        recorders = self._recorders()
+
+        def send(chunk, lines):
+            # Record the requests made by the workers with the recorders of
+            # the calling thread.
+            self._local.recorders = recorders
+            return self._send_bulk_chunk(chunk, lines)
+
+        pool = ThreadPool(thread_count)
+        pending = deque()
+        try:
+            for chunk, lines in chunks:
+                if len(pending) >= thread_count * 2:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(send, (chunk, lines)))
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _bulk_objects(self, actions, chunk_size, max_chunk_bytes,
+                      thread_count):
+        succeeded, errors = self.bulk(actions,
+                                      chunk_size=chunk_size,
+                                      max_chunk_bytes=max_chunk_bytes,
+                                      thread_count=thread_count,
+                                      raise_on_error=False)
+        for error in errors:
+            log.warning('Bulk action failed: %r', error)
+        return succeeded, len(errors)
+
+    def index_objects(self, objects, chunk_size=BULK_CHUNK_SIZE,
+                      max_chunk_bytes=BULK_MAX_CHUNK_BYTES, thread_count=1,
+                      immediate=False):
         """
         Add multiple objects to the index.
+
+        ``objects`` can be any iterable, such as a SQLAlchemy query using
+        ``yield_per()``: it is consumed lazily and sent in bulk requests, see
+        :py:meth:`bulk` for the meaning of the other arguments.
+
+        When the client is used with transactions, the objects are enqueued
+        like with :py:meth:`index_object`, unless ``immediate`` is True.
+        Otherwise, returns a ``(succeeded, failed)`` tuple of counts.
+        """
+        if self.use_transaction and not immediate:
+            for obj in objects:
+                self.index_object(obj)
+            return
+        actions = (self._index_object_action(obj) for obj in objects)
+        return self._bulk_objects(actions, chunk_size, max_chunk_bytes,
+                                  thread_count)
+
+    def delete_objects(self, objects, safe=False, chunk_size=BULK_CHUNK_SIZE,
+                       max_chunk_bytes=BULK_MAX_CHUNK_BYTES, thread_count=1,
+                       immediate=False):
+        """
+        Delete the indexed documents for multiple objects. Behaves like
+        :py:meth:`index_objects`.
         """
-        for obj in objects:
-            self.index_object(obj)
+        if self.use_transaction and not immediate:
+            for obj in objects:
+                self.delete_object(obj, safe=safe)
+            return
+        actions = (self._delete_object_action(obj, safe=safe)
+                   for obj in objects)
+        return self._bulk_objects(actions, chunk_size, max_chunk_bytes,
+                                  thread_count)
 
     def flush(self, force=True):
         self.es.indices.flush(force=force)
@@ -350,8 +1304,73 @@ class ElasticClient(object):
         Retrieve the ES source document for a given object or (document type,
         id) pair.
         """
+        kwargs = self._get_kwargs(obj, routing)
+        scope = self._request_scope()
+        if scope is None:
+            return ElasticResultRecord(self._call('get', **kwargs))
+
+        key = (kwargs['doc_type'], kwargs['id'], kwargs.get('routing'))
+        record = scope.documents.get(key)
+        if record is None:
+            record = scope.documents[key] = \
+                ElasticResultRecord(self._call('get', **kwargs))
+        return record
+
+    def get_many(self, objs, fields=None, chunk_size=MGET_CHUNK_SIZE):
+        """
+        Retrieve the ES source documents for a sequence of objects, (document
+        type, id) pairs or (document type, id, routing) triples, using one
+        ``_mget`` request per ``chunk_size`` documents. Parent routing is
+        resolved like :py:meth:`get` does.
+
+        Returns a list of :py:class:`.result.ElasticResultRecord` instances
+        in the same order as ``objs``, with None in place of the documents
+        which were not found.
+        """
+        specs = [self._get_kwargs(obj) for obj in objs]
+        keys = [(spec['doc_type'], spec['id'], spec.get('routing'))
+                for spec in specs]
+
+        scope = self._request_scope()
+        found = {}
+        if scope is not None and fields is None:
+            found = dict((key, scope.documents[key]) for key in keys
+                         if key in scope.documents)
+
+        missing = [key for key in OrderedDict.fromkeys(keys)
+                   if key not in found]
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            docs = []
+            for doc_type, doc_id, routing in chunk:
+                doc = {'_index': self.index, '_type': doc_type, '_id': doc_id}
+                if routing:
+                    doc['_routing'] = routing
+                docs.append(doc)
+            query_params = {}
+            if fields:
+                query_params['fields'] = fields
+            resp = self._call('mget', body={'docs': docs},
+                              **query_params)
+            for key, raw in zip(chunk, resp['docs']):
+                if 'error' in raw:
+                    log.warning('Failed to get document %r: %r', key,
+                                raw['error'])
+                if not raw.get('found'):
+                    found[key] = None
+                    continue
+                found[key] = record = ElasticResultRecord(raw)
+                if scope is not None and fields is None:
+                    scope.documents[key] = record
+
+        return [found[key] for key in keys]
+
+    def _get_kwargs(self, obj, routing=None):
         if isinstance(obj, tuple):
-            doc_type, doc_id = obj
+            if len(obj) == 3:
+                doc_type, doc_id, routing = obj
+            else:
+                doc_type, doc_id = obj
         else:
             doc_type, doc_id = obj.__class__.__name__, obj.id
             if obj.elastic_parent:
@@ -362,8 +1381,7 @@ class ElasticClient(object):
                       id=doc_id)
         if routing:
             kwargs['routing'] = routing
-        r = self.es.get(**kwargs)
-        return ElasticResultRecord(r)
+        return kwargs
 
     def refresh(self):
         """
@@ -383,7 +1401,39 @@ class ElasticClient(object):
     def search(self, body, classes=None, fields=None, **query_params):
         """
         Run ES search using default indexes.
+
+        If the client has a result cache, the response is looked up in the
+        cache first (except for scrolled searches).
         """
+        kwargs = self._search_kwargs(body, classes, fields, **query_params)
+        if 'scroll' in kwargs:
+            return self._call('search', **kwargs)
+
+        scope = self._request_scope()
+        if scope is None:
+            return self._cached_search(kwargs)
+
+        key = fingerprint(kwargs)
+        if key not in scope.searches:
+            doc_types = frozenset(t for t in kwargs['doc_type'].split(',')
+                                  if t)
+            scope.searches[key] = (doc_types, self._cached_search(kwargs))
+        return scope.searches[key][1]
+
+    def _cached_search(self, kwargs):
+        if self.cache is None:
+            return self._call('search', **kwargs)
+
+        key = self.cache.key(kwargs)
+        raw = self.cache.get(key)
+        if raw is None:
+            raw = self._call('search', **kwargs)
+            doc_types = [t for t in kwargs['doc_type'].split(',') if t]
+            self.cache.set(key, raw, doc_types)
+        return raw
+
+    def _search_kwargs(self, body, classes=None, fields=None,
+                       **query_params):
         doc_types = classes and list(chain.from_iterable(
             [doc_type] if isinstance(doc_type, six.string_types) else
             self.subtype_names(doc_type)
@@ -392,10 +1442,55 @@ class ElasticClient(object):
         if fields:
             query_params['fields'] = fields
 
-        return self.es.search(index=self.index,
-                              doc_type=','.join(doc_types),
-                              body=body,
-                              **query_params)
+        return dict(index=self.index,
+                    doc_type=','.join(doc_types),
+                    body=body,
+                    **query_params)
+
+    def msearch(self, searches):
+        """
+        Run several searches, given as lists of keyword arguments for
+        :py:meth:`search`, with one ``_msearch`` request. Returns the list of
+        responses, each of which may be an error.
+        """
+        lines = []
+        for kwargs in searches:
+            kwargs = dict(kwargs)
+            header = {'index': kwargs.pop('index')}
+            doc_type = kwargs.pop('doc_type')
+            if doc_type:
+                header['type'] = doc_type
+            body = dict(kwargs.pop('body'))
+            if 'from_' in kwargs:
+                kwargs['from'] = kwargs.pop('from_')
+            body.update(kwargs)
+            lines.append(_dumps(header))
+            lines.append(_dumps(body))
+        resp = self._call('msearch', body='\n'.join(lines) + '\n')
+        return resp['responses']
+
+    def batch(self):
+        """
+        Return an :py:class:`.batch.ElasticBatch`, to run several queries with
+        a single request.
+        """
+        return ElasticBatch(self)
+
+    def scroll(self, scroll_id, scroll):
+        """
+        Fetch the next batch of results for a scrolled search.
+        """
+        return self._call('scroll', scroll_id=scroll_id, scroll=scroll)
+
+    def clear_scroll(self, scroll_id):
+        """
+        Release the server-side context of a scrolled search.
+        """
+        try:
+            self._call('clear_scroll', scroll_id=scroll_id)
+        except NotFoundError:
+            # The scroll context already expired.
+            pass
 
     def query(self, *classes, **kw):
         """
@@ -0,0 +1,170 @@
+"""
+Stores for the digests of indexed documents, which let the client skip the
+writes of documents identical to the last version it indexed.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import threading
+
+from collections import OrderedDict
+
+
+class DigestStore(object):
+    """
+    Base class of the digest stores used by
+    :py:class:`.client.ElasticClient`. Before the client sends documents, it
+    computes a hash of their canonical JSON serialization, looks up the
+    digests stored for them, and skips the writes of those which didn't
+    change. The digests of the documents it sends are then stored, and those
+    of the documents it deletes, updates partially or fails to write are
+    dropped.
+
+    Digests are keyed by ``(index, doc_type, id, parent)`` tuples. Subclasses
+    implement :py:meth:`get_many`, :py:meth:`set_many`,
+    :py:meth:`delete_many` and :py:meth:`clear`, for instance to share
+    digests between processes with a key-value store.
+
+    If ``field`` is set, the client also adds the digest of each document it
+    sends to its source, as this field.
+
+    The ``checked`` and ``skipped`` counters hold the numbers of documents
+    which were looked up, and not sent because they didn't change.
+    """
+
+    field = None
+
+    def __init__(self):
+        self.checked = 0
+        self.skipped = 0
+        self._count_lock = threading.Lock()
+
+    def count(self, checked, skipped):
+        """
+        Add to the ``checked`` and ``skipped`` counters.
+        """
+        with self._count_lock:
+            self.checked += checked
+            self.skipped += skipped
+
+    def get_many(self, keys):
+        """
+        Return a dict of the digests stored for ``keys``, omitting the
+        missing ones.
+        """
+        raise NotImplementedError
+
+    def set_many(self, digests):
+        """
+        Store a dict of digests by key.
+        """
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """
+        Drop the digests of ``keys``.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Drop all digests, when the documents of the index are deleted or
+        replaced.
+        """
+        raise NotImplementedError
+
+
+class MemoryDigestStore(DigestStore):
+    """
+    A digest store in process memory, holding at most ``max_size`` digests
+    and evicting the least recently used ones first.
+
+    Documents changed by other processes, or deleted other than through the
+    client, are not noticed: their writes are skipped as long as their
+    digests are kept, if they are identical to the version the client last
+    sent. Use :py:class:`DocumentDigestStore` when that can happen.
+    """
+
+    def __init__(self, max_size=100000):
+        DigestStore.__init__(self)
+        self.max_size = max_size
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._digests)
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                digest = self._digests.pop(key, None)
+                if digest is not None:
+                    self._digests[key] = found[key] = digest
+        return found
+
+    def set_many(self, digests):
+        with self._lock:
+            for key, digest in digests.items():
+                self._digests.pop(key, None)
+                self._digests[key] = digest
+            while len(self._digests) > self.max_size:
+                self._digests.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._digests.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._digests.clear()
+
+
+class DocumentDigestStore(DigestStore):
+    """
+    A digest store keeping the digest of each document in the document
+    itself, as ``field``, and reading them with ``_mget`` requests made by
+    ``client``. It is always accurate, at the cost of one ``_mget`` request
+    per bulk chunk.
+
+    The field is added to the documents, so it should be mapped explicitly
+    (as a ``not_analyzed`` string, or ``keyword``), if at all.
+    """
+
+    def __init__(self, client, field='pyramid_es_digest'):
+        DigestStore.__init__(self)
+        self.client = client
+        self.field = field
+
+    def get_many(self, keys):
+        found = {}
+        by_index = OrderedDict()
+        for key in keys:
+            by_index.setdefault(key[0], []).append(key)
+        for index, index_keys in by_index.items():
+            client = self.client
+            if index != client.index:
+                client = client.for_index(index)
+            records = client.get_many([key[1:] for key in index_keys],
+                                      fields=[self.field])
+            for key, record in zip(index_keys, records):
+                if record is None:
+                    continue
+                digest = record.raw.get('fields', {}).get(self.field)
+                if isinstance(digest, list):
+                    digest = digest[0] if digest else None
+                if digest is not None:
+                    found[key] = digest
+        return found
+
+    def set_many(self, digests):
+        # Sent with the documents.
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
@@ -1,5 +1,6 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import six
 
 
 class DotDict(dict):
@@ -24,3 +25,118 @@ class DotDict(dict):
 
     def __repr__(self):
         return '<%s(%s)>' % (self.__class__.__name__, dict.__repr__(self))
+
+
+class LazyDotDict(DotDict):
+    """
+    A :py:class:`DotDict` which only does a shallow copy of its source dict.
+    Sub-dicts (and sub-dicts in lists) are converted to this class the first
+    time they are accessed, and the converted value is cached.
+
+    This is much cheaper than a ``DotDict`` for large nested documents of
+    which only a few keys are read.
+
+    ``dict()`` and ``**`` unpacking read the values without going through
+    ``__getitem__``: they get the same contents, but sub-dicts which were not
+    accessed yet are the plain dicts of the source. Use :py:meth:`copy` to
+    wrap all of them first. JSON serialization gives the same output either
+    way.
+    """
+
+    def __init__(self, d={}):
+        dict.__init__(self, d)
+        object.__setattr__(self, '_wrapped', set())
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key not in self._wrapped:
+            if hasattr(value, 'keys'):
+                value = LazyDotDict(value)
+            elif isinstance(value, list):
+                value = [LazyDotDict(el) if hasattr(el, 'keys') else el
+                         for el in value]
+            dict.__setitem__(self, key, value)
+            self._wrapped.add(key)
+        return value
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._wrapped.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._wrapped.discard(key)
+
+    def __getattr__(self, key):
+        # Private and special names which aren't keys must raise an
+        # AttributeError, for copy and pickle to look them up.
+        try:
+            return self[key]
+        except KeyError:
+            if key.startswith('_'):
+                raise AttributeError(key)
+            raise
+
+    __setattr__ = __setitem__
+    __delattr__ = __delitem__
+
+    def __reduce__(self):
+        # The values are copied as they are, along with the keys of those
+        # which are already wrapped.
+        return self.__class__, (dict(self),), set(self._wrapped)
+
+    def __setstate__(self, wrapped):
+        self._wrapped.update(wrapped)
+
+    def _wrap_all(self):
+        if len(self._wrapped) < len(self):
+            for key in list(dict.keys(self)):
+                self[key]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        self._wrap_all()
+        key, value = dict.popitem(self)
+        self._wrapped.discard(key)
+        return key, value
+
+    def values(self):
+        self._wrap_all()
+        return dict.values(self)
+
+    def items(self):
+        self._wrap_all()
+        return dict.items(self)
+
+    if six.PY2:
+        def itervalues(self):
+            self._wrap_all()
+            return dict.itervalues(self)
+
+        def iteritems(self):
+            self._wrap_all()
+            return dict.iteritems(self)
+
+    def copy(self):
+        self._wrap_all()
+        return dict.copy(self)
+
+    def __repr__(self):
+        self._wrap_all()
+        return DotDict.__repr__(self)
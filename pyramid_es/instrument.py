@@ -0,0 +1,117 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import sys
+import threading
+
+
+class ElasticCall(object):
+    """
+    A request made to ES through an instrumented client.
+
+    ``duration`` is the wall time of the call in seconds, and ``took`` the
+    processing time reported by the server in milliseconds (None if the
+    response has none). ``request_size`` and ``response_size`` are the sizes
+    in bytes of the serialized request body and response, and ``hits`` the
+    number of documents returned or written. ``call_site`` locates the code
+    outside pyramid_es which made the call.
+    """
+
+    def __init__(self, method, params, body, duration, took=None,
+                 request_size=0, response_size=0, hits=0, call_site=None,
+                 error=None):
+        self.method = method
+        self.params = params
+        self.body = body
+        self.duration = duration
+        self.took = took
+        self.request_size = request_size
+        self.response_size = response_size
+        self.hits = hits
+        self.call_site = call_site
+        self.error = error
+
+    def __repr__(self):
+        return '<ElasticCall %s %.1fms at %s>' % (
+            self.method, self.duration * 1000, self.call_site)
+
+
+class ElasticRecorder(object):
+    """
+    Collects the :py:class:`ElasticCall` instances made while it is active.
+    See :py:meth:`.client.ElasticClient.instrument`.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def totals(self):
+        """
+        Return the number of calls, their wall time and server processing
+        time in milliseconds, their request and response sizes and hit count,
+        as a dict.
+        """
+        calls = list(self.calls)
+        return dict(count=len(calls),
+                    duration=sum(call.duration for call in calls) * 1000,
+                    took=sum(call.took or 0 for call in calls),
+                    request_size=sum(call.request_size for call in calls),
+                    response_size=sum(call.response_size for call in calls),
+                    hits=sum(call.hits for call in calls))
+
+    def headers(self):
+        """
+        Return the totals as a dict of response headers.
+        """
+        totals = self.totals()
+        return {
+            'X-Elastic-Count': str(totals['count']),
+            'X-Elastic-Time': '%.1f' % totals['duration'],
+            'X-Elastic-Took': str(totals['took']),
+            'X-Elastic-Request-Size': str(totals['request_size']),
+            'X-Elastic-Response-Size': str(totals['response_size']),
+            'X-Elastic-Hits': str(totals['hits']),
+        }
+
+
+def call_site():
+    """
+    Return a ``file:line in function`` description of the innermost frame of
+    the current stack which is not in pyramid_es itself (tests excepted).
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if ((module != 'pyramid_es' and
+                not module.startswith('pyramid_es.')) or
+                module.startswith('pyramid_es.tests')):
+            code = frame.f_code
+            return '%s:%d in %s' % (code.co_filename, frame.f_lineno,
+                                    code.co_name)
+        frame = frame.f_back
+
+
+def response_hits(method, resp):
+    """
+    Return the number of documents returned or written by a call.
+    """
+    if not isinstance(resp, dict):
+        return 0
+    if method in ('search', 'scroll'):
+        return len(resp.get('hits', {}).get('hits', ()))
+    if method == 'msearch':
+        return sum(len(r.get('hits', {}).get('hits', ()))
+                   for r in resp.get('responses', ()))
+    if method == 'mget':
+        return sum(1 for doc in resp.get('docs', ()) if doc.get('found'))
+    if method == 'bulk':
+        return len(resp.get('items', ()))
+    if method == 'get':
+        return 1 if resp.get('found', True) else 0
+    if method in ('index', 'delete'):
+        return 1
+    return 0
@@ -0,0 +1,1190 @@
+"""
+An in-process, in-memory stand-in for the ``Elasticsearch`` client, for test
+suites which should not depend on a running server.
+
+It is selected by using a ``memory://`` server URL, for instance with the
+``elastic.servers = memory://`` setting. Clients using the same URL share the
+same data, within a process. Documents are stored with simple inverted
+indexes, and searches support the query DSL generated by
+:py:class:`.query.ElasticQuery`: ``match_all``, ``match``, ``term``,
+``terms``, ``range``, ``has_parent`` and ``has_child`` queries, ``filtered``,
+``bool``, ``and``, ``or`` and ``not`` filters, sorting, ``from`` / ``size``,
+``search_after``, scrolling, term and range facets and aggregations, and term
+suggesters. Indices can be accessed through aliases.
+
+String fields are analyzed by lowercasing and splitting on non-word
+characters, unless their mapping is ``not_analyzed``: analyzers, stemming and
+relevance scoring are only roughly approximated.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import copy
+import itertools
+import json
+import re
+import threading
+import uuid
+
+from collections import OrderedDict, defaultdict
+from functools import cmp_to_key
+
+import six
+
+from elasticsearch.exceptions import (ConflictError, NotFoundError,
+                                      RequestError)
+from elasticsearch.serializer import JSONSerializer
+
+_serializer = JSONSerializer()
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+DEFAULT_SIZE = 10
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def reset(name=None):
+    """
+    Drop all the data of the memory backend named ``name`` (the host part of
+    its ``memory://`` URL), or of all memory backends.
+    """
+    with _STORES_LOCK:
+        if name is None:
+            _STORES.clear()
+        else:
+            _STORES.pop(name, None)
+
+
+def _api_error(cls, status, error, info=None):
+    """
+    Build an exception of the elasticsearch package, whose constructor
+    signature depends on its version.
+    """
+    try:
+        from elastic_transport import ApiResponseMeta, HttpHeaders
+    except ImportError:
+        return cls(status, error, info)
+    meta = ApiResponseMeta(status=status, http_version='1.1',
+                           headers=HttpHeaders(), duration=0.0, node=None)
+    return cls(error, meta, info)
+
+
+def _unsupported(what):
+    return _api_error(RequestError, 400, 'unsupported',
+                      'The memory backend does not support %s' % (what,))
+
+
+def _analyze(text):
+    return _TOKEN_RE.findall(six.text_type(text).lower())
+
+
+def _leaves(source, prefix=''):
+    """
+    Yield the ``(path, value)`` pairs of the leaf values of a document, with
+    dotted paths for nested objects and one pair per element of lists.
+    """
+    if isinstance(source, dict):
+        for key, value in source.items():
+            for leaf in _leaves(value, prefix + key + '.'):
+                yield leaf
+    elif isinstance(source, list):
+        for value in source:
+            for leaf in _leaves(value, prefix):
+                yield leaf
+    elif source is not None:
+        yield prefix[:-1], source
+
+
+def _values(source, path):
+    """
+    Return the list of values of the field ``path`` in a document.
+    """
+    values = [source]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                value = [v.get(part) for v in value if isinstance(v, dict)]
+            elif isinstance(value, dict):
+                value = value.get(part)
+            else:
+                value = None
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+        values = found
+    return [value for value in values if not isinstance(value, dict)]
+
+
+def _compare(a, b):
+    if a == b:
+        return 0
+    try:
+        return -1 if a < b else 1
+    except TypeError:
+        return _compare(type(a).__name__, type(b).__name__)
+
+
+def _edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for ii, ca in enumerate(a, 1):
+        current = [ii]
+        for jj, cb in enumerate(b, 1):
+            current.append(min(previous[jj] + 1,
+                               current[jj - 1] + 1,
+                               previous[jj - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class _Document(object):
+
+    def __init__(self, doc_type, id, source, parent, version, seq):
+        self.doc_type = doc_type
+        self.id = id
+        self.source = source
+        self.parent = parent
+        self.version = version
+        self.seq = seq
+        self.terms = {}
+
+
+class _Index(object):
+    """
+    The documents, mappings and inverted indexes of one index.
+    """
+
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = settings or {}
+        self.mappings = {}
+        self.documents = OrderedDict()
+        self.postings = defaultdict(lambda: defaultdict(set))
+        self.seq = itertools.count()
+
+    def analyzed(self, doc_type, path):
+        mapping = self.mappings.get(doc_type, {})
+        for part in path.split('.'):
+            mapping = mapping.get('properties', {}).get(part)
+            if mapping is None:
+                return True
+        return (mapping.get('index') != 'not_analyzed' and
+                mapping.get('type', 'string') == 'string')
+
+    def terms(self, doc_type, path, value):
+        if isinstance(value, six.string_types):
+            if path == '_all' or self.analyzed(doc_type, path):
+                return _analyze(value)
+            return [value]
+        return [value]
+
+    def put(self, doc):
+        key = (doc.doc_type, doc.id)
+        self.remove(key)
+        all_terms = set()
+        terms = defaultdict(set)
+        terms['_id'].add(doc.id)
+        terms['_type'].add(doc.doc_type)
+        terms['_uid'].add('%s#%s' % key)
+        if doc.parent is not None:
+            terms['_parent'].add(doc.parent)
+        for path, value in _leaves(doc.source):
+            terms[path].update(self.terms(doc.doc_type, path, value))
+            all_terms.update(_analyze(value))
+        terms['_all'] = all_terms
+        for path, values in terms.items():
+            postings = self.postings[path]
+            for term in values:
+                postings[term].add(key)
+        doc.terms = terms
+        self.documents[key] = doc
+
+    def remove(self, key):
+        doc = self.documents.pop(key, None)
+        if doc is not None:
+            for path, values in doc.terms.items():
+                postings = self.postings[path]
+                for term in values:
+                    postings[term].discard(key)
+                    if not postings[term]:
+                        del postings[term]
+        return doc
+
+
+class _Store(object):
+    """
+    The indexes of one memory backend, shared by its clients.
+    """
+
+    def __init__(self):
+        self.indices = OrderedDict()
+        self.aliases = defaultdict(set)
+        self.scrolls = {}
+        self.lock = threading.RLock()
+
+
+class MemoryIndices(object):
+    """
+    The subset of the ``indices`` API of the ``Elasticsearch`` client used by
+    :py:class:`.client.ElasticClient`.
+    """
+
+    def __init__(self, es):
+        self.es = es
+
+    def exists(self, index, **kwargs):
+        store = self.es.store
+        with store.lock:
+            return all(name in store.indices or store.aliases.get(name)
+                       for name in index.split(','))
+
+    def create(self, index, body=None, **kwargs):
+        with self.es.store.lock:
+            if (index in self.es.store.indices or
+                    self.es.store.aliases.get(index)):
+                raise _api_error(RequestError, 400,
+                                 'index_already_exists_exception',
+                                 {'index': index})
+            body = body or {}
+            idx = self.es.store.indices[index] = _Index(
+                index, copy.deepcopy(body.get('settings', {})))
+            for doc_type, mapping in body.get('mappings', {}).items():
+                idx.mappings[doc_type] = copy.deepcopy(mapping)
+            return {'acknowledged': True}
+
+    def delete(self, index, **kwargs):
+        with self.es.store.lock:
+            for idx in self.es._indices(index):
+                self.es._remove_index(idx.name)
+            return {'acknowledged': True}
+
+    def get_settings(self, index=None, **kwargs):
+        with self.es.store.lock:
+            result = {}
+            for idx in self.es._indices(index):
+                settings = dict((k, v) for k, v in idx.settings.items()
+                                if k != 'index')
+                settings.update(idx.settings.get('index', {}))
+                result[idx.name] = {'settings': {'index': settings}}
+            return copy.deepcopy(result)
+
+    def put_settings(self, body, index=None, **kwargs):
+        with self.es.store.lock:
+            settings = body.get('index', body)
+            for idx in self.es._indices(index):
+                for key, value in settings.items():
+                    if key.startswith('index.'):
+                        key = key[len('index.'):]
+                    idx.settings.setdefault('index', {})[key] = value
+            return {'acknowledged': True}
+
+    def put_mapping(self, body, index=None, doc_type=None, **kwargs):
+        with self.es.store.lock:
+            for idx in self.es._indices(index):
+                for name, mapping in body.items():
+                    idx.mappings.setdefault(name, {}).update(
+                        copy.deepcopy(mapping))
+            return {'acknowledged': True}
+
+    def get_mapping(self, index=None, doc_type=None, **kwargs):
+        with self.es.store.lock:
+            types = doc_type and doc_type.split(',')
+            result = {}
+            for idx in self.es._indices(index):
+                mappings = dict((name, mapping)
+                                for name, mapping in idx.mappings.items()
+                                if not types or name in types)
+                if mappings or not types:
+                    result[idx.name] = {'mappings': mappings}
+            return copy.deepcopy(result)
+
+    def delete_mapping(self, index, doc_type, **kwargs):
+        with self.es.store.lock:
+            for idx in self.es._indices(index):
+                if doc_type not in idx.mappings:
+                    raise _api_error(NotFoundError, 404,
+                                     'type_missing_exception',
+                                     {'type': doc_type})
+                del idx.mappings[doc_type]
+                for key in [key for key in idx.documents
+                            if key[0] == doc_type]:
+                    idx.remove(key)
+            return {'acknowledged': True}
+
+    def refresh(self, index=None, **kwargs):
+        # Changes are visible immediately.
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def flush(self, index=None, **kwargs):
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def forcemerge(self, index=None, **kwargs):
+        with self.es.store.lock:
+            self.es._indices(index)
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def update_aliases(self, body, **kwargs):
+        store = self.es.store
+        with store.lock:
+            actions = body['actions']
+            # Check all the indices first, so that the update is atomic.
+            for action in actions:
+                op, spec = list(action.items())[0]
+                if op not in ('add', 'remove', 'remove_index'):
+                    raise _unsupported('the %r alias action' % op)
+                self.es._indices(spec['index'])
+                if op == 'remove' and (spec['index'] not in
+                                       store.aliases.get(spec['alias'], ())):
+                    raise _api_error(NotFoundError, 404,
+                                     'aliases_not_found_exception',
+                                     {'alias': spec['alias']})
+            for action in actions:
+                op, spec = list(action.items())[0]
+                if op == 'add':
+                    store.aliases[spec['alias']].add(spec['index'])
+                elif op == 'remove':
+                    store.aliases[spec['alias']].discard(spec['index'])
+                else:
+                    self.es._remove_index(spec['index'])
+            return {'acknowledged': True}
+
+    def get_alias(self, index=None, name=None, **kwargs):
+        store = self.es.store
+        with store.lock:
+            names = name.split(',') if name else list(store.aliases)
+            indices = (None if index in (None, '', '_all') else
+                       set(idx.name for idx in self.es._indices(index)))
+            result = {}
+            for alias in names:
+                for aliased in store.aliases.get(alias, ()):
+                    if indices is None or aliased in indices:
+                        result.setdefault(aliased, {'aliases': {}})[
+                            'aliases'][alias] = {}
+            if name and not result:
+                raise _api_error(NotFoundError, 404,
+                                 'aliases_not_found_exception',
+                                 {'alias': name})
+            return result
+
+    def exists_alias(self, name, index=None, **kwargs):
+        try:
+            self.get_alias(index=index, name=name)
+        except NotFoundError:
+            return False
+        return True
+
+
+class MemoryElasticsearch(object):
+    """
+    A replacement for the ``Elasticsearch`` client storing documents in
+    process memory, supporting the subset of its API used by
+    :py:class:`.client.ElasticClient`.
+    """
+
+    def __init__(self, hosts=None, **kwargs):
+        if isinstance(hosts, six.string_types):
+            hosts = [hosts]
+        name = hosts[0].partition('://')[2].rstrip('/') if hosts else ''
+        with _STORES_LOCK:
+            self.store = _STORES.get(name)
+            if self.store is None:
+                self.store = _STORES[name] = _Store()
+        self.indices = MemoryIndices(self)
+
+    def info(self, **kwargs):
+        return {'name': 'memory',
+                'version': {'number': '1.7.0'},
+                'tagline': 'You Know, for Search'}
+
+    def ping(self, **kwargs):
+        return True
+
+    def close(self):
+        pass
+
+    def _indices(self, index):
+        """
+        Return the indexes matching a comma-separated list of names or
+        aliases, or all of them for ``_all`` and None.
+        """
+        indices = self.store.indices
+        if index in (None, '', '_all'):
+            return list(indices.values())
+        if not isinstance(index, six.string_types):
+            index = ','.join(index)
+        result = []
+        for name in index.split(','):
+            if name in indices:
+                names = [name]
+            elif self.store.aliases.get(name):
+                names = sorted(self.store.aliases[name])
+            else:
+                raise _api_error(NotFoundError, 404,
+                                 'index_not_found_exception', {'index': name})
+            result.extend(indices[name] for name in names
+                          if indices[name] not in result)
+        return result
+
+    def _index(self, index, create=False):
+        if (create and index not in self.store.indices and
+                not self.store.aliases.get(index)):
+            self.store.indices[index] = _Index(index)
+        indices = self._indices(index)
+        if len(indices) > 1:
+            raise _api_error(RequestError, 400, 'illegal_argument_exception',
+                             'Alias [%s] has more than one index' % index)
+        return indices[0]
+
+    def _remove_index(self, name):
+        del self.store.indices[name]
+        for aliased in self.store.aliases.values():
+            aliased.discard(name)
+
+    # Documents
+
+    def _put(self, index, doc_type, id, body, parent=None, op_type='index'):
+        idx = self._index(index, create=True)
+        if id is None:
+            id = uuid.uuid4().hex
+        id = six.text_type(id)
+        previous = idx.documents.get((doc_type, id))
+        if previous is not None and op_type == 'create':
+            raise _api_error(ConflictError, 409,
+                             'document_already_exists_exception',
+                             {'_type': doc_type, '_id': id})
+        source = json.loads(_serializer.dumps(body))
+        version = previous.version + 1 if previous else 1
+        seq = previous.seq if previous else next(idx.seq)
+        if parent is not None:
+            parent = six.text_type(parent)
+        idx.put(_Document(doc_type, id, source, parent, version, seq))
+        return {'_index': idx.name, '_type': doc_type, '_id': id,
+                '_version': version, 'created': previous is None}
+
+    def index(self, index, doc_type, body, id=None, parent=None,
+              op_type='index', **kwargs):
+        with self.store.lock:
+            return self._put(index, doc_type, id, body, parent=parent,
+                             op_type=op_type)
+
+    def create(self, index, doc_type, body, id=None, parent=None, **kwargs):
+        return self.index(index, doc_type, body, id=id, parent=parent,
+                          op_type='create')
+
+    def _update(self, index, doc_type, id, body, parent=None):
+        idx = self._index(index, create=True)
+        doc = idx.documents.get((doc_type, six.text_type(id)))
+        if doc is None:
+            if 'upsert' in body:
+                source = body['upsert']
+            elif body.get('doc_as_upsert'):
+                source = body['doc']
+            else:
+                raise _api_error(NotFoundError, 404,
+                                 'document_missing_exception',
+                                 {'_type': doc_type, '_id': id})
+        elif 'doc' in body:
+            source = copy.deepcopy(doc.source)
+            source.update(body['doc'])
+        else:
+            raise _unsupported('scripted updates')
+        return self._put(index, doc_type, id, source,
+                         parent=parent if doc is None else doc.parent)
+
+    def update(self, index, doc_type, id, body, parent=None, **kwargs):
+        with self.store.lock:
+            return self._update(index, doc_type, id, body, parent=parent)
+
+    def _delete(self, index, doc_type, id):
+        idx = self._index(index)
+        doc = idx.remove((doc_type, six.text_type(id)))
+        result = {'_index': idx.name, '_type': doc_type,
+                  '_id': six.text_type(id), 'found': doc is not None}
+        if doc is None:
+            raise _api_error(NotFoundError, 404, 'not_found', result)
+        result['_version'] = doc.version + 1
+        return result
+
+    def delete(self, index, doc_type, id, **kwargs):
+        with self.store.lock:
+            return self._delete(index, doc_type, id)
+
+    def _get(self, index, doc_type, id, fields=None):
+        idx = self._index(index)
+        id = six.text_type(id)
+        if doc_type in (None, '_all'):
+            doc = next((doc for key, doc in idx.documents.items()
+                        if key[1] == id), None)
+        else:
+            doc = idx.documents.get((doc_type, id))
+        if doc is None:
+            return {'_index': idx.name, '_type': doc_type, '_id': id,
+                    'found': False}
+        result = {'_index': idx.name, '_type': doc.doc_type, '_id': id,
+                  '_version': doc.version, 'found': True}
+        self._add_source(result, doc, fields)
+        return result
+
+    def get(self, index, id, doc_type='_all', fields=None, **kwargs):
+        with self.store.lock:
+            result = self._get(index, doc_type, id, fields=fields)
+        if not result['found']:
+            raise _api_error(NotFoundError, 404, 'not_found', result)
+        return result
+
+    def exists(self, index, id, doc_type='_all', **kwargs):
+        with self.store.lock:
+            return self._get(index, doc_type, id)['found']
+
+    def mget(self, body, index=None, doc_type=None, fields=None, **kwargs):
+        if isinstance(fields, six.string_types):
+            fields = fields.split(',')
+        if 'ids' in body:
+            specs = [{'_id': id} for id in body['ids']]
+        else:
+            specs = body['docs']
+        docs = []
+        with self.store.lock:
+            for spec in specs:
+                try:
+                    docs.append(self._get(spec.get('_index', index),
+                                          spec.get('_type', doc_type),
+                                          spec['_id'],
+                                          fields=spec.get('fields', fields)))
+                except NotFoundError:
+                    docs.append({'_index': spec.get('_index', index),
+                                 '_type': spec.get('_type', doc_type),
+                                 '_id': six.text_type(spec['_id']),
+                                 'error': 'index_not_found_exception'})
+        return {'docs': docs}
+
+    def _add_source(self, hit, doc, fields):
+        if fields is None:
+            hit['_source'] = copy.deepcopy(doc.source)
+            return
+        hit['fields'] = values = {}
+        for field in fields:
+            if field == '_source':
+                hit['_source'] = copy.deepcopy(doc.source)
+                continue
+            found = _values(doc.source, field)
+            if found:
+                values[field] = copy.deepcopy(found)
+
+    def bulk(self, body, index=None, doc_type=None, **kwargs):
+        """
+        Apply a bulk request, given as newline-delimited JSON or as a list of
+        actions and sources.
+        """
+        if isinstance(body, six.binary_type):
+            body = body.decode('utf-8')
+        if isinstance(body, six.string_types):
+            lines = [json.loads(line) for line in body.splitlines()
+                     if line.strip()]
+        else:
+            lines = list(body)
+
+        items = []
+        lines = iter(lines)
+        with self.store.lock:
+            for action in lines:
+                op, meta = next(iter(action.items()))
+                target = meta.get('_index', index)
+                type_ = meta.get('_type', doc_type)
+                id = meta.get('_id')
+                parent = meta.get('_parent', meta.get('parent'))
+                item = {'_index': target, '_type': type_, '_id': id}
+                try:
+                    if op in ('index', 'create'):
+                        result = self._put(target, type_, id, next(lines),
+                                           parent=parent, op_type=op)
+                        item.update(result)
+                        item['status'] = 201 if result['created'] else 200
+                    elif op == 'update':
+                        item.update(self._update(target, type_, id,
+                                                 next(lines), parent=parent))
+                        item['status'] = 200
+                    elif op == 'delete':
+                        item.update(self._delete(target, type_, id))
+                        item['status'] = 200
+                    else:
+                        raise _unsupported('bulk %r actions' % op)
+                except (NotFoundError, ConflictError, RequestError) as e:
+                    item['status'] = _status(e)
+                    if op == 'delete' and item['status'] == 404:
+                        item['found'] = False
+                    else:
+                        item['error'] = _error_type(e)
+                items.append({op: item})
+        errors = any('error' in result
+                     for item in items for result in item.values())
+        return {'took': 0, 'errors': errors, 'items': items}
+
+    # Search
+
+    def search(self, index=None, doc_type=None, body=None, size=None,
+               from_=None, fields=None, scroll=None, **kwargs):
+        body = dict(body or {})
+        if size is None:
+            size = body.pop('size', DEFAULT_SIZE)
+        if from_ is None:
+            from_ = body.pop('from', 0)
+        if fields is None:
+            fields = body.pop('fields', None)
+        if isinstance(fields, six.string_types):
+            fields = fields.split(',')
+        if isinstance(doc_type, six.string_types):
+            doc_type = [t for t in doc_type.split(',') if t]
+
+        with self.store.lock:
+            resp, hits = self._search(index, doc_type, body, fields)
+
+        if scroll:
+            scroll_id = uuid.uuid4().hex
+            self.store.scrolls[scroll_id] = (hits[size:], size)
+            resp['_scroll_id'] = scroll_id
+            resp['hits']['hits'] = hits[:size]
+        else:
+            resp['hits']['hits'] = hits[from_:from_ + size]
+        return resp
+
+    def scroll(self, scroll_id, scroll=None, **kwargs):
+        try:
+            hits, size = self.store.scrolls[scroll_id]
+        except KeyError:
+            raise _api_error(NotFoundError, 404, 'search_context_missing',
+                             {'scroll_id': scroll_id})
+        self.store.scrolls[scroll_id] = (hits[size:], size)
+        return {'_scroll_id': scroll_id, 'took': 0, 'timed_out': False,
+                'hits': {'total': len(hits), 'hits': hits[:size]}}
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs):
+        if isinstance(scroll_id, six.string_types):
+            scroll_id = scroll_id.split(',')
+        for id in scroll_id or []:
+            if self.store.scrolls.pop(id, None) is None:
+                raise _api_error(NotFoundError, 404, 'search_context_missing',
+                                 {'scroll_id': id})
+        return {}
+
+    def msearch(self, body, index=None, doc_type=None, **kwargs):
+        if isinstance(body, six.binary_type):
+            body = body.decode('utf-8')
+        if isinstance(body, six.string_types):
+            lines = [json.loads(line) for line in body.splitlines()
+                     if line.strip()]
+        else:
+            lines = list(body)
+        responses = []
+        for header, search in zip(lines[::2], lines[1::2]):
+            try:
+                responses.append(self.search(
+                    index=header.get('index', index),
+                    doc_type=header.get('type', doc_type),
+                    body=search))
+            except (NotFoundError, RequestError) as e:
+                responses.append({'error': _error_type(e),
+                                  'status': _status(e)})
+        return {'responses': responses}
+
+    def count(self, index=None, doc_type=None, body=None, **kwargs):
+        resp = self.search(index=index, doc_type=doc_type, body=body, size=0)
+        return {'count': resp['hits']['total']}
+
+    def _search(self, index, doc_types, body, fields):
+        """
+        Run a search, returning the response without hits, and the list of
+        all the hits sorted.
+        """
+        indices = self._indices(index)
+        matches = []
+        for idx in indices:
+            keys = set(key for key in idx.documents
+                       if not doc_types or key[0] in doc_types)
+            scores = _Matcher(self, idx).query(body.get('query',
+                                                        {'match_all': {}}),
+                                               keys)
+            matches.extend((idx, idx.documents[key], score)
+                           for key, score in scores.items())
+
+        post_filter = body.get('post_filter')
+        sorted_by = _sort_specs(body.get('sort'))
+        matches = _sort(matches, sorted_by)
+
+        resp = {'took': 0, 'timed_out': False,
+                '_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        if body.get('facets'):
+            resp['facets'] = dict(
+                (name, _facet(spec, matches))
+                for name, spec in body['facets'].items())
+        aggs = body.get('aggs', body.get('aggregations'))
+        if aggs:
+            resp['aggregations'] = _aggregations(aggs, matches)
+        if body.get('suggest'):
+            resp['suggest'] = dict(
+                (name, _suggest(spec, indices))
+                for name, spec in body['suggest'].items())
+
+        if post_filter:
+            kept = {}
+            for idx in indices:
+                keys = set((doc.doc_type, doc.id)
+                           for i, doc, score in matches if i is idx)
+                kept[idx.name] = _Matcher(self, idx).query(post_filter, keys)
+            matches = [(idx, doc, score) for idx, doc, score in matches
+                       if (doc.doc_type, doc.id) in kept[idx.name]]
+
+        search_after = body.get('search_after')
+        hits = []
+        for idx, doc, score in matches:
+            hit = {'_index': idx.name, '_type': doc.doc_type,
+                   '_id': doc.id, '_score': None if sorted_by else score}
+            if sorted_by:
+                hit['sort'] = _sort_values(sorted_by, idx, doc, score)
+                if (search_after is not None and
+                        _compare_sort(sorted_by, hit['sort'],
+                                      search_after) <= 0):
+                    continue
+            self._add_source(hit, doc, fields)
+            hits.append(hit)
+
+        resp['hits'] = {
+            'total': len(matches),
+            'max_score': None if sorted_by or not matches else
+            max(score for idx, doc, score in matches),
+        }
+        return resp, hits
+
+
+def _status(e):
+    status = getattr(e, 'status_code', None)
+    if not isinstance(status, int):
+        meta = getattr(e, 'meta', None)
+        status = getattr(meta, 'status', 500)
+    return status
+
+
+def _error_type(e):
+    error = getattr(e, 'error', None) or getattr(e, 'message', None)
+    return error if isinstance(error, six.string_types) else repr(e)
+
+
+class _Matcher(object):
+    """
+    Evaluates queries and filters against the documents of an index,
+    returning the scores of the matching documents by key.
+    """
+
+    def __init__(self, es, index):
+        self.es = es
+        self.index = index
+
+    def query(self, q, keys):
+        if len(q) != 1:
+            raise _unsupported('query %r' % (q,))
+        kind, spec = next(iter(q.items()))
+        method = getattr(self, 'q_' + kind, None)
+        if method is None:
+            raise _unsupported('%r queries' % kind)
+        return method(spec, keys)
+
+    def _postings(self, field, term, keys):
+        return self.index.postings.get(field, {}).get(term, set()) & keys
+
+    def _ones(self, keys):
+        return dict((key, 1.0) for key in keys)
+
+    def q_match_all(self, spec, keys):
+        return self._ones(keys)
+
+    def q_match(self, spec, keys):
+        field, spec = next(iter(spec.items()))
+        if not isinstance(spec, dict):
+            spec = {'query': spec}
+        text = spec['query']
+        types = set(key[0] for key in keys)
+        if field == '_all' or any(self.index.analyzed(doc_type, field)
+                                  for doc_type in types):
+            terms = _analyze(text)
+        else:
+            terms = [text]
+        if not terms:
+            return {}
+        matched = [self._postings(field, term, keys) for term in terms]
+        if spec.get('operator', 'or').lower() == 'and':
+            found = set.intersection(*matched)
+        else:
+            found = set.union(*matched)
+        return dict((key, float(sum(key in m for m in matched)))
+                    for key in found)
+
+    def q_term(self, spec, keys):
+        field, value = next(iter(spec.items()))
+        if isinstance(value, dict):
+            value = value.get('value', value.get('term'))
+        if field in ('_id', '_parent'):
+            value = six.text_type(value)
+        return self._ones(self._postings(field, value, keys))
+
+    def q_terms(self, spec, keys):
+        found = set()
+        for field, values in spec.items():
+            if field in ('execution', 'minimum_should_match', 'boost',
+                         '_cache'):
+                continue
+            for value in values:
+                found |= set(self.q_term({field: value}, keys))
+        return self._ones(found)
+
+    def q_ids(self, spec, keys):
+        types = spec.get('type')
+        if isinstance(types, six.string_types):
+            types = [types]
+        ids = set(six.text_type(id) for id in spec.get('values', []))
+        return self._ones(key for key in keys
+                          if key[1] in ids and (not types or key[0] in types))
+
+    def q_range(self, spec, keys):
+        field, bounds = next(iter(spec.items()))
+        lower = upper = None
+        include_lower = include_upper = True
+        if 'from' in bounds or 'to' in bounds:
+            lower, upper = bounds.get('from'), bounds.get('to')
+            include_lower = bounds.get('include_lower', True)
+            include_upper = bounds.get('include_upper', True)
+        if 'gt' in bounds:
+            lower, include_lower = bounds['gt'], False
+        if 'gte' in bounds:
+            lower, include_lower = bounds['gte'], True
+        if 'lt' in bounds:
+            upper, include_upper = bounds['lt'], False
+        if 'lte' in bounds:
+            upper, include_upper = bounds['lte'], True
+
+        def in_range(value):
+            try:
+                if lower is not None and (value < lower or
+                                          value == lower and
+                                          not include_lower):
+                    return False
+                if upper is not None and (value > upper or
+                                          value == upper and
+                                          not include_upper):
+                    return False
+            except TypeError:
+                return False
+            return True
+
+        documents = self.index.documents
+        return self._ones(key for key in keys
+                          if any(in_range(value) for value in
+                                 _values(documents[key].source, field)))
+
+    def q_exists(self, spec, keys):
+        documents = self.index.documents
+        return self._ones(key for key in keys
+                          if _values(documents[key].source, spec['field']))
+
+    def q_missing(self, spec, keys):
+        return self._ones(set(keys) - set(self.q_exists(spec, keys)))
+
+    def q_filtered(self, spec, keys):
+        if 'filter' in spec:
+            keys = set(self.query(spec['filter'], keys))
+        return self.query(spec.get('query', {'match_all': {}}), keys)
+
+    def q_constant_score(self, spec, keys):
+        inner = spec.get('filter', spec.get('query'))
+        return self._ones(self.query(inner, keys))
+
+    def q_query(self, spec, keys):
+        # A query used as a filter.
+        return self.query(spec, keys)
+
+    def _clauses(self, spec):
+        if isinstance(spec, dict) and 'filters' in spec:
+            spec = spec['filters']
+        if isinstance(spec, dict):
+            spec = [spec]
+        return spec
+
+    def q_and(self, spec, keys):
+        for clause in self._clauses(spec):
+            keys = set(self.query(clause, keys))
+        return self._ones(keys)
+
+    def q_or(self, spec, keys):
+        found = set()
+        for clause in self._clauses(spec):
+            found |= set(self.query(clause, keys))
+        return self._ones(found)
+
+    def q_not(self, spec, keys):
+        if 'filter' in spec:
+            spec = spec['filter']
+        elif 'query' in spec:
+            spec = spec['query']
+        return self._ones(set(keys) - set(self.query(spec, keys)))
+
+    def q_bool(self, spec, keys):
+        scores = defaultdict(float)
+        for clause in self._clauses(spec.get('filter', [])):
+            keys = set(self.query(clause, keys))
+        for clause in self._clauses(spec.get('must_not', [])):
+            keys = keys - set(self.query(clause, keys))
+        must = self._clauses(spec.get('must', []))
+        for clause in must:
+            matched = self.query(clause, keys)
+            keys = set(matched)
+            for key, score in matched.items():
+                scores[key] += score
+        should = self._clauses(spec.get('should', []))
+        minimum = spec.get('minimum_should_match',
+                           0 if must or 'filter' in spec else 1)
+        if should:
+            counts = defaultdict(int)
+            for clause in should:
+                for key, score in self.query(clause, keys).items():
+                    counts[key] += 1
+                    scores[key] += score
+            keys = set(key for key in keys if counts[key] >= int(minimum))
+        return dict((key, scores.get(key) or 1.0) for key in keys)
+
+    def q_has_parent(self, spec, keys):
+        parent_type = spec.get('parent_type', spec.get('type'))
+        parents = set(key for key in self.index.documents
+                      if key[0] == parent_type)
+        parents = self.query(spec.get('query', spec.get('filter')), parents)
+        parent_ids = set(key[1] for key in parents)
+        documents = self.index.documents
+        return self._ones(key for key in keys
+                          if documents[key].parent in parent_ids)
+
+    def q_has_child(self, spec, keys):
+        child_type = spec.get('type', spec.get('child_type'))
+        children = set(key for key in self.index.documents
+                       if key[0] == child_type)
+        children = self.query(spec.get('query', spec.get('filter')), children)
+        documents = self.index.documents
+        parent_ids = set(documents[key].parent for key in children)
+        return self._ones(key for key in keys if key[1] in parent_ids)
+
+
+def _sort_specs(sort):
+    """
+    Normalize a ``sort`` clause to a list of ``(field, descending)`` pairs.
+    """
+    if not sort:
+        return []
+    if not isinstance(sort, list):
+        sort = [sort]
+    specs = []
+    for spec in sort:
+        if isinstance(spec, six.string_types):
+            field, order = spec, 'desc' if spec == '_score' else 'asc'
+        else:
+            field, order = next(iter(spec.items()))
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+        specs.append((field, order == 'desc'))
+    return specs
+
+
+def _sort_values(specs, index, doc, score):
+    values = []
+    for field, descending in specs:
+        if field == '_score':
+            values.append(score)
+        elif field == '_doc':
+            values.append(doc.seq)
+        elif field == '_uid':
+            values.append('%s#%s' % (doc.doc_type, doc.id))
+        elif field == '_id':
+            values.append(doc.id)
+        else:
+            found = _values(doc.source, field)
+            if not found:
+                values.append(None)
+            else:
+                pick = max if descending else min
+                values.append(pick(found, key=cmp_to_key(_compare)))
+    return values
+
+
+def _compare_sort(specs, a, b):
+    for (field, descending), x, y in zip(specs, a, b):
+        if x is None or y is None:
+            # Missing values sort last.
+            result = (x is None) - (y is None)
+        else:
+            result = _compare(x, y)
+            if descending:
+                result = -result
+        if result:
+            return result
+    return 0
+
+
+def _sort(matches, specs):
+    if not specs:
+        return sorted(matches, key=lambda m: (-m[2], m[1].seq))
+    decorated = [(_sort_values(specs, idx, doc, score), idx, doc, score)
+                 for idx, doc, score in matches]
+    decorated.sort(key=cmp_to_key(lambda a, b: (_compare_sort(specs, a[0],
+                                                              b[0]) or
+                                                a[2].seq - b[2].seq)))
+    return [(idx, doc, score) for values, idx, doc, score in decorated]
+
+
+def _terms_counts(field, matches):
+    counts = defaultdict(int)
+    missing = 0
+    for idx, doc, score in matches:
+        terms = doc.terms.get(field)
+        if not terms:
+            missing += 1
+        for term in terms or ():
+            counts[term] += 1
+    ranked = sorted(counts.items(),
+                    key=cmp_to_key(lambda a, b: (b[1] - a[1] or
+                                                 _compare(a[0], b[0]))))
+    return ranked, missing
+
+
+def _in_range(value, spec):
+    try:
+        return ((spec.get('from') is None or value >= spec['from']) and
+                (spec.get('to') is None or value < spec['to']))
+    except TypeError:
+        return False
+
+
+def _range_key(spec):
+    return '%s-%s' % ('*' if spec.get('from') is None else
+                      float(spec['from']),
+                      '*' if spec.get('to') is None else float(spec['to']))
+
+
+def _facet(spec, matches):
+    if 'terms' in spec:
+        spec = spec['terms']
+        ranked, missing = _terms_counts(spec['field'], matches)
+        size = spec.get('size', DEFAULT_SIZE)
+        total = sum(count for term, count in ranked)
+        shown = ranked[:size]
+        return {'_type': 'terms',
+                'missing': missing,
+                'total': total,
+                'other': total - sum(count for term, count in shown),
+                'terms': [{'term': term, 'count': count}
+                          for term, count in shown]}
+    if 'range' in spec:
+        spec = spec['range']
+        ranges = []
+        for bounds in spec['ranges']:
+            values = [value for idx, doc, score in matches
+                      for value in _values(doc.source, spec['field'])
+                      if _in_range(value, bounds)]
+            entry = dict(bounds)
+            entry.update(count=len(values), total_count=len(values),
+                         total=sum(values))
+            if values:
+                entry.update(min=min(values), max=max(values),
+                             mean=sum(values) / len(values))
+            ranges.append(entry)
+        return {'_type': 'range', 'ranges': ranges}
+    raise _unsupported('facet %r' % (spec,))
+
+
+_METRICS = {
+    'min': lambda values: min(values) if values else None,
+    'max': lambda values: max(values) if values else None,
+    'sum': lambda values: sum(values),
+    'avg': lambda values: sum(values) / len(values) if values else None,
+    'value_count': lambda values: len(values),
+}
+
+
+def _aggregations(aggs, matches):
+    result = {}
+    for name, spec in aggs.items():
+        spec = dict(spec)
+        sub = spec.pop('aggs', spec.pop('aggregations', None))
+        kind, params = next(iter(spec.items()))
+        if kind == 'terms':
+            ranked, missing = _terms_counts(params['field'], matches)
+            size = params.get('size', DEFAULT_SIZE) or len(ranked)
+            buckets = []
+            for term, count in ranked[:size]:
+                bucket = {'key': term, 'doc_count': count}
+                if sub:
+                    bucket.update(_aggregations(
+                        sub, [m for m in matches
+                              if term in m[1].terms.get(params['field'], ())]))
+                buckets.append(bucket)
+            result[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(count for term, count
+                                           in ranked[size:]),
+                'buckets': buckets}
+        elif kind == 'range':
+            buckets = []
+            for bounds in params['ranges']:
+                selected = [m for m in matches
+                            if any(_in_range(value, bounds) for value in
+                                   _values(m[1].source, params['field']))]
+                bucket = dict(bounds)
+                bucket.setdefault('key', _range_key(bounds))
+                bucket['doc_count'] = len(selected)
+                if sub:
+                    bucket.update(_aggregations(sub, selected))
+                buckets.append(bucket)
+            result[name] = {'buckets': buckets}
+        elif kind in _METRICS:
+            values = [value for idx, doc, score in matches
+                      for value in _values(doc.source, params['field'])]
+            result[name] = {'value': _METRICS[kind](values)}
+        else:
+            raise _unsupported('%r aggregations' % kind)
+    return result
+
+
+def _suggest(spec, indices):
+    text = spec['text']
+    params = spec['term']
+    field = params['field']
+    mode = params.get('suggest_mode', 'missing')
+    size = params.get('size', 5)
+    max_edits = params.get('max_edits', 2)
+
+    frequencies = defaultdict(int)
+    for idx in indices:
+        for term, keys in idx.postings.get(field, {}).items():
+            if isinstance(term, six.string_types):
+                frequencies[term] += len(keys)
+
+    entries = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group().lower()
+        options = []
+        if not (mode == 'missing' and token in frequencies):
+            for term, freq in frequencies.items():
+                if term == token or (mode == 'popular' and
+                                     freq <= frequencies.get(token, 0)):
+                    continue
+                distance = _edit_distance(token, term)
+                if distance <= max_edits:
+                    score = 1.0 - distance / max(len(token), len(term))
+                    options.append({'text': term, 'score': score,
+                                    'freq': freq})
+            if params.get('sort', 'score') == 'frequency':
+                options.sort(key=lambda o: (-o['freq'], -o['score'],
+                                            o['text']))
+            else:
+                options.sort(key=lambda o: (-o['score'], -o['freq'],
+                                            o['text']))
+        entries.append({'text': token, 'offset': match.start(),
+                        'length': len(token), 'options': options[:size]})
+    return entries
@@ -5,6 +5,12 @@ Utility classes intended to make it easier to specify Elastic Search mappings
 for model objects.
 """
 import copy
+from operator import attrgetter
+
+
+_mappings = {}
+_serializers = {}
+_dependencies = {}
 
 
 class ElasticParent(object):
@@ -40,13 +46,94 @@ class ElasticMixin(object):
         """
         raise NotImplementedError("ES classes must define a mapping")
 
+    @classmethod
+    def elastic_mapping_cached(cls):
+        """
+        Return the ES mapping for the current class, only calling
+        ``elastic_mapping()`` the first time. The returned mapping is shared,
+        and should not be modified.
+        """
+        mapping = _mappings.get(cls)
+        if mapping is None:
+            mapping = _mappings[cls] = cls.elastic_mapping()
+        return mapping
+
+    @classmethod
+    def elastic_serializer(cls):
+        """
+        Return the ES mapping for the current class compiled with
+        :py:meth:`ESMapping.compile`. It is compiled once per class.
+        """
+        serializer = _serializers.get(cls)
+        if serializer is None:
+            serializer = _serializers[cls] = \
+                cls.elastic_mapping_cached().compile()
+        return serializer
+
     def elastic_document(self):
         "Apply the class ES mapping to the current instance."
-        return self.elastic_mapping()(self)
+        return self.elastic_serializer()(self)
+
+    @classmethod
+    def elastic_fields_for(cls, attributes):
+        """
+        Return the set of the top-level fields of the documents of this class
+        whose values come from the given mapped attributes, or None if the
+        changes to these attributes can't be mapped to fields: when they
+        include the ID or parent ID, when ``elastic_document()`` is
+        overridden, or when some fields are not mapped attributes (such as
+        properties computed from other attributes).
+        """
+        dependencies = _dependencies.get(cls)
+        if dependencies is None:
+            dependencies = _dependencies[cls] = _field_dependencies(cls)
+        if dependencies is False:
+            return None
+        unmappable = set(['id'])
+        if cls.__elastic_parent__ is not None:
+            unmappable.add(cls.__elastic_parent__[1])
+        fields = set()
+        for attr in attributes:
+            if attr in unmappable:
+                return None
+            fields.update(dependencies.get(attr, ()))
+        return fields
+
+    def elastic_partial_document(self, fields):
+        """
+        Apply the given top-level fields of the class ES mapping to the
+        current instance.
+        """
+        properties = self.elastic_mapping_cached().properties
+        return dict((k, properties[k](self)) for k in fields)
 
     elastic_parent = ElasticParent()
 
 
+def _field_dependencies(cls):
+    """
+    Return a dict of the top-level fields of the mapping of a class by the
+    mapped attribute they come from, or False if some can't be determined.
+    """
+    document = getattr(cls.elastic_document, '__func__', cls.elastic_document)
+    if document is not getattr(ElasticMixin.elastic_document, '__func__',
+                               ElasticMixin.elastic_document):
+        return False
+    mapping = cls.elastic_mapping_cached()
+    properties = mapping.properties
+    if (properties is None or mapping.attr or mapping.name or
+            mapping.filter):
+        return False
+    mapped = set(cls.__mapper__.attrs.keys())
+    dependencies = {}
+    for k, v in properties.items():
+        attr = v.attr or v.name
+        if attr not in mapped:
+            return False
+        dependencies.setdefault(attr, set()).add(k)
+    return dependencies
+
+
 class ESMapping(object):
     """
     ESMapping defines a tree-like DSL for building Elastic Search mappings.
@@ -139,6 +226,60 @@ class ESMapping(object):
             return instance
         return dict((k, v(instance)) for k, v in self.properties.items())
 
+    def compile(self):
+        """
+        Return a function which, applied to an instance, returns the same
+        document as applying this mapping to it, but without walking the
+        mapping tree: attribute getters, filters and sub-mappings are all
+        resolved once, up front.
+
+        The mapping should not be modified after it has been compiled.
+        """
+        attr = self.attr or self.name
+        if attr is None:
+            get = None
+        elif '.' in attr:
+            # attrgetter() would follow the dots, unlike getattr().
+            def get(instance):
+                return getattr(instance, attr)
+        else:
+            get = attrgetter(attr)
+        filter = self.filter
+
+        if get and filter:
+            def prepare(instance):
+                return filter(get(instance))
+        else:
+            prepare = get or filter
+
+        properties = self.properties
+        if properties is None:
+            return prepare or _identity
+
+        children = [(k, _compile(v)) for k, v in properties.items()]
+        if prepare is None:
+            def serialize(instance):
+                return {k: f(instance) for k, f in children}
+        else:
+            def serialize(instance):
+                instance = prepare(instance)
+                return {k: f(instance) for k, f in children}
+        return serialize
+
+
+def _identity(instance):
+    return instance
+
+
+def _compile(mapping):
+    """
+    Compile a mapping node, unless it is a subclass which customizes how it
+    is applied to instances.
+    """
+    if getattr(type(mapping), '__call__', None) == ESMapping.__call__:
+        return mapping.compile()
+    return mapping
+
 
 class ESProp(ESMapping):
     "A leaf property."
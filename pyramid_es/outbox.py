@@ -0,0 +1,299 @@
+"""
+A transactional outbox for the writes of :py:class:`.client.ElasticClient`.
+
+With an outbox, the writes queued in a transaction are not sent to ES when it
+commits: they are stored as rows of a SQL table, in the same database
+transaction as the changes they reflect, and sent later by
+:py:class:`OutboxIndexer` (see the ``pyramid_es_outbox`` command). Writes are
+then neither lost if the process dies after the database commit, nor waited
+for by requests.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Boolean, Column, DateTime, Integer, MetaData, String,
+                        Table, Text, and_, or_, select)
+from sqlalchemy.orm import Session
+
+from .client import _dumps
+
+log = logging.getLogger(__name__)
+
+
+def outbox_table(metadata, name='pyramid_es_outbox'):
+    """
+    Define the outbox table in ``metadata``. Each row is the intent to index
+    or delete one document: the source of raw documents is stored, while
+    objects are loaded again by the indexer.
+    """
+    return Table(
+        name, metadata,
+        Column('id', Integer, primary_key=True),
+        Column('op', String(10), nullable=False),
+        Column('doc_type', String(100), nullable=False),
+        Column('doc_id', String(255), nullable=False),
+        Column('parent', String(255)),
+        Column('source', Text),
+        Column('safe', Boolean, nullable=False, default=False),
+        Column('created_at', DateTime, nullable=False,
+               default=datetime.utcnow),
+        Column('claimed_by', String(100), index=True),
+        Column('claimed_at', DateTime))
+
+
+def _object_args(obj, safe=False, **kw):
+    return obj, safe
+
+
+def _update_args(obj, attributes):
+    return obj, False
+
+
+def _document_args(id, doc_type, doc=None, parent=None, safe=False):
+    return id, doc_type, doc, parent, safe
+
+
+def _text(value):
+    return None if value is None else '%s' % (value,)
+
+
+class ElasticOutbox(object):
+    """
+    Stores the writes of the transactions of a client in ``table`` (by
+    default, ``pyramid_es_outbox`` as defined by :py:func:`outbox_table`)
+    through ``session``, which must take part in the same transactions, as
+    with ``zope.sqlalchemy``. Set it as the ``outbox`` attribute of the
+    client, or use the ``elastic.outbox_session`` setting.
+    """
+
+    def __init__(self, session, table=None):
+        self.session = session
+        if table is None:
+            table = outbox_table(MetaData())
+        self.table = table
+
+    def create(self, bind=None):
+        """
+        Create the outbox table if it doesn't exist.
+        """
+        if bind is None:
+            bind = self.session.get_bind()
+        self.table.create(bind, checkfirst=True)
+
+    def intent(self, cmd, args, kwargs):
+        """
+        Return the outbox row for a write queued by the client, as the name
+        of the client method and its arguments.
+        """
+        if cmd in ('index_object', 'delete_object',
+                   'update_object_attributes'):
+            # Updated objects are indexed whole by the indexer, which
+            # doesn't know what changed.
+            if cmd == 'update_object_attributes':
+                obj, safe = _update_args(*args, **kwargs)
+            else:
+                obj, safe = _object_args(*args, **kwargs)
+            row = dict(doc_type=obj.__class__.__name__,
+                       doc_id=_text(obj.id),
+                       parent=_text(obj.elastic_parent),
+                       source=None, safe=safe)
+        else:
+            id, doc_type, doc, parent, safe = _document_args(*args, **kwargs)
+            row = dict(doc_type=doc_type, doc_id=_text(id),
+                       parent=_text(parent), safe=safe,
+                       source=None if doc is None else _dumps(doc))
+        row['op'] = 'delete' if cmd.startswith('delete_') else 'index'
+        return row
+
+    def write(self, writes):
+        """
+        Insert the rows for the queued writes, an iterable of ``(cmd, args,
+        kwargs)`` tuples.
+        """
+        writes = list(writes)
+        if not writes:
+            return
+        # Objects added in the transaction get their IDs when flushed.
+        self.session.flush()
+        rows = [self.intent(cmd, args, kwargs) for cmd, args, kwargs in writes]
+        now = datetime.utcnow()
+        for row in rows:
+            row['created_at'] = now
+        self.session.execute(self.table.insert(), rows)
+        log.debug('Stored %d write(s) in the outbox', len(rows))
+
+
+class OutboxIndexer(object):
+    """
+    Sends the writes stored in an :py:class:`ElasticOutbox` to ES.
+
+    Batches of at most ``batch_size`` rows are claimed in a database
+    transaction of their own, so that several indexers can run at once.
+    Claims older than ``stale_after`` seconds are taken over, as the indexer
+    holding them has probably died. The writes of a batch are coalesced by
+    document, objects are loaded from the database in one query per class
+    (``classes`` being the mapped classes, e.g. from
+    :py:func:`.client.mapped_classes`) and the result is sent in ``_bulk``
+    requests. The rows are deleted once sent, or released for another try if
+    ES could not be reached. Failed writes are logged and dropped.
+    """
+
+    def __init__(self, client, outbox, classes, bind=None, batch_size=500,
+                 stale_after=300, worker=None):
+        self.client = client
+        self.outbox = outbox
+        self.classes = dict((cls.__name__, cls) for cls in classes)
+        if bind is None:
+            bind = outbox.session.get_bind()
+        self.bind = bind
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        if worker is None:
+            worker = '%s:%d:%s' % (socket.gethostname(), os.getpid(),
+                                   uuid.uuid4().hex[:8])
+        self.worker = worker
+        self.sent = 0
+        self.failed = 0
+
+    def claim(self):
+        """
+        Claim a batch of rows, and return them ordered by ID.
+        """
+        t = self.outbox.table
+        now = datetime.utcnow()
+        available = or_(t.c.claimed_by.is_(None),
+                        t.c.claimed_at < now - timedelta(
+                            seconds=self.stale_after))
+        ids = (select(t.c.id).where(available).order_by(t.c.id)
+               .limit(self.batch_size).scalar_subquery())
+        with self.bind.begin() as conn:
+            # Repeat the condition: a concurrent indexer may have claimed
+            # some of the rows since the subquery read them.
+            conn.execute(t.update()
+                         .where(and_(t.c.id.in_(ids), available))
+                         .values(claimed_by=self.worker, claimed_at=now))
+            return conn.execute(select(t).where(t.c.claimed_by == self.worker)
+                                .order_by(t.c.id)).fetchall()
+
+    def _release(self, ids):
+        t = self.outbox.table
+        with self.bind.begin() as conn:
+            conn.execute(t.update().where(t.c.id.in_(ids))
+                         .values(claimed_by=None, claimed_at=None))
+
+    def _delete(self, ids):
+        t = self.outbox.table
+        with self.bind.begin() as conn:
+            conn.execute(t.delete().where(t.c.id.in_(ids)))
+
+    def _load(self, session, cls, doc_ids):
+        column = cls.__mapper__.primary_key[0]
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:  # pragma: no cover
+            python_type = None
+        if python_type is not None and python_type is not str:
+            doc_ids = [python_type(doc_id) for doc_id in doc_ids]
+        objs = session.query(cls).filter(column.in_(doc_ids)).all()
+        return dict((_text(obj.id), obj) for obj in objs)
+
+    def actions(self, rows, session):
+        """
+        Coalesce claimed rows by document, and return their bulk actions.
+        """
+        latest = OrderedDict()
+        for row in rows:
+            key = (row.doc_type, row.doc_id, row.parent)
+            latest.pop(key, None)
+            latest[key] = row
+
+        to_load = {}
+        for row in latest.values():
+            if row.op == 'index' and row.source is None:
+                to_load.setdefault(row.doc_type, []).append(row.doc_id)
+        objects = {}
+        for doc_type, doc_ids in to_load.items():
+            cls = self.classes.get(doc_type)
+            if cls is None:
+                log.error('No mapped class for doc_type %r, skipping %d '
+                          'write(s)', doc_type, len(doc_ids))
+                continue
+            for doc_id, obj in self._load(session, cls, doc_ids).items():
+                objects[doc_type, doc_id] = obj
+
+        client = self.client
+        actions = []
+        for row in latest.values():
+            if row.op == 'delete':
+                actions.append(client._delete_document_action(
+                    id=row.doc_id, doc_type=row.doc_type, parent=row.parent,
+                    safe=row.safe))
+            elif row.source is not None:
+                actions.append(client._index_document_action(
+                    id=row.doc_id, doc_type=row.doc_type,
+                    doc=json.loads(row.source), parent=row.parent))
+            else:
+                obj = objects.get((row.doc_type, row.doc_id))
+                if obj is None:
+                    # Deleted since: the delete has its own row.
+                    log.debug('%s %s no longer exists', row.doc_type,
+                              row.doc_id)
+                    continue
+                actions.append(client._index_object_action(obj))
+        return actions
+
+    def run_once(self):
+        """
+        Claim and send one batch. Returns the number of rows processed.
+        """
+        rows = self.claim()
+        if not rows:
+            return 0
+        ids = [row.id for row in rows]
+        session = Session(bind=self.bind)
+        try:
+            actions = self.actions(rows, session)
+            succeeded, errors = self.client.bulk(actions,
+                                                 raise_on_error=False)
+        except Exception:
+            log.exception('Failed to send %d outbox row(s)', len(ids))
+            self._release(ids)
+            raise
+        finally:
+            session.close()
+        for error in errors:
+            log.warning('Bulk action failed: %r', error)
+        self.sent += succeeded
+        self.failed += len(errors)
+        self._delete(ids)
+        log.info('Sent %d outbox row(s) as %d action(s), %d failed',
+                 len(ids), len(actions), len(errors))
+        return len(ids)
+
+    def run(self, poll_interval=1.0, once=False):
+        """
+        Send batches until the outbox is empty if ``once`` is true, or
+        forever, polling every ``poll_interval`` seconds while it is empty.
+        """
+        while True:
+            try:
+                processed = self.run_once()
+            except Exception:
+                if once:
+                    raise
+                log.exception('Failed to process the outbox, retrying in '
+                              '%s seconds', poll_interval)
+                processed = 0
+            if not processed:
+                if once:
+                    return
+                time.sleep(poll_interval)
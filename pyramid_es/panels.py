@@ -0,0 +1,73 @@
+"""
+A pyramid_debugtoolbar panel listing the requests made to Elasticsearch
+while handling a request. Enable it with::
+
+    debugtoolbar.extra_panels = pyramid_es.panels.ElasticDebugPanel
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+
+import six
+
+from pyramid_debugtoolbar.panels import DebugPanel
+
+from . import get_client
+
+
+def _format_body(body):
+    if body is None:
+        return ''
+    if isinstance(body, six.string_types):
+        # Bulk and multi-search bodies are newline-delimited JSON.
+        return '\n'.join(_format_body(json.loads(line))
+                         for line in body.splitlines() if line)
+    return json.dumps(body, indent=2, sort_keys=True, default=repr)
+
+
+class ElasticDebugPanel(DebugPanel):
+    """
+    Debug toolbar panel showing, for each request made through the client,
+    its method, parameters, body, timing, sizes, hit count and call site.
+    """
+    name = 'elasticsearch'
+    title = 'Elasticsearch Queries'
+    nav_title = 'Elasticsearch'
+    template = 'pyramid_es:templates/elastic.dbtmako'
+
+    def __init__(self, request):
+        self.recorder = None
+        self.data = {'calls': [], 'totals': None}
+
+    @property
+    def has_content(self):
+        return bool(self.data['calls'])
+
+    @property
+    def nav_subtitle(self):
+        totals = self.data['totals']
+        if totals:
+            return '%d in %.2f ms' % (totals['count'], totals['duration'])
+
+    def wrap_handler(self, handler):
+        def elastic_panel_handler(request):
+            with get_client(request).instrument() as recorder:
+                self.recorder = recorder
+                return handler(request)
+        return elastic_panel_handler
+
+    def process_response(self, response):
+        if self.recorder is None:
+            return
+        calls = [dict(method=call.method,
+                      params=call.params,
+                      body=_format_body(call.body),
+                      duration=call.duration * 1000,
+                      took=call.took,
+                      request_size=call.request_size,
+                      response_size=call.response_size,
+                      hits=call.hits,
+                      call_site=call.call_site,
+                      error=call.error)
+                 for call in self.recorder.calls]
+        self.data = {'calls': calls, 'totals': self.recorder.totals()}
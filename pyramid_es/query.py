@@ -8,12 +8,17 @@ from collections import OrderedDict
 
 import six
 
-from .result import ElasticResult
+from .result import ElasticResult, ElasticResultRecord, decode_cursor
 
 log = logging.getLogger(__name__)
 
 ARBITRARILY_LARGE_SIZE = 10000
 
+SCROLL_BATCH_SIZE = 500
+SCROLL_TIMEOUT = '5m'
+
+TIEBREAKER = 'tiebreaker'
+
 
 def generative(f):
     """
@@ -47,6 +52,10 @@ class ElasticQuery(object):
     Represents a query to be issued against the ES backend.
     """
 
+    #: Field used to break ties between documents when paginating with
+    #: :py:meth:`after`. It must have a unique value for each document.
+    tiebreaker_field = '_uid'
+
     def __init__(self, client, classes=None, q=None):
         if not q:
             q = self.match_all_query()
@@ -65,6 +74,8 @@ class ElasticQuery(object):
 
         self._size = None
         self._start = None
+        self._keyset = False
+        self._search_after = None
 
     def _generate(self):
         s = self.__class__.__new__(self.__class__)
@@ -157,6 +168,9 @@ class ElasticQuery(object):
         """
         order = "desc" if desc else "asc"
         self.sorts['order_by_%s' % key] = {key: {"order": order}}
+        if TIEBREAKER in self.sorts:
+            # Keep the tie-breaker last.
+            self.sorts[TIEBREAKER] = self.sorts.pop(TIEBREAKER)
 
     @generative
     def add_facet(self, facet):
@@ -273,7 +287,24 @@ class ElasticQuery(object):
         self._size = n
     size = limit
 
-    def _search(self, start=None, size=None, fields=None):
+    @generative
+    def after(self, cursor=None):
+        """
+        Paginate with ``search_after`` rather than with an offset: return the
+        page of results following ``cursor``, which is the value of
+        :py:attr:`.result.ElasticResult.cursor` for the previous page, or None
+        for the first page. Use :py:meth:`limit` to set the page size.
+
+        The cost of fetching a page does not depend on how deep it is. A sort
+        on :py:attr:`tiebreaker_field` is added, so that the order of the
+        documents is total.
+        """
+        self._keyset = True
+        self._search_after = None if cursor is None else decode_cursor(cursor)
+        self.sorts.pop(TIEBREAKER, None)
+        self.sorts[TIEBREAKER] = {self.tiebreaker_field: {'order': 'asc'}}
+
+    def _query(self):
         q = copy.copy(self.base_query)
 
         if self.filters:
@@ -284,6 +315,19 @@ class ElasticQuery(object):
                     'query': q,
                 }
             }
+        return q
+
+    def _search(self, start=None, size=None, fields=None):
+        body, params = self._search_params(start=start, size=size)
+        return self.client.search(body, classes=self.classes, fields=fields,
+                                  **params)
+
+    def _search_params(self, start=None, size=None):
+        """
+        Build the body and the size / offset parameters of the search request
+        for this query.
+        """
+        q = self._query()
 
         q_start = self._start or 0
         q_size = self._size or ARBITRARILY_LARGE_SIZE
@@ -300,6 +344,12 @@ class ElasticQuery(object):
             'sort': list(self.sorts.values()),
             'query': q
         }
+        if self._keyset:
+            if q_start:
+                raise ValueError('An offset cannot be used when paginating '
+                                 'with after().')
+            if self._search_after is not None:
+                body['search_after'] = self._search_after
         if self.facets:
             body['facets'] = self.facets
         if self.aggregates:
@@ -307,15 +357,87 @@ class ElasticQuery(object):
         if self.suggests:
             body['suggest'] = self.suggests
 
-        return self.client.search(body, classes=self.classes, fields=fields,
-                                  size=q_size, from_=q_start)
+        return body, dict(size=q_size, from_=q_start)
 
     def execute(self, start=None, size=None, fields=None):
         """
         Execute this query and return a result set.
         """
-        return ElasticResult(self._search(start=start, size=size,
-                                          fields=fields))
+        return self._result(self._search(start=start, size=size,
+                                         fields=fields), size=size)
+
+    def _result(self, raw, size=None):
+        result = ElasticResult(raw)
+        if (size is None and self._size is None and
+                result.total > ARBITRARILY_LARGE_SIZE):
+            log.warning('Query matched %d documents, but only %d were '
+                        'returned: use iterate() to get all of them.',
+                        result.total, ARBITRARILY_LARGE_SIZE)
+        return result
+
+    def iterate(self, batch_size=SCROLL_BATCH_SIZE, scroll=SCROLL_TIMEOUT,
+                fields=None):
+        """
+        Iterate over all the documents matched by this query using the scroll
+        API, yielding :py:class:`.result.ElasticResultRecord` instances. Only
+        ``batch_size`` documents are fetched at once, and ``scroll`` is how
+        long ES should keep the scroll context alive between batches.
+
+        Sorts, and any offset or limit applied to the query, are honored. The
+        scroll context is cleared when the iterator is exhausted, closed or
+        garbage collected.
+        """
+        raw = self.client.search(self._scroll_body(), classes=self.classes,
+                                 fields=fields, size=batch_size,
+                                 scroll=scroll)
+        scroll_id = raw.get('_scroll_id')
+        window = self._scroll_window()
+        try:
+            while raw['hits']['hits']:
+                for hit in raw['hits']['hits']:
+                    keep = window(hit)
+                    if keep is None:
+                        return
+                    if keep:
+                        yield ElasticResultRecord(hit)
+                raw = self.client.scroll(scroll_id, scroll=scroll)
+                scroll_id = raw.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                self.client.clear_scroll(scroll_id)
+    scan = iterate
+
+    def _scroll_body(self):
+        return {
+            'sort': list(self.sorts.values()) or ['_doc'],
+            'query': self._query(),
+        }
+
+    def _scroll_window(self):
+        """
+        Return a function which applies the offset and limit of this query to
+        scrolled hits: it returns whether a hit should be kept, or None once
+        the limit has been reached.
+        """
+        state = {'skip': self._start or 0, 'remaining': self._size}
+
+        def window(hit):
+            if state['skip']:
+                state['skip'] -= 1
+                return False
+            if state['remaining'] is not None:
+                if state['remaining'] <= 0:
+                    return None
+                state['remaining'] -= 1
+            return True
+        return window
+
+    def defer(self, batch, start=None, size=None, fields=None):
+        """
+        Add this query to a :py:class:`.batch.ElasticBatch`, and return the
+        :py:class:`.batch.DeferredResult` of its execution.
+        """
+        return batch.add(self, start=start, size=size, fields=fields)
 
     def count(self):
         """
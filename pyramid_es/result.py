@@ -1,15 +1,46 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from .dotdict import DotDict
+import base64
+import binascii
+import json
+
+from .dotdict import DotDict, LazyDotDict
+
+
+def encode_cursor(values):
+    """
+    Encode the sort values of a search hit as an opaque, URL-safe cursor
+    string.
+    """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor returned by :py:func:`encode_cursor` to the list of sort
+    values it holds. Raises ``ValueError`` if the cursor is invalid.
+    """
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, binascii.Error, UnicodeError):
+        raise ValueError('Invalid cursor: %r' % cursor)
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor: %r' % cursor)
+    return values
 
 
 class ElasticResultRecord(object):
     """
     Wrapper for an Elasticsearch result record. Provides access to the indexed
     document, ES result data (like score), and the mapped object.
+
+    Unless ``lazy`` is False, nested parts of the raw record are only wrapped
+    in :py:class:`.dotdict.DotDict` instances when they are accessed.
     """
-    def __init__(self, raw):
-        self.raw = DotDict(raw)
+    def __init__(self, raw, lazy=True):
+        self.raw = LazyDotDict(raw) if lazy else DotDict(raw)
 
     def __repr__(self):
         return '<%s score:%s id:%s type:%s>' % (
@@ -43,11 +74,12 @@ class ElasticResult(object):
     Iterate over this object to yield document records, which are instances of
     :py:class:`ElasticResultRecord`.
     """
-    def __init__(self, raw):
+    def __init__(self, raw, lazy=True):
         self.raw = raw
+        self.lazy = lazy
 
     def __iter__(self):
-        return (ElasticResultRecord(record)
+        return (ElasticResultRecord(record, lazy=self.lazy)
                 for record in self.raw['hits']['hits'])
 
     def __repr__(self):
@@ -63,6 +95,18 @@ class ElasticResult(object):
         """
         return self.raw['hits']['total']
 
+    @property
+    def cursor(self):
+        """
+        Return an opaque cursor pointing after the last document of this
+        result set, to be passed to :py:meth:`.query.ElasticQuery.after` to
+        fetch the next page. Returns None if there are no documents, or the
+        query was not sorted.
+        """
+        hits = self.raw['hits']['hits']
+        if hits and 'sort' in hits[-1]:
+            return encode_cursor(hits[-1]['sort'])
+
     @property
     def facets(self):
         """
@@ -0,0 +1,52 @@
+"""
+Create the index, and put the mappings of model classes, for the application
+configured by an ini file. Run it once per deployment, rather than setting
+``elastic.ensure_index_on_start``, which runs in every worker process::
+
+    $ pyramid_es_ensure production.ini --base myapp.model.Base
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import logging
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+from pyramid.path import DottedNameResolver
+
+from .. import get_client
+
+log = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create the Elasticsearch index and mappings of an '
+        'application.')
+    parser.add_argument('config_uri',
+                        help='the application configuration, e.g. '
+                        'production.ini')
+    parser.add_argument('--base', action='append', default=[],
+                        help='dotted name of a declarative base class whose '
+                        'mappings are put (can be repeated)')
+    parser.add_argument('--recreate', action='store_true',
+                        help='delete and recreate the index and mappings')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+    try:
+        client = get_client(env['registry'])
+        client.ensure_index(recreate=args.recreate)
+        resolver = DottedNameResolver()
+        for name in args.base:
+            client.ensure_all_mappings(resolver.resolve(name),
+                                       recreate=args.recreate)
+        log.info('Index %r is ready', client.index)
+    finally:
+        env['closer']()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Send the writes stored in the outbox of the application configured by an ini
+file (see :py:mod:`pyramid_es.outbox`) to ES. Several instances can run at
+once::
+
+    $ pyramid_es_outbox production.ini --base myapp.model.Base
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import logging
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+from pyramid.path import DottedNameResolver
+
+from .. import get_client
+from ..client import mapped_classes
+from ..outbox import OutboxIndexer
+
+log = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Send the writes stored in the outbox of an application '
+        'to Elasticsearch.')
+    parser.add_argument('config_uri',
+                        help='the application configuration, e.g. '
+                        'production.ini')
+    parser.add_argument('--base', action='append', default=[],
+                        help='dotted name of a declarative base class whose '
+                        'objects are indexed (can be repeated)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='outbox rows claimed at once (default: '
+                        '%(default)s)')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='seconds to wait when the outbox is empty '
+                        '(default: %(default)s)')
+    parser.add_argument('--stale-after', type=float, default=300,
+                        help='seconds after which the rows claimed by '
+                        'another indexer are taken over (default: '
+                        '%(default)s)')
+    parser.add_argument('--create', action='store_true',
+                        help='create the outbox table if needed')
+    parser.add_argument('--once', action='store_true',
+                        help='exit when the outbox is empty')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+    try:
+        client = get_client(env['registry'])
+        if client.outbox is None:
+            parser.error('elastic.outbox_session is not set')
+        if args.create:
+            client.outbox.create()
+        resolver = DottedNameResolver()
+        classes = [cls for name in args.base
+                   for cls in mapped_classes(resolver.resolve(name))]
+        indexer = OutboxIndexer(client, client.outbox, classes,
+                                batch_size=args.batch_size,
+                                stale_after=args.stale_after)
+        log.info('Indexer %s started', indexer.worker)
+        try:
+            indexer.run(poll_interval=args.poll_interval, once=args.once)
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+        log.info('Indexer %s sent %d write(s), %d failed', indexer.worker,
+                 indexer.sent, indexer.failed)
+    finally:
+        env['closer']()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
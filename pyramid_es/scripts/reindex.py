@@ -0,0 +1,297 @@
+"""
+Rebuild the index from the database, for the application configured by an
+ini file. Every class mapped by the given declarative base classes is split
+into ranges of primary keys, which are indexed in parallel by a pool of
+processes::
+
+    $ pyramid_es_reindex production.ini --base myapp.model.Base \\
+        --session myapp.model.DBSession --processes 4
+
+The indexed ranges are recorded in a checkpoint file, so that an
+interrupted run started again with the same arguments resumes where it
+stopped, indexing the ranges which had failed documents again. The
+checkpoint is removed when a run completes without failures.
+
+With ``--swap``, a new version of the index is built while searches keep
+using the current one, and the index name is then pointed to it (see
+:py:meth:`.client.ElasticClient.rebuild_index`). This only happens once
+every range was indexed without failures, possibly over several runs.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+from timeit import default_timer
+
+import six
+from pyramid.paster import bootstrap, setup_logging
+from pyramid.path import DottedNameResolver
+from sqlalchemy import func
+
+from .. import get_client
+from ..client import mapped_classes
+
+log = logging.getLogger(__name__)
+
+# The state of a worker process, set up by init_worker().
+_worker = {}
+
+
+def class_name(cls):
+    return '%s:%s' % (cls.__module__, cls.__name__)
+
+
+def plan(session, classes, range_size):
+    """
+    Return the ``(class_name, low, high)`` tasks covering the rows of the
+    classes, ``low`` being inclusive and ``high`` exclusive. Tables with an
+    integer primary key are split into ranges of ``range_size`` keys, which
+    start at multiples of ``range_size`` so that they stay the same when rows
+    are added or deleted; other tables are indexed as one range, with None
+    bounds.
+    """
+    tasks = []
+    for cls in classes:
+        pk = cls.__mapper__.primary_key[0]
+        low, high = session.query(func.min(pk), func.max(pk)).one()
+        if low is None:
+            continue
+        if isinstance(low, six.integer_types):
+            for start in range(low - low % range_size, high + 1,
+                               range_size):
+                tasks.append((class_name(cls), start, start + range_size))
+        else:
+            tasks.append((class_name(cls), None, None))
+    return tasks
+
+
+def task_key(task):
+    name, low, high = task
+    return '%s[%s:%s]' % (name, '' if low is None else low,
+                          '' if high is None else high)
+
+
+def load_checkpoint(path, index):
+    """
+    Return the completed tasks recorded in a checkpoint file for ``index``,
+    as a dict of ``[succeeded, failed]`` counts by task key, and the index
+    version being built, if any.
+    """
+    if not os.path.exists(path):
+        return {}, None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('index') != index:
+        raise ValueError('Checkpoint %s is for index %r, not %r' %
+                         (path, checkpoint.get('index'), index))
+    return checkpoint['done'], checkpoint.get('target')
+
+
+def save_checkpoint(path, index, done, target=None):
+    """
+    Atomically replace the checkpoint file.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'index': index, 'done': done, 'target': target}, f)
+    getattr(os, 'replace', os.rename)(tmp, path)
+
+
+def init_worker(config_uri, session_name, chunk_size, target=None, env=None):
+    """
+    Set up a worker process, or the current one if ``env`` is the already
+    bootstrapped application, to index into ``target`` if given.
+    """
+    if env is None:
+        env = bootstrap(config_uri)
+    client = get_client(env['registry'])
+    if target is not None:
+        client = client.for_index(target)
+    _worker.update(
+        client=client,
+        session_factory=DottedNameResolver().resolve(session_name),
+        chunk_size=chunk_size)
+
+
+def index_range(task):
+    """
+    Index the objects of one task. Returns the task and the counts of
+    succeeded and failed documents.
+    """
+    name, low, high = task
+    cls = DottedNameResolver().resolve(name)
+    pk = cls.__mapper__.primary_key[0]
+    chunk_size = _worker['chunk_size']
+    session = _worker['session_factory']()
+    try:
+        q = session.query(cls).order_by(pk)
+        if low is not None:
+            q = q.filter(pk >= low)
+        if high is not None:
+            q = q.filter(pk < high)
+        succeeded, failed = _worker['client'].index_objects(
+            q.yield_per(chunk_size), chunk_size=chunk_size, immediate=True)
+    finally:
+        session.close()
+    return task, succeeded, failed
+
+
+def reindex(env, args):
+    client = get_client(env['registry'])
+    resolver = DottedNameResolver()
+
+    checkpoint = args.checkpoint or 'reindex-%s.json' % client.index
+    done, target = {}, None
+    if args.restart:
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    else:
+        done, target = load_checkpoint(checkpoint, client.index)
+        if done:
+            log.info('Resuming from %s: %d range(s) already indexed, %d with '
+                     'failures', checkpoint, len(done),
+                     len([counts for counts in done.values() if counts[1]]))
+
+    if args.swap:
+        if target is None:
+            target = client.create_index_version()
+            save_checkpoint(checkpoint, client.index, done, target)
+        log.info('Building index %r', target)
+        builder = client.for_index(target)
+    else:
+        client.ensure_index()
+        builder = client
+
+    classes = []
+    for name in args.base:
+        base = resolver.resolve(name)
+        builder.ensure_all_mappings(base)
+        classes.extend(cls for cls in mapped_classes(base)
+                       if hasattr(cls, 'elastic_mapping'))
+
+    session = resolver.resolve(args.session)()
+    try:
+        planned = plan(session, classes, args.range_size)
+    finally:
+        session.close()
+    # Ranges which are no longer planned, for instance because all their
+    # rows were deleted, are forgotten. Ranges with failed documents are
+    # indexed again.
+    keys = set(task_key(task) for task in planned)
+    done = dict((key, counts) for key, counts in done.items() if key in keys)
+    tasks = [task for task in planned if done.get(task_key(task), (0, 1))[1]]
+
+    total = len(planned)
+    documents = 0
+    start = default_timer()
+    log.info('Indexing %d range(s) with %d process(es)', len(tasks),
+             args.processes)
+
+    if args.processes > 1:
+        pool = multiprocessing.Pool(
+            args.processes, initializer=init_worker,
+            initargs=(args.config_uri, args.session, args.chunk_size,
+                      target))
+        results = pool.imap_unordered(index_range, tasks)
+    else:
+        pool = None
+        init_worker(args.config_uri, args.session, args.chunk_size, target,
+                    env=env)
+        results = six.moves.map(index_range, tasks)
+
+    try:
+        for task, task_succeeded, task_failed in results:
+            done[task_key(task)] = [task_succeeded, task_failed]
+            save_checkpoint(checkpoint, client.index, done, target)
+            documents += task_succeeded
+            elapsed = default_timer() - start
+            log.info('%d/%d range(s), %d document(s) indexed (%.0f/s), '
+                     '%d failed', len(done), total, documents,
+                     documents / elapsed if elapsed else 0,
+                     sum(counts[1] for counts in done.values()))
+    except KeyboardInterrupt:
+        log.warning('Interrupted, run again to resume from %s', checkpoint)
+        if pool is not None:
+            pool.terminate()
+        return 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Totals of the whole checkpoint, including the ranges indexed by
+    # previous runs.
+    indexed = sum(counts[0] for counts in done.values())
+    failed = sum(counts[1] for counts in done.values())
+    log.info('Indexed %d document(s) in %.1fs, %d in total, %d failed',
+             documents, default_timer() - start, indexed, failed)
+    if failed:
+        if target is not None:
+            log.error('Not using index %r', target)
+        log.warning('Run again to retry the ranges with failures, from %s',
+                    checkpoint)
+        return 1
+
+    if target is not None:
+        client.finish_index_version(target,
+                                    force_merge=not args.no_force_merge)
+        client.swap_index_version(target, delete_old=not args.keep_old)
+        log.info('Index %r now points to %r', client.index, target)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rebuild the Elasticsearch index of an application from '
+        'its database.')
+    parser.add_argument('config_uri',
+                        help='the application configuration, e.g. '
+                        'production.ini')
+    parser.add_argument('--base', action='append', default=[], required=True,
+                        help='dotted name of a declarative base class whose '
+                        'objects are indexed (can be repeated)')
+    parser.add_argument('--session', required=True,
+                        help='dotted name of the SQLAlchemy scoped session '
+                        'or session factory of the application')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='worker processes (default: %(default)s)')
+    parser.add_argument('--range-size', type=int, default=10000,
+                        help='primary keys per range (default: '
+                        '%(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='objects loaded and sent at once (default: '
+                        '%(default)s)')
+    parser.add_argument('--checkpoint',
+                        help='checkpoint file (default: '
+                        'reindex-<index>.json)')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint and index everything')
+    parser.add_argument('--swap', action='store_true',
+                        help='build a new version of the index, and point '
+                        'the index name to it when done')
+    parser.add_argument('--no-force-merge', action='store_true',
+                        help='with --swap, do not merge the segments of the '
+                        'new version')
+    parser.add_argument('--keep-old', action='store_true',
+                        help='with --swap, keep the previous version')
+    args = parser.parse_args(argv)
+
+    setup_logging(args.config_uri)
+    env = bootstrap(args.config_uri)
+    try:
+        return reindex(env, args)
+    finally:
+        env['closer']()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
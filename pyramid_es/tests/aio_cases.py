@@ -0,0 +1,112 @@
+"""
+Tests of :py:mod:`pyramid_es.aio`, which needs Python 3.6 or later: they are
+collected through ``test_aio`` on these versions only.
+"""
+import asyncio
+import json
+from unittest import TestCase
+
+from ..aio import AsyncElasticClient
+from .test_client import Todo
+
+
+class FakeAsyncES(object):
+
+    def __init__(self, num_hits=0):
+        self.hits = [{'_id': ii, '_type': 'Todo',
+                      '_source': {'description': 'Todo %d' % ii}}
+                     for ii in range(num_hits)]
+        self.calls = []
+
+    async def search(self, **kwargs):
+        self.calls.append(('search', kwargs))
+        size = kwargs['size']
+        start = kwargs.get('from_', 0)
+        return {'_scroll_id': 'scroll-%d' % start,
+                'hits': {'total': len(self.hits),
+                         'hits': self.hits[start:start + size]}}
+
+    async def scroll(self, scroll_id, scroll):
+        self.calls.append(('scroll', scroll_id))
+        start = int(scroll_id.split('-')[1]) + 2
+        return {'_scroll_id': 'scroll-%d' % start,
+                'hits': {'total': len(self.hits),
+                         'hits': self.hits[start:start + 2]}}
+
+    async def clear_scroll(self, scroll_id):
+        self.calls.append(('clear_scroll', scroll_id))
+
+    async def get(self, **kwargs):
+        self.calls.append(('get', kwargs))
+        return {'_id': kwargs['id'], '_type': kwargs['doc_type'],
+                '_source': {'description': 'Fetched'}}
+
+    async def bulk(self, body):
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.calls.append(('bulk', lines))
+        items = [{'index': {'status': 201}} for line in lines
+                 if 'index' in line]
+        return {'errors': False, 'items': items}
+
+
+def make_client(es):
+    client = AsyncElasticClient.__new__(AsyncElasticClient)
+    client.index = 'pyramid_es_tests_aio'
+    client.disable_indexing = False
+    client.es = es
+    return client
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestAsyncClient(TestCase):
+
+    def test_execute_and_count(self):
+        es = FakeAsyncES(5)
+        client = make_client(es)
+        q = client.query('Todo').filter_term('done', False).limit(3)
+
+        async def go():
+            return await asyncio.gather(q.execute(), q.count())
+        result, count = run(go())
+
+        self.assertEqual(count, 5)
+        self.assertEqual([rec.description for rec in result],
+                         ['Todo 0', 'Todo 1', 'Todo 2'])
+        kind, kwargs = es.calls[0]
+        self.assertEqual(kwargs['doc_type'], 'Todo')
+        self.assertEqual(kwargs['body']['query']['filtered']['filter'],
+                         {'and': [{'term': {'done': False}}]})
+
+    def test_get(self):
+        es = FakeAsyncES()
+        client = make_client(es)
+        todo = Todo(id=3, list_id=9)
+        record = run(client.get(todo))
+        self.assertEqual(record.description, 'Fetched')
+        self.assertEqual(es.calls[0][1]['routing'], 9)
+
+    def test_iterate(self):
+        es = FakeAsyncES(5)
+        client = make_client(es)
+
+        async def go():
+            return [rec._id async for rec in
+                    client.query('Todo').iterate(batch_size=2)]
+        self.assertEqual(run(go()), [0, 1, 2, 3, 4])
+        self.assertEqual(es.calls[-1], ('clear_scroll', 'scroll-6'))
+
+    def test_index_objects(self):
+        es = FakeAsyncES()
+        client = make_client(es)
+        todos = [Todo(id=ii, description='x') for ii in range(7)]
+        counts = run(client.index_objects(todos, chunk_size=2,
+                                          concurrency=3))
+        self.assertEqual(counts, (7, 0))
+        self.assertEqual(len(es.calls), 4)
@@ -0,0 +1,13 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import sys
+from unittest import TestCase, skipIf
+
+if sys.version_info >= (3, 6):
+    from .aio_cases import TestAsyncClient  # noqa
+else:
+    @skipIf(True, 'pyramid_es.aio needs Python 3.6 or later')
+    class TestAsyncClient(TestCase):
+
+        def test_skipped(self):
+            pass
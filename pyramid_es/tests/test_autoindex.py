@@ -0,0 +1,146 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+from pyramid.config import Configurator
+from sqlalchemy import Column, create_engine, event, types
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..autoindex import SessionIndexer
+from ..client import ElasticClient
+from ..mixin import ElasticMixin, ESMapping, ESString
+from .test_client import FakeES
+
+
+Base = declarative_base()
+
+
+class Note(Base, ElasticMixin):
+    __tablename__ = 'notes'
+    id = Column(types.Integer, primary_key=True)
+    text = Column(types.Unicode(40))
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('text')))
+
+
+class Plain(Base):
+    __tablename__ = 'plains'
+    id = Column(types.Integer, primary_key=True)
+
+
+class TestSessionIndexer(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_autoindex')
+        self.client.es = FakeES()
+        self.indexer = SessionIndexer(self.client)
+        self.session = Session(bind=self.engine)
+        self.indexer.listen(self.session)
+
+    def tearDown(self):
+        self.session.close()
+
+    def commit(self, f):
+        # With zope.sqlalchemy, the session would be committed by the
+        # transaction.
+        with transaction.manager:
+            f()
+        self.session.commit()
+        return self.client.es.requests
+
+    def ops(self, lines):
+        return [(list(line)[0], line[list(line)[0]]['_id'])
+                for line in lines
+                if list(line)[0] in ('index', 'delete')]
+
+    def test_writes_are_indexed_in_one_request(self):
+        def add():
+            self.session.add_all([Note(id=1, text='One'),
+                                  Note(id=2, text='Two'), Plain(id=1)])
+            self.session.flush()
+            self.session.add(Note(id=3, text='Three'))
+        requests = self.commit(add)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(self.ops(requests[0]),
+                         [('index', 1), ('index', 2), ('index', 3)])
+        self.assertEqual(requests[0][1], {'text': 'One'})
+        self.assertEqual(self.indexer.objects, 3)
+
+    def test_updates_and_deletes(self):
+        self.commit(lambda: self.session.add_all([Note(id=1, text='One'),
+                                                  Note(id=2, text='Two')]))
+
+        def change():
+            one, two = self.session.query(Note).order_by(Note.id)
+            one.text = 'Changed'
+            self.session.delete(two)
+        requests = self.commit(change)
+        self.assertEqual(self.ops(requests[1]),
+                         [('index', 1), ('delete', 2)])
+        self.assertEqual(requests[1][1], {'text': 'Changed'})
+
+    def test_unmodified_objects_are_skipped(self):
+        self.commit(lambda: self.session.add(Note(id=1, text='One')))
+
+        def touch():
+            self.session.query(Note).one().text = 'One'
+        self.assertEqual(len(self.commit(touch)), 1)
+
+    def test_objects_are_loaded_in_bulk(self):
+        self.commit(lambda: self.session.add_all(
+            [Note(id=ii, text='Note') for ii in range(5)]))
+
+        def change():
+            for note in self.session.query(Note):
+                note.text = 'Changed'
+            self.session.flush()
+            self.session.expunge_all()
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     statements.append(statement))
+        requests = self.commit(change)
+        self.assertEqual(len(self.ops(requests[1])), 5)
+        selects = [s for s in statements if s.startswith('SELECT')]
+        # Loading the notes to change them, then to index them.
+        self.assertEqual(len(selects), 2)
+
+    def test_abort_discards_writes(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.manager:
+                self.session.add(Note(id=1, text='One'))
+                self.session.flush()
+                raise RuntimeError
+        self.session.rollback()
+        self.assertEqual(self.commit(lambda: None), [])
+
+    def test_classes(self):
+        self.indexer.classes = (Plain,)
+        self.commit(lambda: self.session.add(Note(id=1, text='One')))
+        self.assertEqual(self.client.es.requests, [])
+
+
+Factory = sessionmaker()
+
+
+class TestIncludeme(TestCase):
+
+    def test_autoindex_session(self):
+        config = Configurator(settings={
+            'elastic.index': 'pyramid_es_tests_autoindex',
+            'elastic.autoindex_session':
+                'pyramid_es.tests.test_autoindex.Factory'})
+        config.include('pyramid_es')
+        indexer = config.registry.pyramid_es_session_indexer
+        self.assertIs(indexer.client, config.registry.pyramid_es_client)
+        self.assertTrue(event.contains(Factory, 'after_flush',
+                                       indexer.after_flush))
@@ -0,0 +1,138 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import threading
+import time
+from unittest import TestCase
+
+import transaction
+
+from .. import client_from_config
+from ..background import BackgroundIndexer
+from ..client import ElasticClient
+from .test_client import FakeES
+
+
+class GatedES(FakeES):
+    """
+    A FakeES whose bulk requests wait until ``gate`` is set, and which
+    records the threads they are made from.
+    """
+
+    def __init__(self):
+        FakeES.__init__(self)
+        self.gate = threading.Event()
+        self.threads = []
+
+    def bulk(self, body):
+        self.threads.append(threading.current_thread())
+        self.gate.wait(5)
+        return FakeES.bulk(self, body)
+
+
+class TestBackgroundIndexer(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_background',
+                                    use_transaction=True)
+        self.client.es = self.es = GatedES()
+        self.indexer = BackgroundIndexer(self.client, max_queue=1)
+        self.client.background = self.indexer
+
+    def tearDown(self):
+        self.es.gate.set()
+        self.indexer.stop()
+
+    def commit(self, *ids):
+        with transaction.manager:
+            for id in ids:
+                self.client.index_document(id=id, doc_type='Todo',
+                                           doc={'description': 'Todo'})
+
+    def sent_ids(self):
+        return [line['index']['_id'] for lines in self.es.requests
+                for line in lines if 'index' in line]
+
+    def test_commit_does_not_wait(self):
+        self.commit(1, 2)
+        self.assertEqual(self.es.requests, [])
+        self.es.gate.set()
+        self.assertTrue(self.indexer.flush(timeout=5))
+        self.assertEqual(self.sent_ids(), [1, 2])
+        self.assertNotIn(threading.current_thread(), self.es.threads)
+        self.assertEqual(self.indexer.sent, 2)
+
+    def test_flush_timeout(self):
+        self.commit(1)
+        self.assertFalse(self.indexer.flush(timeout=0.05))
+        self.es.gate.set()
+        self.assertTrue(self.indexer.wait(timeout=5))
+
+    def test_full_queue_keeps_order(self):
+        self.indexer.put_timeout = 0.05
+        # The first transaction is being sent, the second fills the queue.
+        self.commit(1)
+        while not self.es.threads:
+            threading.Event().wait(0.01)
+        self.commit(2)
+        timer = threading.Timer(0.2, self.es.gate.set)
+        timer.start()
+        # Waits past put_timeout, until the worker takes the second one.
+        self.commit(3)
+        timer.join()
+        self.assertTrue(self.indexer.flush(timeout=5))
+        self.assertEqual(self.sent_ids(), [1, 2, 3])
+        self.assertNotIn(threading.current_thread(), self.es.threads)
+
+    def test_stop_drains_queue(self):
+        self.commit(1)
+        self.commit(2)
+        self.es.gate.set()
+        self.indexer.stop(timeout=5)
+        self.assertEqual(self.sent_ids(), [1, 2])
+        # The worker is started again by the next write.
+        self.commit(3)
+        self.assertTrue(self.indexer.flush(timeout=5))
+        self.assertEqual(self.sent_ids(), [1, 2, 3])
+
+    def test_stop_timeout_with_full_queue(self):
+        self.commit(1)
+        while not self.es.threads:
+            threading.Event().wait(0.01)
+        self.commit(2)
+        start = time.time()
+        self.indexer.stop(timeout=0.1)
+        self.assertLess(time.time() - start, 2)
+        # The abandoned worker still sends what it was given.
+        self.es.gate.set()
+        self.assertTrue(self.indexer.flush(timeout=5))
+        self.assertEqual(self.sent_ids(), [1, 2])
+
+    def test_errors_are_counted(self):
+        self.es.fail_ids.add(2)
+        self.es.gate.set()
+        self.commit(1, 2)
+        self.assertTrue(self.indexer.flush(timeout=5))
+        self.assertEqual(self.indexer.sent, 1)
+        self.assertEqual(self.indexer.failed, 1)
+
+
+class TestBackgroundConfig(TestCase):
+
+    def test_settings(self):
+        client = client_from_config({
+            'elastic.index': 'pyramid_es_tests_background',
+            'elastic.background': 'true',
+            'elastic.background_queue_size': '5',
+            'elastic.background_put_timeout': '0.5',
+        })
+        indexer = client.background
+        self.assertIs(indexer.client, client)
+        self.assertEqual(indexer.max_queue, 5)
+        self.assertEqual(indexer.put_timeout, 0.5)
+        self.assertEqual(indexer.drain_timeout, 30)
+
+    def test_disabled_by_default(self):
+        client = client_from_config({
+            'elastic.index': 'pyramid_es_tests_background'})
+        self.assertIsNone(client.background)
@@ -0,0 +1,95 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+from unittest import TestCase
+
+from ..batch import ElasticQueryError
+from ..client import ElasticClient
+from .test_client import FakeES
+
+
+class MsearchFakeES(FakeES):
+
+    def __init__(self):
+        FakeES.__init__(self)
+        self.msearches = []
+        self.fail = False
+
+    def msearch(self, body):
+        if self.fail:
+            raise RuntimeError('Connection refused')
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.msearches.append(lines)
+        responses = []
+        for header, search in zip(lines[::2], lines[1::2]):
+            if header.get('type') == 'Broken':
+                responses.append({'error': 'SearchPhaseExecutionException'})
+                continue
+            hits = [{'_id': ii, '_type': header['type'],
+                     '_source': {'n': ii}}
+                    for ii in range(search['size'])]
+            responses.append({'hits': {'total': 42, 'hits': hits}})
+        return {'responses': responses}
+
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_batch')
+        self.client.es = MsearchFakeES()
+
+    def test_single_round_trip(self):
+        batch = self.client.batch()
+        main = self.client.query('Movie').order_by('year').limit(3)
+        main_result = main.defer(batch)
+        sidebar = batch.add(self.client.query('Genre'), size=2)
+        count = batch.add_count(self.client.query('Movie'))
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(self.client.es.msearches, [])
+
+        self.assertEqual([rec.n for rec in main_result.result()],
+                         [0, 1, 2])
+        self.assertEqual(len(self.client.es.msearches), 1)
+        self.assertEqual(len(list(sidebar.result())), 2)
+        self.assertEqual(count.result(), 42)
+        self.assertEqual(len(self.client.es.msearches), 1)
+
+        lines = self.client.es.msearches[0]
+        self.assertEqual(lines[0], {'index': 'pyramid_es_tests_batch',
+                                    'type': 'Movie'})
+        self.assertEqual(lines[1]['sort'], [{'year': {'order': 'asc'}}])
+        self.assertEqual((lines[1]['size'], lines[1]['from']), (3, 0))
+        self.assertEqual(lines[5]['size'], 0)
+
+    def test_error_per_query(self):
+        batch = self.client.batch()
+        good = batch.add(self.client.query('Movie').limit(1))
+        bad = batch.add(self.client.query('Broken'))
+        batch.execute()
+        self.assertEqual(good.result().total, 42)
+        with self.assertRaises(ElasticQueryError) as cm:
+            bad.result()
+        self.assertEqual(cm.exception.error,
+                         'SearchPhaseExecutionException')
+
+    def test_reuse(self):
+        batch = self.client.batch()
+        first = batch.add_count(self.client.query('Movie'))
+        first.result()
+        second = batch.add_count(self.client.query('Movie'))
+        second.result()
+        self.assertEqual(len(self.client.es.msearches), 2)
+        self.assertEqual(len(self.client.es.msearches[1]), 2)
+
+    def test_failed_request(self):
+        batch = self.client.batch()
+        count = batch.add_count(self.client.query('Movie'))
+        self.client.es.fail = True
+        for attempt in range(2):
+            with self.assertRaises(RuntimeError):
+                count.result()
+        self.assertEqual(len(batch), 1)
+        self.client.es.fail = False
+        self.assertEqual(count.result(), 42)
+        self.assertEqual(len(batch), 0)
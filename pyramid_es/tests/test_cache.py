@@ -0,0 +1,197 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+
+from ..cache import ResultCache
+from ..client import ElasticClient
+from .test_client import FakeES, Todo
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SearchingFakeES(FakeES):
+
+    def __init__(self):
+        FakeES.__init__(self)
+        self.searches = 0
+
+    def search(self, **kwargs):
+        self.searches += 1
+        return {'hits': {'total': self.searches, 'hits': []}}
+
+
+class TestResultCache(TestCase):
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_size=2)
+        cache.set('a', 1, ['Todo'])
+        cache.set('b', 2, ['Todo'])
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3, ['Todo'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), dict(size=2, hits=3, misses=1,
+                                             evictions=1, invalidations=0))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = ResultCache(ttl=10, clock=clock)
+        cache.set('a', 1, ['Todo'])
+        clock.now += 5
+        self.assertEqual(cache.get('a'), 1)
+        clock.now += 6
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.set('todo', 1, ['Todo'])
+        cache.set('list', 2, ['TodoList'])
+        cache.set('all', 3, [])
+        cache.invalidate(['Todo'])
+        self.assertIsNone(cache.get('todo'))
+        self.assertIsNone(cache.get('all'))
+        self.assertEqual(cache.get('list'), 2)
+        self.assertEqual(cache.invalidations, 2)
+
+    def test_refresh_interval(self):
+        clock = FakeClock()
+        cache = ResultCache(refresh_interval=1, clock=clock)
+        cache.invalidate(['Todo'])
+        # Responses may predate the refresh which makes the write visible.
+        cache.set('todo', 1, ['Todo'])
+        cache.set('all', 2, [])
+        cache.set('list', 3, ['TodoList'])
+        self.assertIsNone(cache.get('todo'))
+        self.assertIsNone(cache.get('all'))
+        self.assertEqual(cache.get('list'), 3)
+        clock.now += 1
+        cache.set('todo', 1, ['Todo'])
+        cache.set('all', 2, [])
+        self.assertEqual(cache.get('todo'), 1)
+        self.assertEqual(cache.get('all'), 2)
+
+    def test_key_canonical(self):
+        cache = ResultCache()
+        self.assertEqual(cache.key({'body': {'a': 1, 'b': 2}, 'size': 10}),
+                         cache.key({'size': 10, 'body': {'b': 2, 'a': 1}}))
+
+
+class TestClientCache(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_cache',
+                                    cache=ResultCache())
+        self.client.es = SearchingFakeES()
+
+    def test_search_cached(self):
+        q = self.client.query('Todo').filter_term('done', False)
+        self.assertEqual(q.count(), 1)
+        self.assertEqual(q.count(), 1)
+        self.assertEqual(self.client.query('Todo').count(), 2)
+        self.assertEqual(self.client.cache.hits, 1)
+
+    def test_scroll_not_cached(self):
+        q = self.client.query('Todo')
+        list(q.iterate())
+        self.assertEqual(len(self.client.cache), 0)
+
+    def test_commit_invalidates(self):
+        q = self.client.query('Todo')
+        self.assertEqual(q.count(), 1)
+        with transaction.manager:
+            self.client.index_object(Todo(id=1, description='New'))
+            self.assertEqual(q.count(), 1)
+        self.assertEqual(q.count(), 2)
+        # Not cached until the index is refreshed.
+        self.assertEqual(q.count(), 3)
+
+    def test_other_type_not_invalidated(self):
+        q = self.client.query('TodoList')
+        self.assertEqual(q.count(), 1)
+        with transaction.manager:
+            self.client.index_object(Todo(id=1, description='New'))
+        self.assertEqual(q.count(), 1)
+
+
+class GettingFakeES(SearchingFakeES):
+
+    def __init__(self):
+        SearchingFakeES.__init__(self)
+        self.gets = 0
+
+    def get(self, **kwargs):
+        self.gets += 1
+        return {'_id': kwargs['id'], '_type': kwargs['doc_type'],
+                '_source': {'description': 'Fetch %d' % self.gets}}
+
+
+class TestRequestScope(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_scope')
+        self.client.es = GettingFakeES()
+
+    def test_get_memoized(self):
+        todo = Todo(id=1, list_id=3)
+        with self.client.request_scope():
+            first = self.client.get(todo)
+            self.assertIs(self.client.get(('Todo', 1), routing=3), first)
+            self.client.get(('Todo', 2))
+        self.assertEqual(self.client.es.gets, 2)
+        self.client.get(todo)
+        self.assertEqual(self.client.es.gets, 3)
+
+    def test_search_memoized(self):
+        q = self.client.query('Todo')
+        with self.client.request_scope():
+            self.assertEqual(q.count(), 1)
+            self.assertEqual(q.count(), 1)
+        self.assertEqual(q.count(), 2)
+        # Not cached until the index is refreshed.
+        self.assertEqual(q.count(), 3)
+
+    def test_queued_write_evicts(self):
+        todo = Todo(id=1, list_id=3)
+        other = Todo(id=2, list_id=3)
+        q = self.client.query('Todo')
+        with transaction.manager:
+            with self.client.request_scope():
+                self.client.get(todo)
+                self.client.get(other)
+                q.count()
+                self.client.index_object(todo)
+                self.client.get(todo)
+                self.client.get(other)
+                q.count()
+        self.assertEqual(self.client.es.gets, 3)
+        self.assertEqual(self.client.es.searches, 2)
+
+    def test_tween(self):
+        from pyramid.config import Configurator
+        from ..tweens import request_scope_tween_factory
+
+        config = Configurator()
+        config.registry.pyramid_es_client = self.client
+
+        def handler(request):
+            self.client.get(('Todo', 1))
+            return self.client.get(('Todo', 1))
+
+        tween = request_scope_tween_factory(handler, config.registry)
+        tween(None)
+        tween(None)
+        self.assertEqual(self.client.es.gets, 2)
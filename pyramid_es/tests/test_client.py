@@ -0,0 +1,620 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+from unittest import TestCase
+
+import transaction
+from sqlalchemy import Column, create_engine, types
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+
+from .. import memory
+from ..client import ElasticClient, ElasticBulkError
+from ..mixin import ElasticMixin, ESMapping, ESString
+
+
+Base = declarative_base()
+
+
+class Todo(Base, ElasticMixin):
+    __tablename__ = 'todos'
+    id = Column(types.Integer, primary_key=True)
+    description = Column(types.Unicode(40))
+    list_id = Column(types.Integer)
+
+    __elastic_parent__ = ('TodoList', 'list_id')
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('description')))
+
+
+class FakeES(object):
+    """
+    Records the bulk requests it receives, and answers them with a
+    successful response unless the document ID is listed in ``fail_ids``.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.fail_ids = set()
+
+    def bulk(self, body):
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.requests.append(lines)
+        items = []
+        for line in lines:
+            op = list(line.keys())[0]
+            if op not in ('index', 'update', 'delete'):
+                continue
+            meta = line[op]
+            status = 400 if meta.get('_id') in self.fail_ids else 200
+            items.append({op: dict(meta, status=status)})
+        return {'errors': False, 'items': items}
+
+
+# Kept apart from Base, whose mapped classes are tested.
+UpdateBase = declarative_base()
+
+
+class Article(UpdateBase, ElasticMixin):
+    __tablename__ = 'articles'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+    body = Column(types.UnicodeText)
+    views = Column(types.Integer)
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('title'),
+                ESString('title_exact', attr='title', index='not_analyzed'),
+                ESString('body')))
+
+
+class Summary(UpdateBase, ElasticMixin):
+    __tablename__ = 'summaries'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    @property
+    def shout(self):
+        return self.title.upper()
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('title'),
+                ESString('shout')))
+
+
+class TestBulkTransaction(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_bulk',
+                                    use_transaction=True)
+        self.client.es = FakeES()
+
+    def test_commit_sends_single_bulk_request(self):
+        with transaction.manager:
+            for ii in range(5):
+                todo = Todo(id=ii, description='Todo %d' % ii, list_id=7)
+                self.client.index_object(todo)
+            self.client.delete_document(id=99, doc_type='Todo', parent=7)
+            self.assertEqual(self.client.es.requests, [])
+
+        self.assertEqual(len(self.client.es.requests), 1)
+        lines = self.client.es.requests[0]
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[0], {'index': {'_index':
+                                              'pyramid_es_tests_bulk',
+                                              '_type': 'Todo',
+                                              '_id': 0,
+                                              '_parent': 7}})
+        self.assertEqual(lines[1], {'description': 'Todo 0'})
+        self.assertEqual(lines[10], {'delete': {'_index':
+                                                'pyramid_es_tests_bulk',
+                                                '_type': 'Todo',
+                                                '_id': 99,
+                                                '_routing': 7}})
+
+    def test_abort_sends_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.manager:
+                self.client.index_document(id=1, doc_type='Todo',
+                                           doc={'description': 'Nope'})
+                raise RuntimeError('fail!')
+        self.assertEqual(self.client.es.requests, [])
+
+    def test_pipeline(self):
+        with transaction.manager:
+            self.client.index_document(id=1, doc_type='Todo',
+                                       doc={'description': 'Piped',
+                                            '__pipeline__': 'attachments'})
+        lines = self.client.es.requests[0]
+        self.assertEqual(lines[0]['index']['pipeline'], 'attachments')
+        self.assertEqual(lines[1], {'description': 'Piped'})
+
+    def test_failures_reported_together(self):
+        self.client.es.fail_ids = set([1, 3])
+        with self.assertRaises(ElasticBulkError) as cm:
+            with transaction.manager:
+                for ii in range(5):
+                    self.client.index_document(id=ii, doc_type='Todo',
+                                               doc={'description': 'x'})
+        self.assertEqual(len(cm.exception.errors), 2)
+
+
+class TestQueueCoalescing(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_bulk',
+                                    use_transaction=True)
+        self.client.es = FakeES()
+
+    def test_repeated_index_collapses(self):
+        todo = Todo(id=1, description='First', list_id=7)
+        with transaction.manager:
+            for description in ('First', 'Second', 'Third'):
+                todo.description = description
+                self.client.index_object(todo)
+            self.assertEqual(len(self.client.uncommitted), 1)
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1], {'description': 'Third'})
+
+    def test_document_built_at_commit(self):
+        todo = Todo(id=1, description='Before', list_id=7)
+        with transaction.manager:
+            self.client.index_object(todo)
+            todo.description = 'After'
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(lines[1], {'description': 'After'})
+
+    def test_delete_after_index(self):
+        todo = Todo(id=1, description='Doomed', list_id=7)
+        with transaction.manager:
+            self.client.index_object(todo)
+            self.client.delete_object(todo)
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(lines, [{'delete': {'_index':
+                                             'pyramid_es_tests_bulk',
+                                             '_type': 'Todo',
+                                             '_id': 1,
+                                             '_routing': 7}}])
+
+    def test_delete_document_after_index_object(self):
+        todo = Todo(id=1, description='Doomed', list_id=7)
+        with transaction.manager:
+            self.client.index_object(todo)
+            self.client.delete_document(id=1, doc_type='Todo', parent=7)
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(list(lines[0].keys()), ['delete'])
+
+    def test_unflushed_objects_not_merged(self):
+        with transaction.manager:
+            self.client.index_object(Todo(description='One'))
+            self.client.index_object(Todo(description='Two'))
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn('_id', lines[0]['index'])
+
+    def test_savepoint_rollback(self):
+        with transaction.manager as txn:
+            self.client.index_document(id=1, doc_type='Todo',
+                                       doc={'description': 'Kept'})
+            savepoint = txn.savepoint()
+            self.client.delete_document(id=1, doc_type='Todo')
+            savepoint.rollback()
+
+        lines = self.client.es.requests[0]
+        self.assertEqual(lines[1], {'description': 'Kept'})
+
+
+class TestBulkChunks(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_bulk',
+                                    use_transaction=False)
+        self.client.es = FakeES()
+
+    def _actions(self, n):
+        return [self.client._index_document_action(
+            id=ii, doc_type='Todo', doc={'description': 'x' * 100})
+            for ii in range(n)]
+
+    def test_chunk_size(self):
+        succeeded, errors = self.client.bulk(self._actions(7), chunk_size=3)
+        self.assertEqual(succeeded, 7)
+        self.assertEqual(errors, [])
+        self.assertEqual([len(req) for req in self.client.es.requests],
+                         [6, 6, 2])
+
+    def test_max_chunk_bytes(self):
+        self.client.bulk(self._actions(4), max_chunk_bytes=300)
+        self.assertEqual(len(self.client.es.requests), 4)
+
+    def test_raise_on_error_false(self):
+        self.client.es.fail_ids = set([2])
+        succeeded, errors = self.client.bulk(self._actions(4),
+                                             raise_on_error=False)
+        self.assertEqual(succeeded, 3)
+        self.assertEqual(len(errors), 1)
+
+
+class TestIndexObjects(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_bulk',
+                                    use_transaction=False)
+        self.client.es = FakeES()
+
+    def _todos(self, n):
+        for ii in range(n):
+            yield Todo(id=ii, description='Todo %d' % ii, list_id=7)
+
+    def test_index_objects(self):
+        succeeded, failed = self.client.index_objects(self._todos(10),
+                                                      chunk_size=4)
+        self.assertEqual((succeeded, failed), (10, 0))
+        self.assertEqual(len(self.client.es.requests), 3)
+
+    def test_index_objects_threaded(self):
+        self.client.es.fail_ids = set([3, 17])
+        succeeded, failed = self.client.index_objects(self._todos(50),
+                                                      chunk_size=5,
+                                                      thread_count=3)
+        self.assertEqual((succeeded, failed), (48, 2))
+        self.assertEqual(len(self.client.es.requests), 10)
+
+    def test_delete_objects(self):
+        succeeded, failed = self.client.delete_objects(self._todos(3))
+        self.assertEqual((succeeded, failed), (3, 0))
+        lines = self.client.es.requests[0]
+        self.assertEqual([list(line.keys()) for line in lines],
+                         [['delete']] * 3)
+
+    def test_index_objects_transactional(self):
+        self.client.use_transaction = True
+        with transaction.manager:
+            self.assertIsNone(self.client.index_objects(self._todos(3)))
+            self.assertEqual(len(self.client.uncommitted), 3)
+        self.assertEqual(len(self.client.es.requests), 1)
+
+
+class FakeIndices(object):
+
+    def __init__(self):
+        self.mappings = {}
+        self.puts = []
+        self.settings = {}
+
+    def put_mapping(self, index, doc_type, body):
+        self.puts.append(doc_type)
+        self.mappings[doc_type] = body[doc_type]
+
+    def delete_mapping(self, index, doc_type):
+        del self.mappings[doc_type]
+
+    def get_mapping(self, index, doc_type=None):
+        mappings = dict((k, v) for k, v in self.mappings.items()
+                        if doc_type in (None, k))
+        return {index: {'mappings': mappings}}
+
+    def exists(self, index):
+        return True
+
+    def get_settings(self, index):
+        return {index + '_v1': {'settings': self.settings}}
+
+
+class TestMappingFingerprints(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_mappings')
+        self.client.es = FakeES()
+        self.client.es.indices = FakeIndices()
+
+    def test_unchanged_mapping_skipped(self):
+        self.assertTrue(self.client.ensure_mapping(Todo))
+        self.assertFalse(self.client.ensure_mapping(Todo))
+        self.assertTrue(self.client.ensure_mapping(Todo, recreate=True))
+        self.assertEqual(self.client.es.indices.puts, ['Todo', 'Todo'])
+
+    def test_changed_mapping_sent(self):
+        self.client.ensure_mapping(Todo)
+        stored = self.client.es.indices.mappings['Todo']
+        stored['_meta']['pyramid_es_fingerprint'] = 'stale'
+        self.assertTrue(self.client.ensure_mapping(Todo))
+
+    def test_ensure_all_mappings(self):
+        self.client.ensure_all_mappings(Base)
+        self.client.ensure_all_mappings(Base)
+        self.assertEqual(self.client.es.indices.puts, ['Todo'])
+
+    def test_mapping_cached(self):
+        self.assertIs(Todo.elastic_mapping_cached(),
+                      Todo.elastic_mapping_cached())
+
+    def test_index_settings_current(self):
+        from ..client import CREATE_INDEX_SETTINGS, _flatten_settings
+        settings = {}
+        for key, value in _flatten_settings(CREATE_INDEX_SETTINGS).items():
+            if not key.startswith('index.'):
+                key = 'index.' + key
+            settings[key] = value
+        settings['index.creation_date'] = '1234'
+        self.client.es.indices.settings = settings
+        self.assertTrue(self.client.index_settings_current())
+
+        settings['index.number_of_shards'] = '5'
+        self.assertFalse(self.client.index_settings_current())
+
+
+class MgetFakeES(FakeES):
+
+    def __init__(self, existing):
+        FakeES.__init__(self)
+        self.existing = existing
+        self.mgets = []
+
+    def mget(self, body, **params):
+        self.mgets.append((body, params))
+        docs = []
+        for doc in body['docs']:
+            raw = dict(doc, found=doc['_id'] in self.existing)
+            if raw['found']:
+                raw['_source'] = {'description': 'Todo %s' % doc['_id']}
+            docs.append(raw)
+        return {'docs': docs}
+
+
+class TestGetMany(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_mget')
+        self.client.es = MgetFakeES(existing=set([1, 2, 3, 5]))
+
+    def test_get_many(self):
+        todo = Todo(id=1, list_id=8)
+        records = self.client.get_many([todo, ('Todo', 4), ('Todo', 2),
+                                        ('Todo', 3, 9)])
+        self.assertEqual(records[0].description, 'Todo 1')
+        self.assertIsNone(records[1])
+        self.assertEqual(records[2]._id, 2)
+        self.assertEqual(records[3]._id, 3)
+
+        body, params = self.client.es.mgets[0]
+        self.assertEqual(body['docs'][0], {'_index': 'pyramid_es_tests_mget',
+                                           '_type': 'Todo',
+                                           '_id': 1,
+                                           '_routing': 8})
+        self.assertNotIn('_routing', body['docs'][1])
+        self.assertEqual(body['docs'][3]['_routing'], 9)
+        self.assertEqual(params, {})
+
+    def test_get_many_chunks(self):
+        keys = [('Todo', ii) for ii in range(7)]
+        records = self.client.get_many(keys + keys[:2], fields=['title'],
+                                       chunk_size=3)
+        self.assertEqual([rec and rec._id for rec in records],
+                         [None, 1, 2, 3, None, 5, None, None, 1])
+        self.assertEqual([len(body['docs'])
+                          for body, params in self.client.es.mgets],
+                         [3, 3, 1])
+        self.assertEqual(self.client.es.mgets[0][1], {'fields': ['title']})
+
+    def test_get_many_request_scope(self):
+        with self.client.request_scope():
+            self.client.get_many([('Todo', 1), ('Todo', 2)])
+            self.client.get_many([('Todo', 2), ('Todo', 3)])
+        self.assertEqual([len(body['docs'])
+                          for body, params in self.client.es.mgets],
+                         [2, 1])
+
+
+class TestRebuildIndex(TestCase):
+
+    def setUp(self):
+        memory.reset('rebuild')
+        self.client = ElasticClient(servers=['memory://rebuild'],
+                                    index='pyramid_es_tests_rebuild',
+                                    use_transaction=False)
+
+    def settings(self, name):
+        raw = self.client.es.indices.get_settings(index=name)
+        return raw[name]['settings']['index']
+
+    def load(self, title):
+        def load(client):
+            self.loaded = client
+            self.assertEqual(self.settings(client.index)['refresh_interval'],
+                             '-1')
+            client.index_document(id=1, doc_type='Todo',
+                                  doc={'description': title})
+        return load
+
+    def test_rebuild_replaces_index(self):
+        self.client.ensure_index()
+        self.client.index_document(id=1, doc_type='Todo',
+                                   doc={'description': 'Old'})
+
+        name = self.client.rebuild_index(self.load('New'), base_classes=[Base],
+                                         version='1')
+        self.assertEqual(name, 'pyramid_es_tests_rebuild_1')
+        self.assertEqual(self.loaded.index, name)
+        self.assertFalse(self.loaded.use_transaction)
+        self.assertIn('Todo', self.client.get_mappings())
+        self.assertEqual(self.client.aliased_indices(), [name])
+        self.assertEqual(self.client.get(('Todo', 1)).description, 'New')
+        self.assertEqual(self.settings(name)['refresh_interval'], '1s')
+        self.assertEqual(self.settings(name)['number_of_replicas'], 0)
+        self.assertTrue(self.client.index_settings_current())
+
+    def test_recreate_aliased_index(self):
+        self.client.rebuild_index(self.load('First'), version='1')
+        self.client.ensure_index(recreate=True)
+        aliased = self.client.aliased_indices()
+        self.assertEqual(len(aliased), 1)
+        self.assertNotEqual(aliased, ['pyramid_es_tests_rebuild_1'])
+        self.assertFalse(self.client.es.indices.exists(
+            'pyramid_es_tests_rebuild_1'))
+        self.assertEqual(self.client.get_many([('Todo', 1)]), [None])
+        self.assertEqual(self.settings(aliased[0])['refresh_interval'], '1s')
+
+    def test_delete_aliased_index(self):
+        self.client.rebuild_index(self.load('First'), version='1')
+        self.client.delete_index()
+        self.assertFalse(self.client.es.indices.exists(
+            'pyramid_es_tests_rebuild_1'))
+        self.assertFalse(self.client.es.indices.exists(
+            'pyramid_es_tests_rebuild'))
+
+    def test_rebuild_swaps_versions(self):
+        self.client.rebuild_index(self.load('First'), version='1')
+        self.client.rebuild_index(self.load('Second'), version='2',
+                                  delete_old=False)
+        self.assertEqual(self.client.aliased_indices(),
+                         ['pyramid_es_tests_rebuild_2'])
+        self.assertEqual(self.client.get(('Todo', 1)).description, 'Second')
+        self.assertTrue(self.client.es.indices.exists(
+            'pyramid_es_tests_rebuild_1'))
+
+        self.client.rebuild_index(self.load('Third'), version='3')
+        self.assertFalse(self.client.es.indices.exists(
+            'pyramid_es_tests_rebuild_2'))
+        self.assertEqual(self.client.get(('Todo', 1)).description, 'Third')
+
+
+class TestUpdateObject(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_update',
+                                    use_transaction=True)
+        self.client.es = FakeES()
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        UpdateBase.metadata.create_all(engine)
+        self.session = Session(bind=engine)
+        self.article = Article(id=1, title='Title', body='Body', views=0)
+        self.todo = Todo(id=2, description='Todo', list_id=7)
+        self.summary = Summary(id=3, title='Summary')
+        self.session.add_all([self.article, self.todo, self.summary])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def update(self, obj, **changes):
+        for key, value in changes.items():
+            setattr(obj, key, value)
+        with transaction.manager:
+            self.client.update_object(obj)
+        self.session.commit()
+        return self.client.es.requests
+
+    def test_fields_for(self):
+        self.assertEqual(Article.elastic_fields_for(['title']),
+                         set(['title', 'title_exact']))
+        self.assertEqual(Article.elastic_fields_for(['views']), set())
+        self.assertIsNone(Article.elastic_fields_for(['id']))
+        self.assertIsNone(Todo.elastic_fields_for(['list_id']))
+        self.assertIsNone(Summary.elastic_fields_for(['title']))
+
+    def test_sends_changed_fields(self):
+        requests = self.update(self.article, title='New title', views=5)
+        self.assertEqual(requests, [[
+            {'update': {'_index': 'pyramid_es_tests_update',
+                        '_type': 'Article', '_id': 1}},
+            {'doc': {'title': 'New title', 'title_exact': 'New title'},
+             'doc_as_upsert': True}]])
+
+    def test_unmapped_changes_send_nothing(self):
+        self.assertEqual(self.update(self.article, views=5), [])
+
+    def test_unmappable_changes_index_document(self):
+        requests = self.update(self.summary, title='New')
+        self.assertEqual(requests[0][0], {'index': {
+            '_index': 'pyramid_es_tests_update', '_type': 'Summary',
+            '_id': 3}})
+        self.assertEqual(requests[0][1], {'title': 'New', 'shout': 'NEW'})
+
+        requests = self.update(self.todo, list_id=8)
+        self.assertEqual(list(requests[1][0]), ['index'])
+
+    def test_no_changes_index_document(self):
+        requests = self.update(self.article)
+        self.assertEqual(list(requests[0][0]), ['index'])
+
+    def test_parent(self):
+        requests = self.update(self.todo, description='Changed')
+        self.assertEqual(requests[0][0], {'update': {
+            '_index': 'pyramid_es_tests_update', '_type': 'Todo', '_id': 2,
+            '_parent': 7}})
+        self.assertEqual(requests[0][1]['doc'], {'description': 'Changed'})
+
+    def test_updates_are_merged(self):
+        with transaction.manager:
+            self.article.title = 'New title'
+            self.client.update_object(self.article)
+            self.session.flush()
+            self.article.body = 'New body'
+            self.client.update_object(self.article)
+        self.assertEqual(self.client.es.requests[0][1]['doc'],
+                         {'title': 'New title', 'title_exact': 'New title',
+                          'body': 'New body'})
+
+    def test_index_object_supersedes_update(self):
+        with transaction.manager:
+            self.client.index_object(self.article)
+            self.article.title = 'New title'
+            self.client.update_object(self.article)
+        lines = self.client.es.requests[0]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(list(lines[0]), ['index'])
+        self.assertEqual(lines[1]['title'], 'New title')
+
+    def test_update_after_delete_indexes_object(self):
+        with transaction.manager:
+            self.client.delete_object(self.article)
+            self.article.title = 'New title'
+            self.client.update_object(self.article)
+        lines = self.client.es.requests[0]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(list(lines[0]), ['index'])
+        self.assertEqual(lines[1]['title'], 'New title')
+        self.assertEqual(lines[1]['body'], 'Body')
+
+    def test_immediate_in_transaction(self):
+        with transaction.manager:
+            self.article.body = 'New body'
+            self.client.update_object(self.article, immediate=True)
+            self.assertEqual(self.client.es.requests[0][1]['doc'],
+                             {'body': 'New body'})
+        self.assertEqual(len(self.client.es.requests), 1)
+
+    def test_immediate(self):
+        self.client.use_transaction = False
+        self.article.body = 'New body'
+        self.client.update_object(self.article)
+        self.assertEqual(self.client.es.requests[0][1]['doc'],
+                         {'body': 'New body'})
+        self.client.update_object(self.article, attributes=['title'])
+        self.assertEqual(self.client.es.requests[1][1]['doc'],
+                         {'title': 'Title', 'title_exact': 'Title'})
@@ -0,0 +1,156 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+from pyramid.config import Configurator
+
+from .. import client as client_module
+from .. import client_from_config, memory
+from ..scripts import ensure
+
+
+class RecordingElasticsearch(object):
+
+    def __init__(self, hosts, **kwargs):
+        self.hosts = hosts
+        self.kwargs = kwargs
+
+
+class TestClientFromConfig(TestCase):
+
+    def setUp(self):
+        self.original = client_module.Elasticsearch
+        client_module.Elasticsearch = RecordingElasticsearch
+
+    def tearDown(self):
+        client_module.Elasticsearch = self.original
+
+    def test_defaults(self):
+        client = client_from_config({'elastic.index': 'idx'})
+        self.assertEqual(client.es.hosts, ['localhost:9200'])
+        self.assertEqual(client.es.kwargs, {})
+        self.assertFalse(client.disable_indexing)
+
+    def test_ini_strings(self):
+        settings = {
+            'elastic.index': 'idx',
+            'elastic.servers': 'http://es1:9200, http://es2:9200\n'
+                               'http://es3:9200',
+            'elastic.disable_indexing': 'false',
+            'elastic.timeout': '2.5',
+            'elastic.maxsize': '25',
+            'elastic.http_compress': 'true',
+            'elastic.sniff_on_start': 'true',
+            'elastic.sniff_on_connection_fail': 'false',
+            'elastic.sniffer_timeout': '',
+            'elastic.retry_on_timeout': 'yes',
+            'elastic.max_retries': '5',
+            'elastic.dead_node_backoff': '0.5',
+            'elastic.connection_class':
+                'pyramid_es.tests.test_config.RecordingElasticsearch',
+        }
+        client = client_from_config(settings)
+        self.assertEqual(client.es.hosts, ['http://es1:9200',
+                                           'http://es2:9200',
+                                           'http://es3:9200'])
+        self.assertFalse(client.disable_indexing)
+
+        modern = client_module.ES_VERSION[0] >= 8
+        expected = dict(
+            (client_module.TRANSPORT_OPTIONS[name][0 if modern else 1], value)
+            for name, value in [
+                ('timeout', 2.5),
+                ('maxsize', 25),
+                ('http_compress', True),
+                ('sniff_on_start', True),
+                ('sniff_on_connection_fail', False),
+                ('retry_on_timeout', True),
+                ('max_retries', 5),
+                ('dead_node_backoff', 0.5),
+                ('connection_class', RecordingElasticsearch)])
+        self.assertEqual(client.es.kwargs, expected)
+
+    def test_memory_backend_ignores_transport(self):
+        client = client_from_config({'elastic.index': 'idx',
+                                     'elastic.servers': 'memory://config',
+                                     'elastic.maxsize': '10'})
+        self.assertIsInstance(client.es, client_module.MemoryElasticsearch)
+
+
+class TestLazyConnection(TestCase):
+
+    def setUp(self):
+        self.original = client_module.Elasticsearch
+        client_module.Elasticsearch = RecordingElasticsearch
+
+    def tearDown(self):
+        client_module.Elasticsearch = self.original
+
+    def make_client(self):
+        return client_module.ElasticClient(['http://es1:9200'], index='idx',
+                                           maxsize=4)
+
+    def test_created_on_first_use(self):
+        client = self.make_client()
+        self.assertIsNone(client._es)
+        es = client.es
+        self.assertEqual(es.hosts, ['http://es1:9200'])
+        self.assertIs(client.es, es)
+
+    def test_rebuilt_in_other_process(self):
+        client = self.make_client()
+        es = client.es
+        client._pid = -1
+        self.assertIsNot(client.es, es)
+        self.assertEqual(client.es.kwargs, es.kwargs)
+
+    def test_after_fork_hook(self):
+        client = self.make_client()
+        es = client.es
+        client_module._after_fork()
+        self.assertIsNone(client._es)
+        self.assertIsNot(client.es, es)
+
+    @skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+    def test_fork(self):
+        client = self.make_client()
+        es = client.es
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os._exit(0 if client.es is not es else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertIs(client.es, es)
+
+
+def make_app(global_config, **settings):
+    config = Configurator(settings=settings)
+    config.include('pyramid_es')
+    return config.make_wsgi_app()
+
+
+class TestEnsureScript(TestCase):
+
+    def setUp(self):
+        memory.reset('script')
+        self.dir = tempfile.mkdtemp()
+        self.ini = os.path.join(self.dir, 'test.ini')
+        with open(self.ini, 'w') as f:
+            f.write('[app:main]\n'
+                    'use = call:pyramid_es.tests.test_config:make_app\n'
+                    'elastic.servers = memory://script\n'
+                    'elastic.index = script_idx\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_ensure(self):
+        self.assertEqual(ensure.main([self.ini, '--base',
+                                      'pyramid_es.tests.data.Base']), 0)
+        es = memory.MemoryElasticsearch('memory://script')
+        self.assertTrue(es.indices.exists('script_idx'))
+        mappings = es.indices.get_mapping(index='script_idx')
+        self.assertEqual(sorted(mappings['script_idx']['mappings']),
+                         ['Genre', 'Movie'])
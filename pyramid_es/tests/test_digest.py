@@ -0,0 +1,151 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+from pyramid.config import Configurator
+
+from .. import memory
+from ..client import ElasticBulkError, ElasticClient
+from ..digest import DocumentDigestStore, MemoryDigestStore
+from .test_client import Article, FakeES
+
+
+class TestMemoryDigestStore(TestCase):
+
+    def test_lru(self):
+        store = MemoryDigestStore(max_size=2)
+        store.set_many({'a': '1', 'b': '2'})
+        self.assertEqual(store.get_many(['a', 'c']), {'a': '1'})
+        store.set_many({'c': '3'})
+        self.assertEqual(store.get_many(['a', 'b', 'c']),
+                         {'a': '1', 'c': '3'})
+        self.assertEqual(store.evictions, 1)
+        store.delete_many(['a'])
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+
+class TestSkipUnchanged(TestCase):
+
+    def setUp(self):
+        self.digests = MemoryDigestStore()
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_digest',
+                                    use_transaction=False,
+                                    digests=self.digests)
+        self.client.es = FakeES()
+
+    def index(self, *articles):
+        self.client.index_objects(articles)
+        return self.client.es.requests
+
+    def sent_ids(self, request):
+        return [line['index']['_id'] for line in request if 'index' in line]
+
+    def test_unchanged_documents_are_skipped(self):
+        one = Article(id=1, title='One', body='Body')
+        two = Article(id=2, title='Two', body='Body')
+        self.index(one, two)
+        two.title = 'Changed'
+        requests = self.index(one, two)
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(self.sent_ids(requests[1]), [2])
+        self.assertEqual(self.digests.checked, 4)
+        self.assertEqual(self.digests.skipped, 1)
+
+        self.index(one, two)
+        self.assertEqual(len(self.client.es.requests), 2)
+
+    def test_deleted_documents_are_sent_again(self):
+        one = Article(id=1, title='One', body='Body')
+        self.index(one)
+        self.client.delete_objects([one])
+        requests = self.index(one)
+        self.assertEqual(self.sent_ids(requests[2]), [1])
+
+    def test_failed_documents_are_sent_again(self):
+        one = Article(id=1, title='One', body='Body')
+        self.client.es.fail_ids.add(1)
+        self.index(one)
+        self.client.es.fail_ids.clear()
+        requests = self.index(one)
+        self.assertEqual(self.sent_ids(requests[1]), [1])
+
+    def test_transaction(self):
+        client = ElasticClient(servers=['http://localhost:9200'],
+                               index='pyramid_es_tests_digest',
+                               digests=self.digests)
+        client.es = FakeES()
+        one = Article(id=1, title='One', body='Body')
+        for title in ('One', 'One', 'Changed'):
+            one.title = title
+            with transaction.manager:
+                client.index_object(one)
+        self.assertEqual(len(client.es.requests), 2)
+
+        client.es.fail_ids.add(1)
+        one.title = 'Failed'
+        with self.assertRaises(ElasticBulkError):
+            with transaction.manager:
+                client.index_object(one)
+        self.assertEqual(self.digests.get_many(
+            [('pyramid_es_tests_digest', 'Article', 1, None)]), {})
+
+
+class TestDocumentDigestStore(TestCase):
+
+    def setUp(self):
+        memory.reset('digest')
+        self.client = self.make_client()
+
+    def make_client(self):
+        client = ElasticClient(servers=['memory://digest'],
+                               index='pyramid_es_tests_digest',
+                               use_transaction=False)
+        client.digests = DocumentDigestStore(client)
+        client.ensure_index()
+        return client
+
+    def test_digests_are_stored_in_documents(self):
+        one = Article(id=1, title='One', body='Body')
+        self.client.index_object(one)
+        doc = self.client.get(('Article', 1))
+        self.assertEqual(len(doc.pyramid_es_digest), 40)
+
+        # Another process finds the digest in the document.
+        client = self.make_client()
+        self.assertEqual(client.index_objects([one]), (0, 0))
+        self.assertEqual(client.digests.skipped, 1)
+        one.title = 'Changed'
+        client.index_object(one)
+        self.assertEqual(client.get(('Article', 1)).title, 'Changed')
+
+
+def make_store(client):
+    return MemoryDigestStore(max_size=10)
+
+
+class TestIncludeme(TestCase):
+
+    def make_client(self, **settings):
+        settings['elastic.index'] = 'pyramid_es_tests_digest'
+        config = Configurator(settings=settings)
+        config.include('pyramid_es')
+        return config.registry.pyramid_es_client
+
+    def test_settings(self):
+        self.assertIsNone(self.make_client().digests)
+        digests = self.make_client(**{
+            'elastic.digests': 'memory',
+            'elastic.digest_cache_size': '5'}).digests
+        self.assertEqual(digests.max_size, 5)
+        client = self.make_client(**{
+            'elastic.digests': 'document',
+            'elastic.digest_field': 'digest'})
+        self.assertIs(client.digests.client, client)
+        self.assertEqual(client.digests.field, 'digest')
+        digests = self.make_client(**{
+            'elastic.digests':
+                'pyramid_es.tests.test_digest.make_store'}).digests
+        self.assertEqual(digests.max_size, 10)
@@ -1,27 +1,32 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import copy
+import json
+import pickle
 from unittest import TestCase
 
-from ..dotdict import DotDict
+from ..dotdict import DotDict, LazyDotDict
 
 
 class TestDotDict(TestCase):
+    dotdict_class = DotDict
+
     def test_get(self):
-        dd = DotDict({'a': 42,
-                      'b': 'hello'})
+        dd = self.dotdict_class({'a': 42,
+                                 'b': 'hello'})
         self.assertEqual(dd['b'], 'hello')
         self.assertEqual(dd.b, 'hello')
 
     def test_recursive(self):
-        dd = DotDict({'a': 42,
-                      'b': {'one': 1,
-                            'two': 2,
-                            'three': 3}})
+        dd = self.dotdict_class({'a': 42,
+                                 'b': {'one': 1,
+                                       'two': 2,
+                                       'three': 3}})
         self.assertEqual(dd['b']['two'], 2)
         self.assertEqual(dd.b.two, 2)
 
     def test_recursive_list(self):
-        dd = DotDict({
+        dd = self.dotdict_class({
             'organization': 'Avengers',
             'members': [
                 {'id': 1, 'name': 'Bruce Banner'},
@@ -32,20 +37,93 @@ class TestDotDict(TestCase):
         })
         self.assertEqual(dd.members[1].name, 'Tony Stark')
 
+    def test_recursive_get_items(self):
+        dd = self.dotdict_class({'a': {'b': {'c': 1}}})
+        self.assertEqual(dd.get('a').b.c, 1)
+        self.assertEqual([v.b.c for v in dd.values()], [1])
+        self.assertEqual([v.b.c for k, v in dd.items()], [1])
+
     def test_set(self):
-        dd = DotDict({'a': 4,
-                      'b': 9})
+        dd = self.dotdict_class({'a': 4,
+                                 'b': 9})
         dd.c = 16
         self.assertEqual(dd.c, 16)
         self.assertEqual(dd['c'], 16)
 
     def test_del(self):
-        dd = DotDict({'a': 123,
-                      'b': 456})
+        dd = self.dotdict_class({'a': 123,
+                                 'b': 456})
         del dd.b
         self.assertEqual(dict(dd), {'a': 123})
 
+    def test_missing(self):
+        dd = self.dotdict_class({'a': 1})
+        with self.assertRaises(KeyError):
+            dd.b
+
     def test_repr(self):
         dd = DotDict({'a': 1})
         self.assertIn(repr(dd), ["<DotDict({'a': 1})>",
                                  "<DotDict({u'a': 1})>"])
+
+
+class TestLazyDotDict(TestDotDict):
+    dotdict_class = LazyDotDict
+
+    def test_source_not_modified(self):
+        source = {'a': {'b': [{'c': 1}]}}
+        dd = LazyDotDict(source)
+        self.assertEqual(dd.a.b[0].c, 1)
+        self.assertIs(type(source['a']), dict)
+        self.assertIs(type(source['a']['b'][0]), dict)
+
+    def test_wrapped_value_cached(self):
+        dd = LazyDotDict({'a': {'b': 1}, 'l': [{'c': 2}]})
+        self.assertIs(dd.a, dd['a'])
+        self.assertIs(dd.l, dd['l'])
+        dd.a.b = 5
+        self.assertEqual(dd.a.b, 5)
+
+    def test_special_names(self):
+        dd = LazyDotDict({'a': 1, '_id': 2})
+        self.assertEqual(dd._id, 2)
+        self.assertFalse(hasattr(dd, '__html__'))
+        with self.assertRaises(AttributeError):
+            dd._missing
+
+    def test_pickle(self):
+        dd = LazyDotDict({'a': {'b': [{'c': 1}]}, 'd': 2})
+        dd.a
+        loaded = pickle.loads(pickle.dumps(dd, pickle.HIGHEST_PROTOCOL))
+        self.assertIs(type(loaded), LazyDotDict)
+        self.assertEqual(loaded, dd)
+        self.assertEqual(loaded.a.b[0].c, 1)
+        loaded.e = 3
+        self.assertEqual(loaded.e, 3)
+
+    def test_copy(self):
+        dd = LazyDotDict({'a': {'b': 1}})
+        dd.a
+        shallow = copy.copy(dd)
+        self.assertIs(type(shallow), LazyDotDict)
+        self.assertIs(shallow.a, dd.a)
+        deep = copy.deepcopy(dd)
+        deep.a.b = 2
+        self.assertEqual(dd.a.b, 1)
+
+    def test_equal_to_eager(self):
+        source = {'a': {'b': [{'c': 1}, 2]}, 'd': 'e'}
+        self.assertEqual(LazyDotDict(source), DotDict(source))
+        self.assertEqual(repr(LazyDotDict(source)).replace('Lazy', ''),
+                         repr(DotDict(source)))
+
+    def test_dict_and_json(self):
+        source = {'a': {'b': [{'c': 1}, 2]}, 'd': 'e'}
+        dd = LazyDotDict(source)
+        # dict() skips the lazy wrapping, unlike copy().
+        self.assertEqual(dict(dd), source)
+        self.assertIs(type(dict(dd)['a']), dict)
+        self.assertIs(type(dict(dd.copy())['a']), LazyDotDict)
+        for dd in (LazyDotDict(source), LazyDotDict(source).copy()):
+            self.assertEqual(json.dumps(dd, sort_keys=True),
+                             json.dumps(source, sort_keys=True))
@@ -0,0 +1,87 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+from pyramid.config import Configurator
+from pyramid.response import Response
+
+from ..client import ElasticClient
+from ..tweens import instrument_tween_factory
+from .test_cache import GettingFakeES
+from .test_client import Todo
+
+
+class TestInstrument(TestCase):
+
+    def setUp(self):
+        self.client = ElasticClient(servers=['http://localhost:9200'],
+                                    index='pyramid_es_tests_instrument')
+        self.client.es = GettingFakeES()
+
+    def test_not_recording(self):
+        self.client.query('Todo').count()
+        self.assertEqual(self.client._recorders(), ())
+
+    def test_records_calls(self):
+        with self.client.instrument() as recorder:
+            self.client.query('Todo').filter_term('done', False).count()
+            self.client.get(('Todo', 1))
+            with transaction.manager:
+                self.client.index_object(Todo(id=1, description='New'))
+                self.client.index_object(Todo(id=2, description='Newer'))
+        self.client.get(('Todo', 2))
+
+        self.assertEqual([call.method for call in recorder.calls],
+                         ['search', 'get', 'bulk'])
+        search, get, bulk = recorder.calls
+        self.assertEqual(search.params['doc_type'], 'Todo')
+        self.assertEqual(search.params['size'], 0)
+        self.assertIn('query', search.body)
+        self.assertGreater(search.request_size, 0)
+        self.assertGreater(search.response_size, 0)
+        self.assertIn('test_instrument.py', search.call_site)
+        self.assertEqual(get.hits, 1)
+        self.assertEqual(bulk.hits, 2)
+
+        totals = recorder.totals()
+        self.assertEqual(totals['count'], 3)
+        self.assertEqual(totals['hits'], 3)
+        self.assertEqual(totals['request_size'],
+                         sum(call.request_size for call in recorder.calls))
+
+    def test_nested(self):
+        with self.client.instrument() as outer:
+            self.client.get(('Todo', 1))
+            with self.client.instrument() as inner:
+                self.client.get(('Todo', 2))
+        self.assertEqual(len(outer.calls), 2)
+        self.assertEqual(len(inner.calls), 1)
+
+    def test_records_errors(self):
+        def fail(**kwargs):
+            raise RuntimeError('down')
+        self.client.es.search = fail
+        with self.client.instrument() as recorder:
+            with self.assertRaises(RuntimeError):
+                self.client.query('Todo').count()
+        self.assertIsInstance(recorder.calls[0].error, RuntimeError)
+
+    def test_tween(self):
+        config = Configurator(settings={})
+        config.registry.pyramid_es_client = self.client
+
+        class Request(object):
+            pass
+
+        def handler(request):
+            self.client.get(('Todo', 1))
+            return Response('ok')
+
+        tween = instrument_tween_factory(handler, config.registry)
+        request = Request()
+        response = tween(request)
+        self.assertEqual(len(request.elastic_recorder.calls), 1)
+        self.assertEqual(response.headers['X-Elastic-Count'], '1')
+        self.assertEqual(response.headers['X-Elastic-Hits'], '1')
+        self.assertIn('X-Elastic-Time', response.headers)
@@ -0,0 +1,254 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+import transaction
+from elasticsearch.exceptions import NotFoundError
+
+from .. import memory
+from ..client import ElasticClient
+from ..memory import MemoryElasticsearch
+from . import test_functional
+from .data import Genre, Movie, get_data
+
+
+def memory_client(**kwargs):
+    return ElasticClient(servers=['memory://tests'],
+                         index='pyramid_es_tests', **kwargs)
+
+
+class TestMemoryClient(test_functional.TestClient):
+    """
+    Run the functional client tests against the memory backend.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        memory.reset('tests')
+        cls.client = memory_client(use_transaction=False)
+        cls.client.ensure_index(recreate=True)
+        cls.client.ensure_mapping(Movie)
+
+
+class TestMemoryQuery(test_functional.TestQuery):
+    """
+    Run the functional query tests against the memory backend.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        memory.reset('tests')
+        cls.client = memory_client(use_transaction=False)
+        cls.client.ensure_index(recreate=True)
+        cls.client.ensure_mapping(Movie)
+
+        cls.genres, cls.movies = get_data()
+
+        cls.client.index_objects(cls.genres)
+        cls.client.index_objects(cls.movies)
+        cls.client.refresh()
+
+    def test_add_term_aggregate(self):
+        q = self.client.query(Movie).\
+            add_term_aggregate(name='genre_hist',
+                               field='genre_title')
+
+        result = q.execute()
+        buckets = result.aggregations['genre_hist']['buckets']
+        self.assertEqual(len(buckets), 4)
+        self.assertEqual(buckets[0], {'key': 'mystery', 'doc_count': 3})
+
+    def test_keyset_pagination(self):
+        q = self.client.query(Movie).order_by('year').limit(3).after()
+        titles = []
+        while True:
+            result = q.execute()
+            titles.extend(rec.title for rec in result)
+            if result.cursor is None:
+                break
+            q = q.after(result.cursor)
+        self.assertEqual(len(titles), 8)
+        self.assertEqual(titles[:2], ['Metropolis', 'Captain Blood'])
+
+    def test_iterate(self):
+        q = self.client.query(Movie).order_by('year', desc=True)
+        titles = [rec.title for rec in q.iterate(batch_size=3)]
+        self.assertEqual(len(titles), 8)
+        self.assertEqual(titles[0], 'Annie Hall')
+        self.assertEqual(self.client.es.store.scrolls, {})
+
+    def test_batch(self):
+        batch = self.client.batch()
+        movies = batch.add(self.client.query(Movie, q='allen'))
+        genres = batch.add_count(self.client.query(Genre))
+        self.assertEqual(movies.result().total, 2)
+        self.assertEqual(genres.result(), 4)
+
+    def test_get_many(self):
+        genre = Genre(title=u'Mystery')
+        records = self.client.get_many([genre, ('Genre', 'missing')])
+        self.assertEqual(records[0].title, 'Mystery')
+        self.assertIsNone(records[1])
+
+
+class TestMemoryBackend(TestCase):
+
+    def setUp(self):
+        memory.reset('unit')
+        self.es = MemoryElasticsearch('memory://unit')
+        self.es.indices.create('idx')
+        self.es.indices.put_mapping(index='idx', doc_type='Thing', body={
+            'Thing': {'properties': {
+                'code': {'type': 'string', 'index': 'not_analyzed'},
+                'name': {'type': 'string'}}}})
+
+    def search(self, query=None, **body):
+        if query is not None:
+            body['query'] = query
+        return self.es.search(index='idx', doc_type='Thing', body=body)
+
+    def test_shared_by_url(self):
+        other = MemoryElasticsearch(['memory://unit'])
+        self.assertTrue(other.indices.exists('idx'))
+        self.assertFalse(MemoryElasticsearch('memory://').indices.exists(
+            'idx'))
+
+    def test_selected_by_client(self):
+        client = ElasticClient(servers='memory://unit', index='idx')
+        self.assertIsInstance(client.es, MemoryElasticsearch)
+        self.assertTrue(client.es.indices.exists('idx'))
+
+    def test_selected_by_settings(self):
+        from .. import client_from_config
+        client = client_from_config({'elastic.servers': 'memory://unit',
+                                     'elastic.index': 'idx'})
+        self.assertIsInstance(client.es, MemoryElasticsearch)
+
+    def test_analysis(self):
+        self.es.index(index='idx', doc_type='Thing', id=1,
+                      body={'code': 'AB-1', 'name': 'Red Apple'})
+        hits = self.search({'term': {'code': 'AB-1'}})['hits']
+        self.assertEqual(hits['total'], 1)
+        self.assertEqual(hits['hits'][0]['_id'], '1')
+        self.assertEqual(
+            self.search({'term': {'name': 'apple'}})['hits']['total'], 1)
+        self.assertEqual(
+            self.search({'term': {'name': 'Apple'}})['hits']['total'], 0)
+        self.assertEqual(
+            self.search({'match': {'_all': {'query': 'red apple',
+                                            'operator': 'and'}}})
+            ['hits']['total'], 1)
+
+    def test_reindex_updates_postings(self):
+        self.es.index(index='idx', doc_type='Thing', id=1,
+                      body={'name': 'Red Apple'})
+        self.es.index(index='idx', doc_type='Thing', id=1,
+                      body={'name': 'Green Pear'})
+        self.assertEqual(
+            self.search({'term': {'name': 'apple'}})['hits']['total'], 0)
+        self.assertEqual(self.es.get(index='idx', doc_type='Thing',
+                                     id=1)['_version'], 2)
+
+    def test_bulk(self):
+        self.es.index(index='idx', doc_type='Thing', id=3,
+                      body={'name': 'Old', 'size': 1})
+        body = '\n'.join([
+            '{"index": {"_index": "idx", "_type": "Thing", "_id": 1}}',
+            '{"name": "One"}',
+            '{"update": {"_index": "idx", "_type": "Thing", "_id": 3}}',
+            '{"doc": {"name": "Three"}}',
+            '{"update": {"_index": "idx", "_type": "Thing", "_id": 4}}',
+            '{"doc": {"name": "Four"}}',
+            '{"delete": {"_index": "idx", "_type": "Thing", "_id": 5}}',
+        ]) + '\n'
+        resp = self.es.bulk(body=body)
+        statuses = [list(item.values())[0]['status']
+                    for item in resp['items']]
+        self.assertEqual(statuses, [201, 200, 404, 404])
+        self.assertTrue(resp['errors'])
+        self.assertEqual(self.es.get(index='idx', doc_type='Thing', id=3)
+                         ['_source'], {'name': 'Three', 'size': 1})
+
+    def test_not_found(self):
+        with self.assertRaises(NotFoundError):
+            self.es.get(index='idx', doc_type='Thing', id=1)
+        with self.assertRaises(NotFoundError):
+            self.es.delete(index='idx', doc_type='Thing', id=1)
+        with self.assertRaises(NotFoundError):
+            self.es.search(index='nope', body={})
+
+    def test_sort_missing_last(self):
+        for ii, size in enumerate([3, None, 1]):
+            self.es.index(index='idx', doc_type='Thing', id=ii,
+                          body={'size': size})
+        for order, expected in (('asc', ['2', '0', '1']),
+                                ('desc', ['0', '2', '1'])):
+            hits = self.search(sort=[{'size': {'order': order}}])
+            self.assertEqual([hit['_id'] for hit in hits['hits']['hits']],
+                             expected)
+
+    def test_range_and_bool(self):
+        for ii in range(10):
+            self.es.index(index='idx', doc_type='Thing', id=ii,
+                          body={'size': ii, 'name': 'even' if ii % 2 else
+                                'odd'})
+        query = {'bool': {
+            'must': [{'range': {'size': {'gte': 2, 'lt': 8}}}],
+            'must_not': [{'term': {'name': 'odd'}}]}}
+        hits = self.search(query, sort=['size'])['hits']
+        self.assertEqual([hit['_id'] for hit in hits['hits']],
+                         ['3', '5', '7'])
+
+    def test_range_aggregation(self):
+        for ii in range(10):
+            self.es.index(index='idx', doc_type='Thing', id=ii,
+                          body={'size': ii})
+        aggs = self.search(size=0, aggs={
+            'sizes': {'range': {'field': 'size',
+                                'ranges': [{'to': 5}, {'from': 5}]},
+                      'aggs': {'biggest': {'max': {'field': 'size'}}}}})
+        buckets = aggs['aggregations']['sizes']['buckets']
+        self.assertEqual([b['doc_count'] for b in buckets], [5, 5])
+        self.assertEqual([b['biggest']['value'] for b in buckets], [4, 9])
+
+    def test_transactional_client(self):
+        client = ElasticClient(servers='memory://unit', index='idx')
+        with transaction.manager:
+            client.index_document(id=1, doc_type='Thing',
+                                  doc={'name': 'Queued'})
+            self.assertEqual(client.query('Thing').count(), 0)
+        self.assertEqual(client.query('Thing').count(), 1)
+
+    def test_aliases(self):
+        self.es.index(index='idx', doc_type='Thing', id=1,
+                      body={'name': 'Widget'})
+        self.es.indices.update_aliases(body={'actions': [
+            {'add': {'index': 'idx', 'alias': 'things'}}]})
+        self.assertTrue(self.es.indices.exists('things'))
+        self.assertEqual(self.es.indices.get_alias(name='things'),
+                         {'idx': {'aliases': {'things': {}}}})
+        self.assertEqual(self.es.get(index='things', doc_type='Thing',
+                                     id=1)['_source'], {'name': 'Widget'})
+        self.es.index(index='things', doc_type='Thing', id=2,
+                      body={'name': 'Gadget'})
+        self.assertEqual(self.search()['hits']['total'], 2)
+
+        # Failing actions leave the aliases unchanged.
+        with self.assertRaises(NotFoundError):
+            self.es.indices.update_aliases(body={'actions': [
+                {'remove': {'index': 'idx', 'alias': 'things'}},
+                {'add': {'index': 'missing', 'alias': 'things'}}]})
+        self.assertTrue(self.es.indices.exists_alias(name='things'))
+
+        self.es.indices.delete('idx')
+        self.assertFalse(self.es.indices.exists('things'))
+        self.assertFalse(self.es.indices.exists_alias(name='things'))
+
+    def test_put_settings(self):
+        self.es.indices.put_settings(index='idx', body={
+            'index': {'refresh_interval': '-1'}})
+        self.es.indices.put_settings(index='idx', body={
+            'index.number_of_replicas': 1})
+        settings = self.es.indices.get_settings(index='idx')
+        self.assertEqual(settings['idx']['settings']['index'],
+                         {'refresh_interval': '-1', 'number_of_replicas': 1})
@@ -21,6 +21,31 @@ class Thing(object):
         self.child = child
 
 
+class Upper(ESProp):
+    def __call__(self, instance):
+        return ESProp.__call__(self, instance).upper()
+
+
+class Colored(ElasticMixin):
+    def __init__(self, id, name, foreground, child=None):
+        self.id = id
+        self.name = name
+        self.foreground = foreground
+        self.child = child
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                Upper('name'),
+                ESColor('foreground'),
+                ESString('shade', attr='foreground',
+                         filter=lambda rgb: sum(rgb)),
+                child=dict(
+                    properties=ESMapping(
+                        ESString('name')))))
+
+
 class TestMixin(TestCase):
 
     def test_custom_prop(self):
@@ -110,3 +135,30 @@ class TestMixin(TestCase):
 
         mapping_base.update(mapping_new)
         self.assertEqual(mapping_base['name']['analyzer'], 'lowercase')
+
+    def test_compile_matches_tree_walk(self):
+        mapping = Colored.elastic_mapping()
+        child = Colored(id=1, name='inner', foreground=(1, 2, 3))
+        obj = Colored(id=2, name='outer', foreground=(40, 20, 27),
+                      child=child)
+        doc = mapping.compile()(obj)
+        self.assertEqual(doc, mapping(obj))
+        self.assertEqual(doc, {'_id': 2,
+                               'name': 'OUTER',
+                               'foreground': '#28141b',
+                               'shade': 87,
+                               'child': {'_id': 1, 'name': 'inner'}})
+
+    def test_compile_leaf(self):
+        mapping = ESColor('foreground')
+        obj = Thing(id=42, foreground=(60, 40, 30))
+        self.assertEqual(mapping.compile()(obj), '#3c281e')
+
+    def test_elastic_document_cached_serializer(self):
+        child = Colored(id=4, name='child', foreground=(0, 0, 0))
+        obj = Colored(id=3, name='cached', foreground=(0, 0, 0),
+                      child=child)
+        serializer = Colored.elastic_serializer()
+        self.assertIs(Colored.elastic_serializer(), serializer)
+        self.assertEqual(obj.elastic_document(),
+                         Colored.elastic_mapping()(obj))
@@ -0,0 +1,212 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+import transaction
+from sqlalchemy import Column, create_engine, select, types
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+
+from .. import client_from_config, memory
+from ..client import ElasticClient, mapped_classes
+from ..outbox import ElasticOutbox, OutboxIndexer
+
+
+Base = declarative_base()
+
+
+class Todo(Base):
+    __tablename__ = 'todos'
+    id = Column(types.Integer, primary_key=True)
+    description = Column(types.Unicode(40))
+
+    elastic_parent = None
+
+    def elastic_document(self):
+        return {'_id': self.id, 'description': self.description}
+
+
+class BrokenES(object):
+
+    def bulk(self, body):
+        raise RuntimeError('ES is down')
+
+
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        memory.reset('outbox')
+        self.dir = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///' +
+                                    os.path.join(self.dir, 'test.db'))
+        Base.metadata.create_all(self.engine)
+        self.session = Session(bind=self.engine)
+        self.outbox = ElasticOutbox(self.session)
+        self.outbox.create()
+        self.client = ElasticClient(servers=['memory://outbox'],
+                                    index='pyramid_es_tests_outbox',
+                                    outbox=self.outbox)
+        self.client.ensure_index()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def commit(self, f):
+        # With zope.sqlalchemy, the session would be committed by the
+        # transaction.
+        with transaction.manager:
+            f()
+        self.session.commit()
+
+    def indexer(self, **kwargs):
+        return OutboxIndexer(self.client, self.outbox, mapped_classes(Base),
+                             **kwargs)
+
+    def rows(self):
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.outbox.table)
+                                .order_by(self.outbox.table.c.id)).fetchall()
+
+    def indexed(self, doc_type, id):
+        return self.client.es.exists(index='pyramid_es_tests_outbox',
+                                     doc_type=doc_type, id=id)
+
+    def add_todos(self, *descriptions):
+        todos = [Todo(description=description)
+                 for description in descriptions]
+
+        def add():
+            for todo in todos:
+                self.session.add(todo)
+                self.client.index_object(todo)
+        self.commit(add)
+        return todos
+
+    def test_commit_writes_outbox(self):
+        def add():
+            todo = Todo(description='Write tests')
+            self.session.add(todo)
+            self.client.index_object(todo)
+            self.client.index_document(id='n1', doc_type='Note',
+                                       doc={'text': 'hello'})
+            self.client.delete_document(id='n2', doc_type='Note', safe=True)
+        self.commit(add)
+
+        rows = self.rows()
+        self.assertEqual([(row.op, row.doc_type, row.doc_id) for row in rows],
+                         [('index', 'Todo', '1'), ('index', 'Note', 'n1'),
+                          ('delete', 'Note', 'n2')])
+        self.assertIsNone(rows[0].source)
+        self.assertEqual(rows[1].source, '{"text":"hello"}')
+        self.assertTrue(rows[2].safe)
+        self.assertFalse(self.indexed('Todo', '1'))
+
+        indexer = self.indexer()
+        self.assertEqual(indexer.run_once(), 3)
+        self.assertEqual(self.rows(), [])
+        self.assertTrue(self.indexed('Todo', '1'))
+        self.assertTrue(self.indexed('Note', 'n1'))
+        self.assertEqual(indexer.run_once(), 0)
+
+    def test_dates_are_serialized(self):
+        self.commit(lambda: self.client.index_document(
+            id='n1', doc_type='Note',
+            doc={'posted': datetime(2015, 3, 1, 12, 30)}))
+        self.assertEqual(self.rows()[0].source,
+                         '{"posted":"2015-03-01T12:30:00"}')
+        self.assertEqual(self.indexer().run_once(), 1)
+        doc = self.client.es.get(index='pyramid_es_tests_outbox',
+                                 doc_type='Note', id='n1')
+        self.assertEqual(doc['_source'], {'posted': '2015-03-01T12:30:00'})
+
+    def test_abort_writes_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.manager:
+                self.client.index_document(id='n1', doc_type='Note',
+                                           doc={'text': 'hello'})
+                raise RuntimeError
+        self.session.commit()
+        self.assertEqual(self.rows(), [])
+
+    def test_writes_are_coalesced(self):
+        todo, = self.add_todos('Write tests')
+        self.commit(lambda: self.client.delete_object(todo, safe=True))
+        self.assertEqual(len(self.rows()), 2)
+
+        indexer = self.indexer()
+        indexer.run(once=True)
+        self.assertEqual(indexer.sent, 1)
+        self.assertFalse(self.indexed('Todo', '1'))
+
+    def test_deleted_objects_are_skipped(self):
+        todo, = self.add_todos('Write tests')
+        self.session.delete(todo)
+        self.session.commit()
+
+        indexer = self.indexer()
+        self.assertEqual(indexer.run_once(), 1)
+        self.assertEqual(indexer.sent, 0)
+        self.assertEqual(self.rows(), [])
+
+    def test_concurrent_indexers_claim_disjoint_batches(self):
+        self.add_todos('One', 'Two', 'Three')
+        first = self.indexer(batch_size=2).claim()
+        second = self.indexer(batch_size=2).claim()
+        self.assertEqual([row.doc_id for row in first], ['1', '2'])
+        self.assertEqual([row.doc_id for row in second], ['3'])
+        self.assertEqual(self.indexer().claim(), [])
+
+    def test_stale_claims_are_taken_over(self):
+        self.add_todos('One')
+        self.indexer().claim()
+        indexer = self.indexer(stale_after=-1)
+        self.assertEqual(indexer.run_once(), 1)
+        self.assertTrue(self.indexed('Todo', '1'))
+
+    def test_es_failure_releases_rows(self):
+        self.add_todos('One')
+        self.client.es = BrokenES()
+        indexer = self.indexer()
+        with self.assertRaises(RuntimeError):
+            indexer.run_once()
+        rows = self.rows()
+        self.assertEqual(len(rows), 1)
+        self.assertIsNone(rows[0].claimed_by)
+
+    def test_run_logs_errors(self):
+        class Stop(BaseException):
+            pass
+        outcomes = [RuntimeError('database is down'), Stop()]
+
+        def run_once():
+            raise outcomes.pop(0)
+        indexer = self.indexer()
+        indexer.run_once = run_once
+        records = []
+        handler = logging.Handler(logging.ERROR)
+        handler.emit = records.append
+        log = logging.getLogger('pyramid_es.outbox')
+        log.addHandler(handler)
+        try:
+            with self.assertRaises(Stop):
+                indexer.run(poll_interval=0)
+        finally:
+            log.removeHandler(handler)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(str(records[0].exc_info[1]), 'database is down')
+
+    def test_config(self):
+        client = client_from_config({
+            'elastic.index': 'pyramid_es_tests_outbox',
+            'elastic.outbox_session': 'pyramid_es.tests.test_outbox:Session',
+            'elastic.outbox_table': 'es_writes',
+        })
+        self.assertIs(client.outbox.session, Session)
+        self.assertEqual(client.outbox.table.name, 'es_writes')
@@ -0,0 +1,80 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+from unittest import TestCase, skipIf
+
+from pyramid import testing
+from pyramid.config import Configurator
+from pyramid.response import Response
+
+from .. import get_client, memory
+from ..instrument import ElasticCall, ElasticRecorder
+
+try:
+    import pyramid_debugtoolbar
+except ImportError:
+    pyramid_debugtoolbar = None
+
+
+@skipIf(pyramid_debugtoolbar is None, 'pyramid_debugtoolbar is not installed')
+class TestElasticDebugPanel(TestCase):
+
+    def setUp(self):
+        memory.reset('panels')
+        config = Configurator(settings={
+            'elastic.servers': 'memory://panels',
+            'elastic.index': 'pyramid_es_tests_panels',
+            'elastic.ensure_index_on_start': 'true'})
+        config.include('pyramid_es')
+        self.request = testing.DummyRequest()
+        self.request.registry = config.registry
+
+    def make_panel(self):
+        from ..panels import ElasticDebugPanel
+        return ElasticDebugPanel(self.request)
+
+    def test_process_response(self):
+        panel = self.make_panel()
+        self.assertFalse(panel.has_content)
+        self.assertIsNone(panel.nav_subtitle)
+
+        recorder = ElasticRecorder()
+        recorder.add(ElasticCall('search', {'index': 'movies'},
+                                 {'query': {'match_all': {}}}, 0.0125,
+                                 took=3, request_size=30, hits=2))
+        recorder.add(ElasticCall('bulk', {},
+                                 '{"index":{"_id":1}}\n{"title":"One"}\n',
+                                 0.0025, hits=1))
+        panel.recorder = recorder
+        panel.process_response(Response())
+
+        self.assertTrue(panel.has_content)
+        self.assertEqual(panel.nav_subtitle, '2 in 15.00 ms')
+        search, bulk = panel.data['calls']
+        self.assertEqual(search['method'], 'search')
+        self.assertEqual(search['duration'], 12.5)
+        self.assertEqual(search['body'],
+                         '{\n  "query": {\n    "match_all": {}\n  }\n}')
+        self.assertEqual(bulk['body'].count('\n{\n'), 1)
+        self.assertEqual(panel.data['totals']['hits'], 3)
+
+        # The toolbar renders the template with the panel data.
+        from mako.template import Template
+        template = Template(filename=os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'templates',
+            'elastic.dbtmako'))
+        html = template.render(**panel.data)
+        self.assertIn('2 requests in 15.00 ms', html)
+        self.assertIn('<td>search</td>', html)
+
+    def test_wrap_handler(self):
+        panel = self.make_panel()
+
+        def handler(request):
+            get_client(request).get_many([('Movie', 1)])
+            return Response()
+        response = panel.wrap_handler(handler)(self.request)
+        panel.process_response(response)
+        self.assertEqual([call['method'] for call in panel.data['calls']],
+                         ['mget'])
+        self.assertTrue(panel.nav_subtitle.startswith('1 in '))
@@ -0,0 +1,115 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from unittest import TestCase
+
+from ..query import ElasticQuery
+
+
+class FakeClient(object):
+    """
+    Answers searches from a fixed list of hits, returning them in pages of
+    the requested size when scrolling.
+    """
+
+    def __init__(self, num_hits):
+        self.hits = [{'_id': ii, '_type': 'Thing', '_source': {'n': ii},
+                      'sort': [ii % 3, 'Thing#%d' % ii]}
+                     for ii in range(num_hits)]
+        self.searches = []
+        self.scrolls = []
+        self.cleared = []
+
+    def _page(self, start, size):
+        return {
+            '_scroll_id': 'scroll-%d' % start,
+            'hits': {
+                'total': len(self.hits),
+                'hits': self.hits[start:start + size],
+            },
+        }
+
+    def search(self, body, classes=None, fields=None, **query_params):
+        self.searches.append((body, query_params))
+        self.size = query_params['size']
+        return self._page(query_params.get('from_', 0), self.size)
+
+    def scroll(self, scroll_id, scroll):
+        self.scrolls.append((scroll_id, scroll))
+        start = int(scroll_id.split('-')[1]) + self.size
+        return self._page(start, self.size)
+
+    def clear_scroll(self, scroll_id):
+        self.cleared.append(scroll_id)
+
+
+class TestIterate(TestCase):
+
+    def test_iterate_all(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).filter_term('color', 'red')
+        records = list(q.iterate(batch_size=10))
+        self.assertEqual([rec.n for rec in records], list(range(25)))
+
+        body, params = client.searches[0]
+        self.assertEqual(params, {'size': 10, 'scroll': '5m'})
+        self.assertEqual(body['query']['filtered']['filter'],
+                         {'and': [{'term': {'color': 'red'}}]})
+        self.assertEqual(body['sort'], ['_doc'])
+        self.assertEqual(len(client.scrolls), 3)
+        self.assertEqual(client.cleared, ['scroll-30'])
+
+    def test_iterate_keeps_sorts(self):
+        client = FakeClient(5)
+        q = ElasticQuery(client).order_by('year', desc=True)
+        list(q.iterate())
+        body, params = client.searches[0]
+        self.assertEqual(body['sort'], [{'year': {'order': 'desc'}}])
+
+    def test_iterate_offset_limit(self):
+        client = FakeClient(25)
+        q = ElasticQuery(client).offset(3).limit(12)
+        records = list(q.iterate(batch_size=10))
+        self.assertEqual([rec.n for rec in records], list(range(3, 15)))
+        self.assertEqual(client.cleared, ['scroll-10'])
+
+    def test_iterate_close_clears_scroll(self):
+        client = FakeClient(25)
+        it = ElasticQuery(client).iterate(batch_size=10)
+        next(it)
+        self.assertEqual(client.cleared, [])
+        it.close()
+        self.assertEqual(client.cleared, ['scroll-0'])
+
+
+class TestKeysetPagination(TestCase):
+
+    def test_first_page(self):
+        client = FakeClient(10)
+        q = ElasticQuery(client).order_by('year').after().limit(4)
+        result = q.execute()
+        body, params = client.searches[0]
+        self.assertEqual(body['sort'], [{'year': {'order': 'asc'}},
+                                        {'_uid': {'order': 'asc'}}])
+        self.assertNotIn('search_after', body)
+        self.assertEqual(params['from_'], 0)
+        self.assertIsNotNone(result.cursor)
+
+    def test_next_page(self):
+        client = FakeClient(10)
+        q = ElasticQuery(client).after().limit(4)
+        cursor = q.execute().cursor
+        q.after(cursor).order_by('year').execute()
+        body, params = client.searches[1]
+        self.assertEqual(body['search_after'], [0, 'Thing#3'])
+        self.assertEqual(body['sort'], [{'year': {'order': 'asc'}},
+                                        {'_uid': {'order': 'asc'}}])
+
+    def test_offset_rejected(self):
+        q = ElasticQuery(FakeClient(10)).offset(5).after()
+        with self.assertRaises(ValueError):
+            q.execute()
+
+    def test_invalid_cursor(self):
+        q = ElasticQuery(FakeClient(10))
+        with self.assertRaises(ValueError):
+            q.after('not a cursor')
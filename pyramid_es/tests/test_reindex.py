@@ -0,0 +1,246 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyramid.config import Configurator
+from sqlalchemy import Column, create_engine, types
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from .. import memory
+from ..mixin import ElasticMixin, ESMapping, ESString
+from ..scripts import reindex
+
+
+Base = declarative_base()
+
+Session = scoped_session(sessionmaker())
+
+
+class Task(Base, ElasticMixin):
+    __tablename__ = 'tasks'
+    id = Column(types.Integer, primary_key=True)
+    title = Column(types.Unicode(40))
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('title')))
+
+
+class Tag(Base, ElasticMixin):
+    __tablename__ = 'tags'
+    id = Column(types.Unicode(40), primary_key=True)
+
+    @classmethod
+    def elastic_mapping(cls):
+        return ESMapping(
+            properties=ESMapping(
+                ESString('id')))
+
+
+def make_app(global_config, **settings):
+    Session.remove()
+    Session.configure(bind=create_engine(settings['sqlalchemy.url']))
+    config = Configurator(settings=settings)
+    config.include('pyramid_es')
+    return config.make_wsgi_app()
+
+
+class TestReindexScript(TestCase):
+
+    def setUp(self):
+        memory.reset('reindex')
+        self.dir = tempfile.mkdtemp()
+        self.ini = os.path.join(self.dir, 'test.ini')
+        self.checkpoint = os.path.join(self.dir, 'checkpoint.json')
+        self.url = url = 'sqlite:///' + os.path.join(self.dir, 'test.db')
+        with open(self.ini, 'w') as f:
+            f.write('[app:main]\n'
+                    'use = call:pyramid_es.tests.test_reindex:make_app\n'
+                    'sqlalchemy.url = %s\n'
+                    'elastic.servers = memory://reindex\n'
+                    'elastic.index = reindex_idx\n' % url)
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add_all([Task(id=ii, title='Task %d' % ii)
+                         for ii in range(1, 26)])
+        session.add_all([Tag(id='red'), Tag(id='blue')])
+        session.commit()
+        session.close()
+        engine.dispose()
+
+    def tearDown(self):
+        Session.remove()
+        shutil.rmtree(self.dir)
+
+    def run_script(self, *args):
+        return reindex.main([self.ini,
+                             '--base', 'pyramid_es.tests.test_reindex.Base',
+                             '--session',
+                             'pyramid_es.tests.test_reindex.Session',
+                             '--range-size', '10',
+                             '--checkpoint', self.checkpoint] + list(args))
+
+    def patch_index_range(self, failing):
+        """
+        Make index_range() report the documents of the ranges in ``failing``
+        as failed. Returns the list of the ranges it is called for.
+        """
+        index_range = reindex.index_range
+        calls = []
+
+        def patched(task):
+            key = reindex.task_key(task)
+            calls.append(key)
+            task, succeeded, failed = index_range(task)
+            if key in failing:
+                return task, 0, succeeded + failed
+            return task, succeeded, failed
+        reindex.index_range = patched
+        self.addCleanup(setattr, reindex, 'index_range', index_range)
+        return calls
+
+    def indexed(self, doc_type):
+        es = memory.MemoryElasticsearch('memory://reindex')
+        es.indices.refresh(index='reindex_idx')
+        resp = es.search(index='reindex_idx', doc_type=doc_type, size=100)
+        return sorted(hit['_id'] for hit in resp['hits']['hits'])
+
+    def test_plan(self):
+        session = sessionmaker(bind=create_engine(
+            'sqlite:///' + os.path.join(self.dir, 'test.db')))()
+        tasks = reindex.plan(session, [Task, Tag], 10)
+        session.close()
+        self.assertEqual(tasks, [
+            ('pyramid_es.tests.test_reindex:Task', 0, 10),
+            ('pyramid_es.tests.test_reindex:Task', 10, 20),
+            ('pyramid_es.tests.test_reindex:Task', 20, 30),
+            ('pyramid_es.tests.test_reindex:Tag', None, None),
+        ])
+
+    def test_reindex(self):
+        self.assertEqual(self.run_script('--processes', '1'), 0)
+        self.assertEqual(len(self.indexed('Task')), 25)
+        self.assertEqual(self.indexed('Tag'), ['blue', 'red'])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_from_checkpoint(self):
+        reindex.save_checkpoint(self.checkpoint, 'reindex_idx', {
+            'pyramid_es.tests.test_reindex:Task[0:10]': [9, 0],
+            'pyramid_es.tests.test_reindex:Tag[:]': [2, 0],
+        })
+        self.assertEqual(self.run_script('--processes', '1'), 0)
+        self.assertEqual(self.indexed('Task'),
+                         sorted('%d' % ii for ii in range(10, 26)))
+        self.assertEqual(self.indexed('Tag'), [])
+
+    def test_failed_ranges_are_retried(self):
+        key = 'pyramid_es.tests.test_reindex:Task[10:20]'
+        failing = set([key])
+        calls = self.patch_index_range(failing)
+        self.assertEqual(self.run_script('--processes', '1'), 1)
+        done, target = reindex.load_checkpoint(self.checkpoint, 'reindex_idx')
+        self.assertEqual(done[key], [0, 10])
+        self.assertEqual(len(done), 4)
+
+        del calls[:]
+        self.assertEqual(self.run_script('--processes', '1'), 1)
+        self.assertEqual(calls, [key])
+
+        failing.clear()
+        del calls[:]
+        self.assertEqual(self.run_script('--processes', '1'), 0)
+        self.assertEqual(calls, [key])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def delete_tasks(self, *ids):
+        engine = create_engine(self.url)
+        session = sessionmaker(bind=engine)()
+        session.query(Task).filter(Task.id.in_(ids)).delete(
+            synchronize_session=False)
+        session.commit()
+        session.close()
+        engine.dispose()
+
+    def test_ranges_stay_when_minimum_changes(self):
+        key = 'pyramid_es.tests.test_reindex:Task[0:10]'
+        failing = set([key])
+        calls = self.patch_index_range(failing)
+        self.assertEqual(self.run_script('--processes', '1'), 1)
+
+        self.delete_tasks(1)
+        del calls[:]
+        self.assertEqual(self.run_script('--processes', '1'), 1)
+        self.assertEqual(calls, [key])
+
+        # The failed range is gone: it is dropped from the checkpoint.
+        self.delete_tasks(*range(2, 10))
+        del calls[:]
+        self.assertEqual(self.run_script('--processes', '1'), 0)
+        self.assertEqual(calls, [])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_of_other_index(self):
+        reindex.save_checkpoint(self.checkpoint, 'other_idx', {})
+        with self.assertRaises(ValueError):
+            self.run_script('--processes', '1')
+        self.assertEqual(self.run_script('--processes', '1', '--restart'), 0)
+        self.assertEqual(len(self.indexed('Task')), 25)
+
+    def test_process_pool(self):
+        # Workers index into their own copy of the memory backend: check the
+        # counts they report through the checkpoint.
+        saved = []
+        save_checkpoint = reindex.save_checkpoint
+
+        def record(path, index, done, target=None):
+            saved.append(json.loads(json.dumps(done)))
+            save_checkpoint(path, index, done, target)
+        reindex.save_checkpoint = record
+        try:
+            self.assertEqual(self.run_script('--processes', '2'), 0)
+        finally:
+            reindex.save_checkpoint = save_checkpoint
+        self.assertEqual(sorted(saved[-1].values()),
+                         [[2, 0], [6, 0], [9, 0], [10, 0]])
+
+    def test_swap(self):
+        self.assertEqual(self.run_script('--processes', '1', '--swap'), 0)
+        es = memory.MemoryElasticsearch('memory://reindex')
+        aliased = list(es.indices.get_alias(name='reindex_idx'))
+        self.assertEqual(len(aliased), 1)
+        self.assertTrue(aliased[0].startswith('reindex_idx_'))
+        self.assertEqual(len(self.indexed('Task')), 25)
+
+    def test_no_swap_with_failures(self):
+        failing = set(['pyramid_es.tests.test_reindex:Task[10:20]'])
+        self.patch_index_range(failing)
+        es = memory.MemoryElasticsearch('memory://reindex')
+        self.assertEqual(self.run_script('--processes', '1', '--swap'), 1)
+        # Resuming retries the failed range, which fails again.
+        self.assertEqual(self.run_script('--processes', '1', '--swap'), 1)
+        self.assertFalse(es.indices.exists_alias(name='reindex_idx'))
+
+        failing.clear()
+        self.assertEqual(self.run_script('--processes', '1', '--swap'), 0)
+        self.assertEqual(len(es.indices.get_alias(name='reindex_idx')), 1)
+        self.assertEqual(len(self.indexed('Task')), 25)
+
+    def test_swap_resumes_version(self):
+        es = memory.MemoryElasticsearch('memory://reindex')
+        es.indices.create('reindex_idx_1')
+        reindex.save_checkpoint(self.checkpoint, 'reindex_idx', {
+            'pyramid_es.tests.test_reindex:Tag[:]': [2, 0],
+        }, 'reindex_idx_1')
+        self.assertEqual(self.run_script('--processes', '1', '--swap'), 0)
+        self.assertEqual(list(es.indices.get_alias(name='reindex_idx')),
+                         ['reindex_idx_1'])
+        self.assertEqual(len(self.indexed('Task')), 25)
+        self.assertEqual(self.indexed('Tag'), [])
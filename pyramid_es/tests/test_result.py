@@ -2,7 +2,8 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 from unittest import TestCase
 
-from ..result import ElasticResult, ElasticResultRecord
+from ..result import (ElasticResult, ElasticResultRecord, encode_cursor,
+                      decode_cursor)
 
 
 sample_record1 = {
@@ -72,6 +73,14 @@ class TestResult(TestCase):
         result = self._make_result()
         self.assertIn('total:2', repr(result))
 
+    def test_result_cursor_unsorted(self):
+        result = self._make_result()
+        self.assertIsNone(result.cursor)
+
+    def test_cursor_roundtrip(self):
+        values = [1955, u'Movie#Vertigo']
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+
 
 class TestResultRecord(TestCase):
 
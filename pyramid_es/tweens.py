@@ -0,0 +1,42 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+from pyramid.settings import asbool
+
+
+def request_scope_tween_factory(handler, registry):
+    """
+    Tween which memoizes the documents fetched and the searches run through
+    the registered client for the duration of each request. See
+    :py:meth:`.client.ElasticClient.request_scope`.
+    """
+    client = registry.pyramid_es_client
+
+    def request_scope_tween(request):
+        with client.request_scope():
+            return handler(request)
+
+    return request_scope_tween
+
+
+def instrument_tween_factory(handler, registry):
+    """
+    Tween which records the requests made through the registered client
+    during each request, including the writes sent when the transaction
+    commits. The :py:class:`.instrument.ElasticRecorder` is available as
+    ``request.elastic_recorder``, and unless the ``elastic.instrument_headers``
+    setting is false, its totals are added to the response headers. See
+    :py:meth:`.client.ElasticClient.instrument`.
+    """
+    client = registry.pyramid_es_client
+    headers = asbool(registry.settings.get('elastic.instrument_headers',
+                                           True))
+
+    def instrument_tween(request):
+        with client.instrument() as recorder:
+            request.elastic_recorder = recorder
+            response = handler(request)
+        if headers:
+            response.headers.update(recorder.headers())
+        return response
+
+    return instrument_tween
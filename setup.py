@@ -24,12 +24,21 @@ setup(name='pyramid_es',
           'pyramid>=1.4',
           'pyramid_tm',
           'transaction',
-          'sqlalchemy>=0.8',
+          'sqlalchemy>=1.4',
           'six>=1.5.2',
           'elasticsearch',
       ],
       license='MIT',
       packages=find_packages(),
+      package_data={'pyramid_es': ['templates/*.dbtmako']},
+      extras_require={'debugtoolbar': ['pyramid_debugtoolbar']},
+      entry_points={
+          'console_scripts': [
+              'pyramid_es_ensure = pyramid_es.scripts.ensure:main',
+              'pyramid_es_outbox = pyramid_es.scripts.outbox:main',
+              'pyramid_es_reindex = pyramid_es.scripts.reindex:main',
+          ],
+      },
       test_suite='nose.collector',
       tests_require=['nose', 'webtest'],
       zip_safe=False)